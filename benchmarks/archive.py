@@ -0,0 +1,128 @@
+"""
+Generate a synthetic PP/AN archive with the layout expected by esm4ppe.organization, for
+benchmarking without access to the real GFDL archive.
+
+The tree under [rootdir] contains the control and one pp directory per ensemble member:
+    rootdir/<configid>/<prod>/pp/<ppname>/<ppname>.static.nc
+    rootdir/<configid>/<prod>/pp/<ppname>/ts/<frequency>/<N>yr/<ppname>.<start>-<end>.<variable>.nc
+with "time_bnds" in every file and the ensemble member encoded in the "title" attribute.
+"""
+
+import os
+import datetime
+import numpy as np
+import xarray as xr
+import cftime
+
+from esm4ppe.version import sysconfig
+from esm4ppe.organization import get_configid, get_pp
+
+# Number of time steps per year, and the date format in the filename, for each frequency
+_timesteps = {'monthly':12,'daily':365,'annual':1}
+_datefmt = {'monthly':'{:04d}{:02d}','daily':'{:04d}{:02d}01','annual':'{:04d}'}
+
+def set_sysconfig(basedir):
+    """
+    Point sysconfig at a synthetic archive and working directories under [basedir],
+    creating the working directories.
+    """
+    sysconfig['os'] = 'synthetic'
+    sysconfig['rootdir'] = '/'.join([basedir,'archive'])
+    for key in ['zarrpathroot','verifypathroot','correlationpathroot','regionalmeanpathroot',
+                'climatologypathroot','otherpathroot','cachepathroot']:
+        sysconfig[key] = '/'.join([basedir,'work',key.replace('pathroot','')])
+        os.makedirs(sysconfig[key],exist_ok=True)
+    return sysconfig
+
+def make_static(ny=90,nx=144,landfraction=0.3,seed=0):
+    """
+    Return a static grid dataset with geolon, geolat, areacello, wet and basin codes.
+    """
+    rng = np.random.default_rng(seed)
+    yh = np.linspace(-89,89,ny)
+    xh = np.linspace(-299,59,nx)
+    geolon,geolat = np.meshgrid(xh,yh)
+    wet = (rng.random((ny,nx))>landfraction)
+    # Basin codes: 0 land, 1 southern, 2 atlantic, 3 pacific, 4 arctic, 5 indian
+    basin = np.where(geolat<-35,1,np.where(geolon<-68,3,np.where(geolon<20,2,5)))
+    basin = np.where(geolat>65,4,basin)
+    basin = np.where(wet,basin,0)
+    areacello = np.cos(np.deg2rad(geolat))*wet
+    static = xr.Dataset({'geolon':(('yh','xh'),geolon),
+                         'geolat':(('yh','xh'),geolat),
+                         'areacello':(('yh','xh'),areacello),
+                         'wet':(('yh','xh'),wet.astype('f4')),
+                         'basin':(('yh','xh'),basin.astype('i4'),
+                                  {'flag_values':'0 1 2 3 4 5',
+                                   'flag_meanings':('global_land southern_ocean atlantic_ocean '
+                                                    'pacific_ocean arctic_ocean indian_ocean')})},
+                        coords={'yh':yh,'xh':xh})
+    return static
+
+def _get_time(startyear,startmonth,nyears,frequency):
+    """
+    Return time and time_bnds for [nyears] starting at [startyear],[startmonth].
+    """
+    nt = nyears*_timesteps[frequency]
+    if frequency=='monthly':
+        bnds = [cftime.DatetimeNoLeap(startyear+(startmonth-1+i)//12,(startmonth-1+i)%12+1,1)
+                for i in range(nt+1)]
+    elif frequency=='daily':
+        start = cftime.DatetimeNoLeap(startyear,startmonth,1)
+        bnds = [start+datetime.timedelta(days=i) for i in range(nt+1)]
+    elif frequency=='annual':
+        bnds = [cftime.DatetimeNoLeap(startyear+i,startmonth,1) for i in range(nt+1)]
+    time = [bnds[i]+(bnds[i+1]-bnds[i])/2 for i in range(nt)]
+    return time,np.array([bnds[:-1],bnds[1:]]).T
+
+def _write_timeseries(pp,ppname,variable,frequency,startyear,startmonth,nyears,filelength,static,title,rng):
+    """
+    Write [nyears] of synthetic [variable] in files of [filelength] years under [pp].
+    """
+    ts = '/'.join([pp,ppname,'ts',frequency,str(filelength)+'yr'])
+    os.makedirs(ts,exist_ok=True)
+    land = static['wet'].values==0
+    for y0 in range(0,nyears,filelength):
+        ny = min(filelength,nyears-y0)
+        time,time_bnds = _get_time(startyear+y0,startmonth,ny,frequency)
+        t = np.arange(len(time))/_timesteps[frequency]
+        data = (np.sin(2*np.pi*t)[:,np.newaxis,np.newaxis]
+                +rng.standard_normal((len(time),)+land.shape)).astype('f4')
+        data[:,land] = np.nan
+        ds = xr.Dataset({variable:(('time','yh','xh'),data),
+                         'time_bnds':(('time','nv'),time_bnds)},
+                        coords={'time':time,'yh':static['yh'],'xh':static['xh'],'nv':[1,2]},
+                        attrs={'title':title})
+        fmt = _datefmt[frequency]
+        end = time_bnds[-1,0]
+        daterange = '-'.join([fmt.format(startyear+y0,startmonth),fmt.format(end.year,end.month)])
+        ds.to_netcdf('/'.join([ts,'.'.join([ppname,daterange,variable,'nc'])]))
+
+def make_archive(variables=['tos'],frequency='monthly',ny=90,nx=144,startyears=[123,133],
+                 startmonths=[1],members=[1,2,3],nyears=10,filelength=5,ppname=None,seed=0):
+    """
+    Write a synthetic archive under sysconfig['rootdir'] (see set_sysconfig). The control
+    spans every initialization plus [nyears]; members initialized in January run for
+    [nyears] and others for 3/10 of that, as in the ESM4 PPE.
+    """
+    rng = np.random.default_rng(seed)
+    if ppname is None:
+        ppname = '_'.join(['ocean',frequency])
+    static = make_static(ny,nx,seed=seed)
+    # Control
+    pps = [(get_pp(),get_configid(),min(startyears),1,max(startyears)+nyears-min(startyears)+1)]
+    # Ensemble members
+    for startyear in startyears:
+        for startmonth in startmonths:
+            nyearsinit = nyears if startmonth==1 else max(1,int(3*nyears/10))
+            for member in members:
+                pps.append((get_pp(startyear,startmonth,member),
+                            get_configid(startyear,startmonth,member),
+                            startyear,startmonth,nyearsinit))
+    for pp,title,startyear,startmonth,nyearsrun in pps:
+        os.makedirs('/'.join([pp,ppname]),exist_ok=True)
+        static.to_netcdf('/'.join([pp,ppname,ppname+'.static.nc']))
+        for variable in variables:
+            _write_timeseries(pp,ppname,variable,frequency,startyear,startmonth,nyearsrun,
+                              filelength,static,title,rng)
+    return static
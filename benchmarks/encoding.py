@@ -0,0 +1,90 @@
+"""
+Benchmark of the zarr encoding profiles (see esm4ppe.encoding) on a synthetic archive.
+
+For each profile the control and ensemble are written to their own zarr stores, and the
+compression ratio (uncompressed bytes / bytes on disk), write and read throughput, and the
+largest error relative to the source are reported. Usage:
+    python benchmarks/encoding.py --basedir /tmp/esm4ppe_bench --profiles default fast compact
+Requires gfdl_utils.
+"""
+
+import argparse
+import json
+import os
+import time
+
+from archive import set_sysconfig, make_archive
+
+def get_storebytes(path):
+    """
+    Return the number of bytes on disk under [path].
+    """
+    nbytes = 0
+    for root,dirs,files in os.walk(path):
+        nbytes += sum(os.path.getsize(os.path.join(root,f)) for f in files)
+    return nbytes
+
+def run(basedir,profiles=['none','default','float32','fast','compact'],variable='tos',frequency='monthly',
+        ny=90,nx=144,startyears=[123,133],members=[1,2,3],nyears=10,generate=True):
+    """
+    Generate the synthetic archive (if [generate]), write the control and ensemble with each
+    of [profiles] and return a dictionary of results for each profile and dataset.
+    """
+    sysconfig = set_sysconfig(basedir)
+    zarrpathroot = sysconfig['zarrpathroot']
+    import numpy as np
+    import xarray as xr
+    import esm4ppe
+    if generate:
+        make_archive([variable],frequency,ny,nx,startyears,[1],members,nyears)
+    source = {'control':esm4ppe.open_control(variable,frequency)[variable].load(),
+              'ensemble':esm4ppe.open_ensemble(variable,frequency)[variable].load()}
+    results = {}
+    for profile in profiles:
+        sysconfig['encodingprofile'] = profile
+        sysconfig['zarrpathroot'] = '/'.join([zarrpathroot+'_encoding',profile])
+        es = esm4ppe.esm4ppeObj(variable,frequency)
+        results[profile] = {}
+        for dataset in ['control','ensemble']:
+            path = esm4ppe.get_zarrpath(variable,frequency,dataset)
+            if os.path.exists('/'.join([path,variable])):
+                esm4ppe.delete_zarrvariable(variable,frequency,dataset,check=False)
+            start = time.time()
+            if dataset=='control':
+                es.add_control(write=True,check=False)
+            else:
+                es.add_ensemble(write=True,check=False)
+            write = time.time()-start
+            start = time.time()
+            data = xr.open_zarr(path)[variable].load()
+            read = time.time()-start
+            nbytes = data.size*source[dataset].dtype.itemsize
+            ref = source[dataset].transpose(*data.dims)
+            error = float(np.nanmax(np.abs(data.values-ref.values)))
+            results[profile][dataset] = {'ratio':round(nbytes/get_storebytes('/'.join([path,variable])),2),
+                                         'write_MBps':round(nbytes/1e6/write,1),
+                                         'read_MBps':round(nbytes/1e6/read,1),
+                                         'maxerror':error}
+            print(profile,dataset,results[profile][dataset])
+    sysconfig['zarrpathroot'] = zarrpathroot
+    return results
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark the zarr encoding profiles.")
+    parser.add_argument('--basedir',required=True,help="directory for the archive and outputs")
+    parser.add_argument('--profiles',nargs='+',default=['none','default','float32','fast','compact'])
+    parser.add_argument('--variable',default='tos')
+    parser.add_argument('--frequency',default='monthly')
+    parser.add_argument('--ny',type=int,default=90)
+    parser.add_argument('--nx',type=int,default=144)
+    parser.add_argument('--nogenerate',action='store_true',help="reuse an existing archive")
+    parser.add_argument('--output',default=None,help="write results to this json file")
+    args = parser.parse_args(args)
+    results = run(args.basedir,args.profiles,args.variable,args.frequency,args.ny,args.nx,
+                  generate=not args.nogenerate)
+    if args.output is not None:
+        with open(args.output,'w') as f:
+            json.dump(results,f,indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+End-to-end benchmarks of esm4ppe on a synthetic archive.
+
+Each stage is timed for wall-clock, peak (traced) memory and bytes read from disk:
+ingestion of the ensemble and control to zarr, regional means, PPP, a climpred skill
+metric and the climatology. Usage:
+    python benchmarks/run.py --basedir /tmp/esm4ppe_bench --ny 180 --nx 288 --members 1 2 3 4 5
+Requires gfdl_utils (and climpred for the skill metric).
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+
+from archive import set_sysconfig, make_archive
+
+def get_bytesread():
+    """
+    Return the number of bytes read by this process, or None if not available.
+    """
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+def measure(name,fn,results):
+    """
+    Run [fn], recording its wall-clock time, peak memory and bytes read under [name].
+    """
+    print(name+"...",end=" ")
+    read0 = get_bytesread()
+    tracemalloc.start()
+    start = time.time()
+    out = fn()
+    end = time.time()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    read1 = get_bytesread()
+    results[name] = {'seconds':round(end-start,3),
+                     'peakmemory_MB':round(peak/1e6,1),
+                     'read_MB':None if read0 is None else round((read1-read0)/1e6,1)}
+    print(results[name])
+    return out
+
+def run(basedir,variable='tos',frequency='monthly',ny=90,nx=144,startyears=[123,133],
+        startmonths=[1],members=[1,2,3],nyears=10,masksname='basin',metric='acc',generate=True):
+    """
+    Generate the synthetic archive (if [generate]) and time each stage of processing.
+    Return a dictionary of results for each stage.
+    """
+    set_sysconfig(basedir)
+    import esm4ppe
+    results = {}
+    if generate:
+        measure('generate',lambda: make_archive([variable],frequency,ny,nx,startyears,
+                                                startmonths,members,nyears),results)
+    es = measure('construct',lambda: esm4ppe.esm4ppeObj(variable,frequency),results)
+    measure('ingest_ensemble',lambda: es.add_ensemble(write=True,check=False,incremental=True),results)
+    measure('ingest_control',lambda: es.add_control(write=True,check=False),results)
+    measure('verify_ppp',lambda: es.verify('ppp',cache=False,groupby='month').vs.load(),results)
+    try:
+        import climpred
+        measure('verify_'+metric,
+                lambda: es.verify(metric,cache=False,comparison='m2e',dim=['init','member']).vs.load(),results)
+    except ImportError:
+        print("climpred not available: skipping verify_"+metric)
+    measure('regionalmean',
+            lambda: es.regionalmean(masksname,omit=['vs'],cache=False).ensemble.load(),results)
+    es = esm4ppe.esm4ppeObj(variable,frequency).add_control()
+    measure('climatology',lambda: es.climatology(saveclimatology=False,cache=False).control.load(),results)
+    return results
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark esm4ppe on a synthetic archive.")
+    parser.add_argument('--basedir',required=True,help="directory for the archive and outputs")
+    parser.add_argument('--variable',default='tos')
+    parser.add_argument('--frequency',default='monthly')
+    parser.add_argument('--ny',type=int,default=90)
+    parser.add_argument('--nx',type=int,default=144)
+    parser.add_argument('--startyears',type=int,nargs='+',default=[123,133])
+    parser.add_argument('--startmonths',type=int,nargs='+',default=[1])
+    parser.add_argument('--members',type=int,nargs='+',default=[1,2,3])
+    parser.add_argument('--nyears',type=int,default=10)
+    parser.add_argument('--nogenerate',action='store_true',help="reuse an existing archive")
+    parser.add_argument('--output',default=None,help="write results to this json file")
+    args = parser.parse_args(args)
+    results = run(args.basedir,args.variable,args.frequency,args.ny,args.nx,args.startyears,
+                  args.startmonths,args.members,args.nyears,generate=not args.nogenerate)
+    if args.output is not None:
+        with open(args.output,'w') as f:
+            json.dump(results,f,indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,43 @@
+import importlib as _importlib
+import types as _types
+
 from .version import __version__, sysconfig
-from .classes import *
-from .organization import *
-from .calculations import *
-from .processing import *
-from .utils import *
-from .masks import *
+from .utils import _LazyModule
+
+# Submodules are imported on first access to one of their attributes, so that
+# `import esm4ppe` does not pull in xarray, dask, climpred or gfdl_utils. Names are
+# looked up in this order, from the lightest submodule to the heaviest.
+_submodules = ['organization','utils','cache','catalog','encoding','masks','moments','calculations',
+               'recallmanager','processing','virtual','chunking','correlation','pyramid','classes']
+# Submodules that are available as attributes but whose contents are not exported
+_othersubmodules = ['pipeline','version']
+
+def _get_public(module):
+    # Names defined in the submodule, leaving out modules (lazy or not) and names it imports
+    public = {}
+    for name,attr in vars(module).items():
+        if name.startswith('_') or isinstance(attr,(_types.ModuleType,_LazyModule)):
+            continue
+        if getattr(attr,'__module__',module.__name__)!=module.__name__:
+            continue
+        public[name] = attr
+    return public
+
+def __getattr__(name):
+    if name in _submodules+_othersubmodules:
+        return _importlib.import_module('.'+name,__name__)
+    if name=='__all__':
+        # Support `from esm4ppe import *`
+        names = []
+        for submodule in _submodules:
+            module = _importlib.import_module('.'+submodule,__name__)
+            names += [n for n in _get_public(module) if n not in names]
+        return names+['__version__','sysconfig']
+    if not name.startswith('_'):
+        for submodule in _submodules:
+            module = _importlib.import_module('.'+submodule,__name__)
+            public = _get_public(module)
+            if name in public:
+                globals()[name] = public[name]
+                return public[name]
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__,name))
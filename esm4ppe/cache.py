@@ -0,0 +1,258 @@
+"""
+Collection of functions for a content-addressed cache of derived results.
+
+The results of verify, regionalmean and climatology are stored as netCDF files named by a
+hash of what they were computed from: the identity of the input stores (their zarr metadata,
+ingestion record and write stamp), the parameters of the calculation and the version of the
+cached results (_cacheversion). A
+result is therefore only reused if none of these has changed, and can be shared safely by
+everyone pointing sysconfig at the same working directories. Files are written atomically,
+and the least recently used are evicted once the cache exceeds sysconfig['cachemaxbytes'].
+Results saved under their own names (e.g. with saveskill) record their key, so that they are
+reused once evicted from the cache, and not rewritten while they are current.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import uuid
+import xarray as xr
+
+from esm4ppe.version import sysconfig
+
+# Version of the cached results: increment when a change to the calculations changes their
+# results, so that results computed before it are not reused
+_cacheversion = 1
+
+# Zarr metadata files that identify a store and its variables
+_metadatafiles = ['.zgroup','.zattrs','.zmetadata','.zarray','zarr.json']
+
+_stats = {'hits':0,'misses':0,'writes':0,'evictions':0}
+
+def get_stamppath(path,variable):
+    """
+    Return the path of the write stamp of [variable] in the store at [path] (see stamp_store).
+    """
+    return path.rstrip('/')+'.'+variable+'.stamp'
+
+def stamp_store(path,variable):
+    """
+    Record that [variable] of the store at [path] has been written, so that the identity of
+    the store (see get_storeidentity) changes. Rewriting a region of an array changes none of
+    its metadata, so the writers in this package stamp the store after writing to it.
+    """
+    stamppath = get_stamppath(path,variable)
+    tmppath = stamppath+'.'+str(os.getpid())
+    with open(tmppath,'w') as f:
+        f.write(uuid.uuid4().hex)
+    os.replace(tmppath,stamppath)
+
+def get_storeidentity(path,variable=None):
+    """
+    Return a string identifying the current state of the store at [path].
+
+    For a zarr store, this is a hash of the metadata of each of its arrays (only [variable],
+    if given, since the stores hold many variables), the record of any incremental ingestion
+    (see processing.get_ingestrecordpath) and the write stamp of each array (see 
+    stamp_store), so that it changes when the data are rewritten or extended. The chunks are
+    not examined: a region rewritten by other tools, without a new stamp, is not detected.
+    For a file (e.g. a virtual store index), it is a hash of its size and modification time.
+    Returns None if [path] does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    h = hashlib.sha1(os.path.abspath(path).encode())
+    if os.path.isdir(path):
+        if variable is None:
+            subs = sorted(d for d in os.listdir(path) if os.path.isdir(os.path.join(path,d)))
+        else:
+            subs = [variable]
+        for sub in subs:
+            subpath = os.path.join(path,sub)
+            if not os.path.exists(subpath):
+                return None
+            for filepath in ([os.path.join(subpath,name) for name in _metadatafiles]+
+                             [path.rstrip('/')+'.'+sub+'.ingest.json',get_stamppath(path,sub)]):
+                if os.path.exists(filepath):
+                    h.update(filepath.encode())
+                    with open(filepath,'rb') as f:
+                        h.update(f.read())
+    else:
+        stat = os.stat(path)
+        h.update(str((stat.st_size,stat.st_mtime_ns)).encode())
+    return h.hexdigest()
+
+def get_cachekey(kind,inputs,params):
+    """
+    Return the cache key for a result of [kind] ('verify', 'regionalmean', 'climatology')
+    computed from [inputs] (a list of store identities or cache keys) with [params] (a
+    json-serializable dictionary). Returns None if any of the inputs is unidentified, in
+    which case the result should not be cached.
+    """
+    if any(i is None for i in inputs):
+        return None
+    description = {'kind':kind,'inputs':list(inputs),'params':params,
+                   'version':_cacheversion}
+    return hashlib.sha1(json.dumps(description,sort_keys=True,default=str).encode()).hexdigest()
+
+def get_cachepath(kind,key):
+    """
+    Return the path of the cached result of [kind] with [key].
+    """
+    return '/'.join([sysconfig['cachepathroot'],kind,key+'.nc'])
+
+def read_cache(kind,key):
+    """
+    Open the cached result of [kind] with [key], or return None if it is not in the cache.
+    A cached file that cannot be opened is removed and counted as a miss.
+    """
+    if key is None:
+        return None
+    path = get_cachepath(kind,key)
+    if not os.path.exists(path):
+        _stats['misses'] += 1
+        return None
+    try:
+        ds = xr.open_dataset(path)
+    except (OSError,ValueError):
+        print("Removing unreadable cache file "+path+".")
+        _remove(path)
+        _stats['misses'] += 1
+        return None
+    # Mark as recently used for eviction
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    _stats['hits'] += 1
+    return ds
+
+def to_netcdf_atomic(ds,path):
+    """
+    Write [ds] to netCDF at [path] via a temporary file, so that [path] is either absent or
+    complete for concurrent readers.
+    """
+    os.makedirs(os.path.dirname(path),exist_ok=True)
+    tmppath = path+'.'+str(os.getpid())
+    try:
+        ds.to_netcdf(tmppath)
+        os.replace(tmppath,path)
+    finally:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+
+def write_cache(kind,key,ds,params=None):
+    """
+    Compute and write [ds] to the cache under [kind] and [key], evict the least recently used
+    results if the cache is over its size limit, and return the cached result. The [params]
+    are recorded in the attributes of the file. If [key] is None, [ds] is returned unchanged.
+    """
+    if key is None:
+        return ds
+    ds = ds.copy()
+    ds.attrs['esm4ppe_cache'] = json.dumps({'kind':kind,'key':key,'params':params},default=str)
+    path = get_cachepath(kind,key)
+    to_netcdf_atomic(ds,path)
+    _stats['writes'] += 1
+    evict_cache(keep=[path])
+    return xr.open_dataset(path)
+
+def get_resultkey(ds):
+    """
+    Return the cache key recorded in the attributes of [ds] (see write_cache), or None.
+    """
+    record = ds.attrs.get('esm4ppe_cache')
+    if record is None:
+        return None
+    return json.loads(record).get('key')
+
+def get_savedkey(path):
+    """
+    Return the cache key recorded in the result saved at [path], '' if it was saved without
+    one (e.g. before the cache existed), or None if there is no readable file at [path].
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with xr.open_dataset(path) as ds:
+            return get_resultkey(ds) or ''
+    except (OSError,ValueError):
+        return None
+
+def read_saved(path,key):
+    """
+    Open the result saved at [path] (e.g. with catalog.save_product) if it was computed with
+    [key], or saved without a key, and return None otherwise or if [key] is None.
+    """
+    if key is None:
+        return None
+    if get_savedkey(path) in [key,'']:
+        return xr.open_dataset(path)
+    return None
+
+def is_saved(ds,path):
+    """
+    Return True if [ds] is already saved at [path]: it was opened from [path], or it carries
+    a cache key (see write_cache) that is recorded in the file at [path].
+    """
+    if os.path.abspath(ds.encoding.get('source','')) == os.path.abspath(path):
+        return True
+    key = get_resultkey(ds)
+    return (key is not None) and (get_savedkey(path)==key)
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        # Removed by another process
+        return False
+
+def _list_cache():
+    files = []
+    for path in glob.glob('/'.join([sysconfig['cachepathroot'],'*','*.nc'])):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime,stat.st_size,path))
+    return files
+
+def evict_cache(maxbytes=None,keep=[]):
+    """
+    Remove the least recently used results, other than those at the paths in [keep], until
+    the cache is no larger than [maxbytes] (default sysconfig['cachemaxbytes']). Returns the
+    number of files removed.
+    """
+    if maxbytes is None:
+        maxbytes = sysconfig['cachemaxbytes']
+    files = sorted(_list_cache())
+    nbytes = sum(f[1] for f in files)
+    nremoved = 0
+    for mtime,size,path in files:
+        if nbytes<=maxbytes:
+            break
+        if path in keep:
+            continue
+        if _remove(path):
+            nremoved += 1
+        nbytes -= size
+    _stats['evictions'] += nremoved
+    return nremoved
+
+def clear_cache(kind=None):
+    """
+    Remove all cached results, or only those of [kind].
+    """
+    for mtime,size,path in _list_cache():
+        if (kind is None) or (path.split('/')[-2]==kind):
+            _remove(path)
+
+def get_cachestats():
+    """
+    Return the hits, misses, writes and evictions of this session, and the number of files
+    and bytes currently in the cache.
+    """
+    files = _list_cache()
+    return dict(_stats,nfiles=len(files),nbytes=sum(f[1] for f in files))
@@ -4,21 +4,31 @@ Collection of calculations for operating on ESM4 PPE simulations.
 
 from esm4ppe.version import sysconfig
 from esm4ppe.utils import *
+from esm4ppe.moments import calc_variance, calc_climatologicalvariance, calc_climatologicalmean
+from esm4ppe.masks import build_maskindex
 
 import xarray as xr
 import numpy as np
-from dask.diagnostics import ProgressBar
+
+sparse = lazy_import('scipy.sparse')
 
 def calc_ensemblevariance(ds,groupby=None):
     """
     Calculate the mean ensemble variance. groupby refers to grouping the initializations,
-    and the mean is taken for each group separately.
+    and the mean is taken for each group separately. The variance across members is
+    calculated in a single pass with streaming moments.
+    """
+    evar = calc_variance(ds,'member')
+    return _group_inits(evar,groupby)
+
+def _group_inits(da,groupby=None):
+    """
+    Average [da] over the initializations, or over each group of initializations.
     """
-    evar = (ds.std(dim='member'))**2
     if groupby is not None:
-        return evar.groupby('init.'+groupby).mean()
+        return da.groupby('init.'+groupby).mean()
     else:
-        return evar.mean('init')
+        return da.mean('init')
 
 def calc_controlvariance(control,frequency,nlead):
     """
@@ -27,62 +37,528 @@ def calc_controlvariance(control,frequency,nlead):
     The variance is propagated so that its length in "time" or "lead" is the same as that of
     the ensemble (given by nlead). So a monthly climatology would be repeated nlead/12 times.
     """
+    return calc_controlvariance_initmonth(control,frequency,nlead,[1]).isel(month=0,drop=True)
+
+def get_climatologygroup(frequency):
+    """
+    Return the name of the climatological grouping of the control for the given frequency.
+    """
     if frequency=='monthly':
-        tmp = (control.groupby('time.month').std()**2)
-        # Broadcast to nlead/12 repeating years
-        montharray = np.tile(tmp['month'].to_numpy(),int(nlead/12))
-        tmp = tmp.sel(month=montharray).rename({'month':'lead'})
-        cvar = tmp.assign_coords({'lead':np.arange(1,nlead+1)})
+        return 'month'
+    elif frequency=='daily':
+        return 'dayofyear'
     elif frequency=='annual':
-        tmp = (control.std('time')**2).expand_dims({'lead':1})
-        tmp = tmp.isel(time=[0]*n)
-        cvar = tmp.assign_coords({'lead':np.arange(1,nlead+1)})
-    return cvar
-        
+        return None
+
+def get_climatologyindex(initmonths,frequency,nlead):
+    """
+    Return a (month, lead) DataArray giving, for ensembles initialized in each of [initmonths],
+    the climatological group (month or dayofyear) of the control that corresponds to each lead.
+    """
+    initmonths = np.array(initmonths)
+    lead = np.arange(nlead)
+    if frequency=='monthly':
+        index = (initmonths[:,np.newaxis]-1+lead[np.newaxis,:])%12+1
+    elif frequency=='daily':
+        daysbeforemonth = np.cumsum([0,31,28,31,30,31,30,31,31,30,31,30])
+        index = (daysbeforemonth[initmonths-1][:,np.newaxis]+lead[np.newaxis,:])%365+1
+    return xr.DataArray(index,dims=['month','lead'],
+                        coords={'month':initmonths,'lead':np.arange(1,nlead+1)})
+
+def calc_controlvariance_initmonth(control,frequency,nlead,initmonths):
+    """
+    Calculate the climatological variance of the control, aligned with the leads of ensembles
+    initialized in each of [initmonths]. Return a DataArray with dimensions (month, lead, ...).
+    The alignment is a single gather from the climatology, using get_climatologyindex.
+    """
+    group = get_climatologygroup(frequency)
+    cvar = calc_climatologicalvariance(control,frequency)
+    if group is None:
+        return cvar.expand_dims({'month':list(initmonths),'lead':np.arange(1,nlead+1)})
+    index = get_climatologyindex(initmonths,frequency,nlead).rename({'month':'initmonth'})
+    cvar = cvar.sel({group:index}).drop_vars(group)
+    return cvar.rename({'initmonth':'month'})
+
 def calc_ppp(ds,control,groupby,frequency,nlead):
     """
     Calculate the potential prognostic predictability.
     
     If groupby is specified, it refers to grouping the ensemble variance by its initialization 
-    month. In this case, the control variance has to be expanded to include a 'groupby' 
-    dimension and then shifted to match the appropriate months.
+    (e.g. groupby='month'). The control variance is aligned with the leads of each 
+    initialization month and grouped in the same way as the ensemble variance. If groupby
+    is None, the control variance is averaged over all initializations.
     """
     # Ensemble variance
     evarmean = calc_ensemblevariance(ds,groupby)
-
     # Control variance
-    cvar = calc_controlvariance(control,frequency,nlead)
-    # If necessary, shift control variance to align with init month
-    if groupby=='month':
-        cvar_month = cvar.expand_dims({'month':evarmean['month']})
-        for m in cvar_month['month'].values:
-            cvar_month.loc[{'month':m}]=cvar.roll(lead=-1*(m-1))
+    cvar = calc_pppcontrolvariance(ds,control,groupby,frequency,nlead)
     # PPP
-    ppp = 1-(evarmean/cvar_month)
+    ppp = 1-(evarmean/cvar)
     return ppp
 
-def _calc_regionalmean(da,mask,weights):
-    dims = get_dimensionslesstime(da)
-    return da.where(mask,drop=True).weighted(weights.fillna(0)).mean(dims)
+def calc_pppcontrolvariance(ds,control,groupby,frequency,nlead):
+    """
+    Calculate the control variance for the PPP of the ensemble [ds]: aligned with the leads
+    of each initialization month and grouped in the same way as the ensemble variance.
+    """
+    # Control variance, aligned to each initialization month
+    initmonth = xr.DataArray(ds['init'].dt.month.values,dims=['init'],coords={'init':ds['init']})
+    cvar_month = calc_controlvariance_initmonth(control,frequency,nlead,np.unique(initmonth))
+    if groupby=='month':
+        cvar = cvar_month
+    else:
+        cvar = cvar_month.sel(month=initmonth).drop_vars('month')
+        if groupby is None:
+            cvar = cvar.mean('init')
+        else:
+            cvar = cvar.groupby('init.'+groupby).mean()
+    return cvar
 
-def calc_regionalmean(da,masks,weights,verbose=False):
-    ''' Calculate regional means for [da] based on [masks].
-    Return DataArray with "region" dimension corresponding to masknames.'''
-    dims_out = get_dimensionslessxy(da)
-    coords_out = {}
-    for d in dims_out:
-        coords_out[d] = da.coords[d]
-    coords_out['region']=list(masks.keys())
+# Metrics and perfect-model comparisons available in calc_skill
+skillmetrics = ['acc','pearson_r','mse','rmse','mae','msess','crps','ppp']
+comparisons = ['m2e','e2c','m2c']
+_probabilisticmetrics = ['crps']
+
+def get_comparison(ds,comparison,controlmember=0):
+    """
+    Return the forecast and verification of a perfect-model [comparison], as in climpred:
+    'm2e' each member against the mean of the other members, 'e2c' the mean of the members
+    against the control member, and 'm2c' each member against the control member.
+    """
+    if comparison=='m2e':
+        n = ds.count('member')
+        forecast = (ds.sum('member')-ds)/(n-1)
+        verif = ds
+    elif comparison=='e2c':
+        forecast = ds.drop_sel(member=controlmember).mean('member')
+        verif = ds.sel(member=controlmember,drop=True)
+    elif comparison=='m2c':
+        forecast = ds.drop_sel(member=controlmember)
+        verif = ds.sel(member=controlmember,drop=True)
+    else:
+        raise Exception("Unknown comparison {"+comparison+"}; choose from "+str(comparisons)+".")
+    return forecast,verif
+
+def _sort_member(x):
+    return np.sort(x,axis=-1)
+
+def calc_crps(forecast,verif,dim):
+    """
+    Calculate the continuous ranked probability score of the [forecast] ensemble (with a
+    'member' dimension) against [verif], averaged over [dim]. The mean absolute difference
+    between members is calculated from the sorted members, rather than from every pair.
+    """
+    nmember = forecast.sizes['member']
+    if forecast.chunks:
+        forecast = forecast.chunk({'member':-1})
+    spread = xr.apply_ufunc(_sort_member,forecast,
+                            input_core_dims=[['member']],output_core_dims=[['member']],
+                            dask='parallelized')
+    rank = xr.DataArray(2*np.arange(nmember)-nmember+1,dims=['member'])
+    spread = (spread*rank).sum('member',skipna=False)*2/nmember**2
+    crps = abs(forecast-verif).mean('member',skipna=False)-spread/2
+    return crps.mean([d for d in dim if d!='member'])
+
+def calc_skill(ds,control,metrics,comparison='m2e',dim=['init','member'],groupby=None,frequency=None):
+    """
+    Calculate several skill [metrics] of the ensemble together, returning a dictionary of
+    results keyed by metric. The deterministic metrics share the moments of the forecast and
+    verification of the [comparison] over [dim], so that when the results are computed
+    together (e.g. with dask.compute) the ensemble is traversed once.
+
+    Metrics: 'acc' (or 'pearson_r'), 'mse', 'rmse', 'mae', 'msess' (1-mse/variance of the
+    verification), 'crps' (requires comparison='m2c') and 'ppp' (see calc_ppp, using
+    [groupby] and [frequency]).
+    """
+    unknown = [m for m in metrics if m not in skillmetrics]
+    if len(unknown)>0:
+        raise Exception("Unknown metrics "+str(unknown)+"; choose from "+str(skillmetrics)+".")
+    skill = {}
+    if 'ppp' in metrics:
+        skill['ppp'] = calc_ppp(ds,control,groupby,frequency,len(ds['lead']))
+    deterministic = [m for m in metrics if m not in _probabilisticmetrics+['ppp']]
+    probabilistic = [m for m in metrics if m in _probabilisticmetrics]
+    if len(deterministic+probabilistic)==0:
+        return skill
+    # Accumulate in double precision
+    forecast,verif = get_comparison(ds.astype('float64'),comparison)
+    
+    if len(probabilistic)>0:
+        if comparison!='m2c':
+            raise Exception("Probabilistic metrics "+str(probabilistic)+" require comparison='m2c'.")
+        skill['crps'] = calc_crps(forecast,verif,dim)
     
-    da_out = xr.DataArray(dims=coords_out.keys(),coords=coords_out,name=da.name)
-        
-    for name,mask in masks.items():
-        if verbose:
-            print(name, end = ' ')
-            da_out.loc[{'region':name}] = _calc_regionalmean(da,mask,weights).transpose(*dims_out)
+    if len(deterministic)>0:
+        # Only average over the dimensions of the comparison
+        ddim = [d for d in dim if d in forecast.dims]
+        # Moments over points where both are valid
+        valid = forecast.notnull() & verif.notnull()
+        f = forecast.where(valid)
+        v = verif.where(valid)
+        fmean = f.mean(ddim)
+        vmean = v.mean(ddim)
+        vvar = (v*v).mean(ddim)-vmean**2
+        if ('mse' in deterministic) or ('rmse' in deterministic) or ('msess' in deterministic):
+            mse = ((f-v)**2).mean(ddim)
+        for metric in deterministic:
+            if metric in ['acc','pearson_r']:
+                fvar = (f*f).mean(ddim)-fmean**2
+                cov = (f*v).mean(ddim)-fmean*vmean
+                skill[metric] = cov/np.sqrt(fvar*vvar)
+            elif metric=='mse':
+                skill[metric] = mse
+            elif metric=='rmse':
+                skill[metric] = np.sqrt(mse)
+            elif metric=='mae':
+                skill[metric] = abs(f-v).mean(ddim)
+            elif metric=='msess':
+                skill[metric] = 1-mse/vvar
+    return skill
+
+def get_bootstrapcounts(nmember,iterations,seed=None):
+    """
+    Draw [iterations] resamplings of [nmember] members with replacement, returned as the
+    number of times each member is drawn in each resampling, with shape (iterations, nmember).
+    """
+    rng = np.random.default_rng(seed)
+    index = rng.integers(0,nmember,size=(iterations,nmember))
+    counts = np.zeros((iterations,nmember))
+    np.add.at(counts,(np.arange(iterations)[:,np.newaxis],index),1)
+    return counts
+
+def _centre(x,axis):
+    """
+    Subtract the mean of the valid values of [x] along [axis], to reduce the loss of
+    precision when differencing sums of squares.
+    """
+    x = np.asarray(x,dtype='f8')
+    valid = np.isfinite(x)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        mean = np.where(valid,x,0).sum(axis=axis,keepdims=True)/valid.sum(axis=axis,keepdims=True)
+    return np.where(valid,x-np.where(np.isfinite(mean),mean,0),np.nan)
+
+def _resampled_sums(x,counts):
+    """
+    Return the number of valid members, their sum and their sum of squares, for each of the
+    resamplings in [counts]. The members are on the last axis of [x], which is replaced by
+    the resamplings.
+    """
+    valid = np.isfinite(x)
+    x = np.where(valid,x,0)
+    return valid.astype('f8')@counts.T,x@counts.T,(x**2)@counts.T
+
+def _bootstrap_ensemblevariance(x,counts,batch):
+    """
+    Variance across the members (last axis) of [x] for each resampling in [counts].
+    """
+    x = _centre(x,-1)
+    var = []
+    for start in range(0,counts.shape[0],batch):
+        n,s,q = _resampled_sums(x,counts[start:start+batch])
+        with np.errstate(invalid='ignore',divide='ignore'):
+            var.append(np.where(n>0,q/n-(s/n)**2,np.nan))
+    return np.concatenate(var,axis=-1)
+
+def _bootstrap_acc(x,counts,batch):
+    """
+    Anomaly correlation of each member against the mean of the other members (m2e) over the
+    inits and members (last two axes) of [x], for each resampling of the members in [counts].
+    The sums over forecasts and verifications follow from the resampled sums for each init.
+    """
+    x = _centre(x,(-2,-1))
+    acc = []
+    for start in range(0,counts.shape[0],batch):
+        n,s,q = _resampled_sums(x,counts[start:start+batch])
+        with np.errstate(invalid='ignore',divide='ignore'):
+            # Only inits with at least two members contribute
+            ok = n>1
+            sff = np.where(ok,(n*s**2-2*s**2+q)/(n-1)**2,0).sum(axis=-2)
+            sfv = np.where(ok,(s**2-q)/(n-1),0).sum(axis=-2)
+            n = np.where(ok,n,0).sum(axis=-2)
+            s = np.where(ok,s,0).sum(axis=-2)
+            q = np.where(ok,q,0).sum(axis=-2)
+            cov = sfv/n-(s/n)**2
+            fvar = sff/n-(s/n)**2
+            vvar = q/n-(s/n)**2
+            acc.append(cov/np.sqrt(fvar*vvar))
+    return np.concatenate(acc,axis=-1)
+
+def calc_bootstrap(ds,control,metric,iterations=1000,sig=95,groupby=None,frequency=None,seed=None,batch=100):
+    """
+    Calculate the skill [metric] ('ppp' or 'acc') of the ensemble with its significance,
+    from [iterations] resamplings of the members with replacement. Returned along 'results':
+    'verify' the skill, 'p' the fraction of resamplings with no skill (<=0), and 'low_ci' and
+    'high_ci' the bounds of the [sig]% confidence interval.
+
+    All resamplings are drawn up front (get_bootstrapcounts), so that the sums over members
+    needed for each are obtained by a matrix product, [batch] iterations at a time, in each
+    (spatial) chunk of the ensemble. 'ppp' is as calc_ppp, with [groupby] and [frequency];
+    'acc' is the m2e anomaly correlation over inits and members, as in calc_skill.
+    """
+    if metric=='pearson_r':
+        metric = 'acc'
+    counts = get_bootstrapcounts(ds.sizes['member'],iterations,seed)
+    if ds.chunks:
+        ds = ds.chunk({'member':-1,'init':-1})
+    if metric=='ppp':
+        core = ['member']
+        kernel = _bootstrap_ensemblevariance
+    elif metric=='acc':
+        core = ['init','member']
+        kernel = _bootstrap_acc
+    else:
+        raise Exception("Bootstrap is available for metrics 'ppp' and 'acc', not {"+metric+"}.")
+    bootstrap = xr.apply_ufunc(kernel,ds,
+                               input_core_dims=[core],output_core_dims=[['iteration']],
+                               kwargs={'counts':counts,'batch':batch},
+                               dask='parallelized',output_dtypes=['f8'],
+                               dask_gufunc_kwargs={'output_sizes':{'iteration':iterations}})
+    if metric=='ppp':
+        nlead = len(ds['lead'])
+        skill = calc_ppp(ds,control,groupby,frequency,nlead)
+        bootstrap = 1-_group_inits(bootstrap,groupby)/calc_pppcontrolvariance(ds,control,groupby,frequency,nlead)
+    elif metric=='acc':
+        skill = calc_skill(ds,control,['acc'])['acc']
+    
+    alpha = (100-sig)/200
+    ci = bootstrap.quantile([alpha,1-alpha],dim='iteration')
+    p = (bootstrap<=0).where(bootstrap.notnull()).mean('iteration')
+    results = [skill,p,ci.isel(quantile=0,drop=True),ci.isel(quantile=1,drop=True)]
+    return xr.concat(results,dim='results',coords='minimal',compat='override').assign_coords(
+        {'results':['verify','p','low_ci','high_ci']})
+
+# Reductions of skill over lead available in calc_leadsummary
+leadsummaries = ['horizon','integrated','efolding']
+
+def calc_horizon(skill,threshold,dim='lead'):
+    """
+    Calculate the predictability horizon: the number of leads before [skill] first falls
+    below [threshold] (a number, or an array without [dim] that broadcasts against skill).
+    Points where skill never falls below the threshold are given the number of leads.
+    The first crossing is found with an argmax, which dask reduces chunk by chunk.
+    """
+    below = skill<threshold
+    horizon = below.argmax(dim).where(below.any(dim),skill.sizes[dim])
+    return horizon.where(skill.notnull().any(dim))
+
+def calc_efoldingtime(skill,dim='lead'):
+    """
+    Calculate the e-folding time of [skill]: the number of leads before it first falls
+    below 1/e of its value at the first lead.
+    """
+    return calc_horizon(skill,skill.isel({dim:0},drop=True)/np.e,dim)
+
+def calc_integratedskill(skill,dim='lead'):
+    """
+    Calculate the sum of the positive [skill] over leads.
+    """
+    return skill.clip(min=0).sum(dim,min_count=1)
+
+def calc_leadsummary(skill,summaries=leadsummaries,threshold=0.5,dim='lead'):
+    """
+    Reduce [skill] over [dim] to each of [summaries] ('horizon', with [threshold],
+    'integrated' and 'efolding'; a single one may be given as a string), returned along the
+    dimension 'summary'. If [skill] is lazy, so is the result, so that the reductions are
+    computed in the same pass as the skill and the full skill field is never held.
+    """
+    if isinstance(summaries,str):
+        summaries = [summaries]
+    reduced = []
+    for summary in summaries:
+        if summary=='horizon':
+            reduced.append(calc_horizon(skill,threshold,dim))
+        elif summary=='efolding':
+            reduced.append(calc_efoldingtime(skill,dim))
+        elif summary=='integrated':
+            reduced.append(calc_integratedskill(skill,dim))
         else:
-            da_out.loc[{'region':name}] = _calc_regionalmean(da,mask,weights).transpose(*dims_out)
-    return da_out
+            raise Exception("Unknown lead summary {"+summary+"}; choose from "+str(leadsummaries)+".")
+    reduced = [r.astype('f8') for r in reduced]
+    return xr.concat(reduced,dim='summary',coords='minimal',compat='override').assign_coords(
+        {'summary':list(summaries)})
+
+def get_regionweights(masks,weights,dims=None,cells=None):
+    """
+    Convert the [masks] and the cell [weights] (e.g. areacello) into a single sparse
+    (region x cell) weight operator. [masks] is either a Dataset of boolean masks or the 
+    compact form returned by masks.get_maskindex. Cells are flattened in the order of [dims], 
+    which defaults to the dimensions of the masks. If [cells] is given (the "cell" coordinate
+    of data in the wet-cell layout, see masks.compress_wetcells), the operator acts on those
+    cells only, and dims is ['cell']. Return the operator, the list of region names and the
+    dims.
+    """
+    if (cells is not None) and ('index' not in masks.variables):
+        masks = build_maskindex(masks)
+    if 'index' in masks.variables:
+        maskdims = masks.attrs['dims'].split(' ')
+        if dims is None:
+            dims = maskdims
+        weights = weights.fillna(0).transpose(*maskdims).values.ravel()
+        rows = np.repeat(np.arange(len(masks['region'])),masks['count'].values)
+        cols = masks['index'].values
+        W = sparse.csr_matrix((weights[cols],(rows,cols)),shape=(len(masks['region']),len(weights)))
+        if cells is not None:
+            # Select the columns of the cells, converting their flattened indices if the
+            # grid dimensions are ordered differently
+            celldims = cells.attrs.get('dims',' '.join(maskdims)).split(' ')
+            shape = dict(zip(maskdims,[int(n) for n in np.atleast_1d(masks.attrs['shape'])]))
+            index = np.unravel_index(cells.values,[shape[d] for d in celldims])
+            index = np.ravel_multi_index([index[celldims.index(d)] for d in maskdims],
+                                         [shape[d] for d in maskdims])
+            W = W[:,index]
+            W.eliminate_zeros()
+            return W,list(masks['region'].values),list(cells.dims)
+        if dims!=maskdims:
+            # Reorder the cells to match the order of [dims]
+            order = np.arange(len(weights)).reshape([masks.sizes[d] for d in maskdims])
+            order = np.transpose(order,[maskdims.index(d) for d in dims]).ravel()
+            W = W[:,order]
+        W.eliminate_zeros()
+        return W,list(masks['region'].values),dims
+    regions = list(masks.data_vars)
+    if dims is None:
+        dims = [d for d in masks.dims]
+    weights = weights.fillna(0).transpose(*dims)
+    # Build the operator from the cells of each region, without a dense (region x cell) array
+    rows,cols = [],[]
+    for i,name in enumerate(regions):
+        mask = masks[name].fillna(0).astype(bool).broadcast_like(weights).transpose(*dims)
+        index = np.flatnonzero(mask.values)
+        rows.append(np.full(len(index),i))
+        cols.append(index)
+    rows,cols = np.concatenate(rows),np.concatenate(cols)
+    weights = weights.values.ravel()
+    W = sparse.csr_matrix((weights[cols],(rows,cols)),shape=(len(regions),len(weights)))
+    W.eliminate_zeros()
+    return W,regions,dims
+
+def _apply_regionweights(x,W,ndim=2):
+    """
+    Apply the (region x cell) operator [W] to the array [x], whose final [ndim] axes are the 
+    spatial dimensions (two for the full grid, one for the wet-cell layout). NaN cells are 
+    excluded from both the sum and the weights.
+    """
+    shape = x.shape[:-ndim]
+    x = x.reshape(-1,W.shape[1])
+    valid = np.isfinite(x)
+    num = W @ np.where(valid,x,0).T
+    den = W @ valid.T.astype(W.dtype)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        out = num/den
+    return out.T.reshape(shape+(W.shape[0],))
+
+def _check_maskgrid(da,masks,name):
+    """
+    Raise an Exception if the grid of [da] differs from that of the compact [masks] (see
+    masks.get_maskindex), in its sizes or in the coordinates both hold.
+    """
+    maskdims = masks.attrs['dims'].split(' ')
+    shape = dict(zip(maskdims,[int(n) for n in np.atleast_1d(masks.attrs['shape'])]))
+    sizes = {d:da.sizes.get(d) for d in maskdims}
+    if sizes!=shape:
+        raise Exception("The grid of the "+name+" "+str(sizes)+" does not match that of the masks "+
+                        str(shape)+". Build the masks from the static file of the same grid.")
+    for d in maskdims:
+        if (d in masks.coords) and (d in da.coords) and (not np.array_equal(masks[d].values,da[d].values)):
+            raise Exception("The "+d+" coordinate of the "+name+" does not match that of the masks."+
+                            " Build the masks from the static file of the same grid.")
+
+def calc_regionalmean(da,masks,weights,verbose=False):
+    ''' Calculate regional means for [da] based on [masks], either a Dataset of boolean masks
+    or the compact form returned by masks.get_maskindex.
+    Return DataArray with "region" dimension corresponding to masknames.
+    
+    All regions are calculated together in a single pass over [da], by applying a sparse
+    (region x cell) weight operator to each chunk. [da] may be on the full grid or in the
+    wet-cell layout (see masks.compress_wetcells); [weights] are on the full grid.'''
+    cells = None
+    if 'cell' in da.dims:
+        cells = da['cell']
+        dims = ['cell']
+    elif 'index' in masks.variables:
+        # Compact masks are defined on the full grid
+        _check_maskgrid(da,masks,'data')
+        _check_maskgrid(weights,masks,'weights')
+        dims = [d for d in da.dims if d in masks.attrs['dims'].split(' ')]
+    else:
+        dims = [d for d in da.dims if d in masks.dims]
+        da,masks,weights = xr.align(da,masks,weights,join='inner',
+                                    exclude=[d for d in da.dims if d not in dims])
+    W,regions,dims = get_regionweights(masks,weights,dims,cells)
+    if verbose:
+        print(str(len(regions))+" regions", end = ' ')
+    if da.chunks is not None:
+        da = da.chunk({d:-1 for d in dims})
+    da_out = xr.apply_ufunc(_apply_regionweights,da,
+                            kwargs={'W':W,'ndim':len(dims)},
+                            input_core_dims=[dims],
+                            output_core_dims=[['region']],
+                            dask='parallelized',
+                            output_dtypes=[float],
+                            dask_gufunc_kwargs={'output_sizes':{'region':len(regions)}})
+    return da_out.assign_coords({'region':regions}).rename(da.name)
+
+def _truncate_harmonics(x,nharmonics):
+    coefs = np.fft.rfft(x,axis=-1)
+    coefs[...,nharmonics+1:] = 0
+    return np.fft.irfft(coefs,n=x.shape[-1],axis=-1)
+
+def calc_harmonicsmoothing(clim,nharmonics=3,dim='dayofyear'):
+    """
+    Smooth the climatology [clim] along its periodic dimension [dim] by retaining only its
+    mean and first [nharmonics] harmonics.
+    """
+    if clim.chunks:
+        clim = clim.chunk({dim:-1})
+    smooth = xr.apply_ufunc(_truncate_harmonics,clim,
+                            input_core_dims=[[dim]],output_core_dims=[[dim]],
+                            kwargs={'nharmonics':nharmonics},
+                            dask='parallelized',output_dtypes=['f8'],keep_attrs=True)
+    return smooth.transpose(dim,...)
+
+def calc_controlanomaly(control,clim,frequency):
+    """
+    Calculate the anomaly of the control about the climatology [clim] (see
+    calc_climatologicalmean), selecting the climatological group of each time.
+    """
+    group = get_climatologygroup(frequency)
+    if group is None:
+        return control-clim
+    index = getattr(control['time'].dt,group).load()
+    return _subtract_climatology(control,clim,index,group)
+
+def calc_ensembleanomaly(ds,clim,frequency):
+    """
+    Calculate the anomaly of the ensemble about the climatology of the control [clim],
+    aligned with the leads of each initialization month (see get_climatologyindex).
+    """
+    group = get_climatologygroup(frequency)
+    if group is None:
+        return ds-clim
+    initmonth = xr.DataArray(ds['init'].dt.month.values,dims=['init'],coords={'init':ds['init']})
+    index = get_climatologyindex(np.unique(initmonth),frequency,len(ds['lead'])).rename({'month':'initmonth'})
+    index = index.assign_coords({'lead':ds['lead']}).sel(initmonth=initmonth).drop_vars('initmonth')
+    return _subtract_climatology(ds,clim,index,group)
+
+def _subtract_climatology(ds,clim,index,group):
+    """
+    Subtract from [ds] the climatology [clim] at the groups given by [index] (the group of
+    each time, or of each init and lead). The climatology is indexed chunk by chunk of [ds],
+    so that it is never gathered to the full length of [ds].
+    """
+    position = index.copy(data=np.searchsorted(clim[group].values,index.values))
+    if ds.chunks:
+        position = position.chunk({d:ds.chunks[d] for d in position.dims})
+    return xr.apply_ufunc(_subtract_groups,ds,position,clim,
+                          input_core_dims=[[],[],[group]],
+                          dask='parallelized',keep_attrs=True)
+
+def _subtract_groups(x,position,clim):
+    # Leading dimensions missing from an input are not passed by apply_ufunc
+    ndim = max(np.ndim(x),np.ndim(position),np.ndim(clim)-1)
+    position = np.reshape(position,(1,)*(ndim-np.ndim(position))+np.shape(position))
+    clim = np.reshape(clim,(1,)*(ndim+1-np.ndim(clim))+np.shape(clim))
+    return x-np.take_along_axis(clim,position[...,np.newaxis],axis=-1)[...,0]
 
 def calc_climatology(ds,groupby):
     """
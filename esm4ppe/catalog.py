@@ -0,0 +1,285 @@
+"""
+Collection of functions for a catalog of the derived products (skill metrics, regional means,
+climatologies, correlations and their coarsened levels).
+
+Each product saved with save_product is recorded in a SQLite database, with the fields that
+identify it (parsed from its path, see describe_product) and the variables and dimensions it
+holds. The openers query the catalog for the files they need, rather than globbing the
+directories and combining every match by its coordinates. Products saved before the catalog
+existed can be added with build_catalog.
+
+SQLite's own locking relies on fcntl locks, which are unreliable on NFS and Lustre, so it is
+turned off and every access to the catalog holds a lock directory instead (see
+utils.lock_store).
+"""
+
+import glob
+import json
+import os
+import re
+import sqlite3
+import urllib.parse
+import xarray as xr
+from contextlib import contextmanager
+
+from esm4ppe.version import sysconfig
+from esm4ppe.cache import to_netcdf_atomic, is_saved
+from esm4ppe.utils import lock_store
+
+_columns = ['path','kind','directory','metric','component','variable','frequency','masksname',
+            'factor','resolution','qualifiers','variables','sizes','mtime']
+
+_frequencies = ['daily','monthly','annual']
+
+def get_catalogpath():
+    """
+    Return the path of the catalog of derived products.
+    """
+    return '/'.join([sysconfig['otherpathroot'],'catalog.sqlite'])
+
+@contextmanager
+def _opencatalog():
+    """
+    Hold the lock on the catalog and yield a connection to it, creating it if necessary. 
+    Changes are committed at the end of the with block.
+    """
+    path = get_catalogpath()
+    os.makedirs(os.path.dirname(path),exist_ok=True)
+    with lock_store(path,timeout=60):
+        connection = sqlite3.connect('file:'+urllib.parse.quote(path)+'?nolock=1',uri=True)
+        try:
+            _create_tables(connection)
+            yield connection
+            connection.commit()
+        finally:
+            connection.close()
+
+def _create_tables(connection):
+    connection.execute("CREATE TABLE IF NOT EXISTS products (path TEXT PRIMARY KEY, kind TEXT, "+
+                       "directory TEXT, metric TEXT, component TEXT, variable TEXT, frequency TEXT, "+
+                       "masksname TEXT, factor INTEGER, resolution REAL, qualifiers TEXT, "+
+                       "variables TEXT, sizes TEXT, mtime REAL)")
+    connection.execute("CREATE INDEX IF NOT EXISTS products_query ON products "+
+                       "(kind, directory, component, frequency, masksname)")
+    # Modification times of the directories last searched for unrecorded products
+    connection.execute("CREATE TABLE IF NOT EXISTS scans (directory TEXT PRIMARY KEY, mtime REAL)")
+
+def _normpath(path):
+    return os.path.normpath(os.path.abspath(path))
+
+def describe_product(path):
+    """
+    Return the catalog fields of the product at [path], parsed from its location and name:
+    its kind ('verify', 'regionalmean', 'climatology' or 'correlation'), the directory within
+    that kind, the skill metric, and the component, variable, frequency and mask set of the
+    file name. Pyramid levels (see pyramid.write_pyramid) have their coarsening factor, and
+    any other qualifiers in the name are listed. Returns None if [path] is not under one of
+    the product directories in sysconfig.
+    """
+    path = _normpath(path)
+    directory,filename = os.path.split(path)
+    parts = filename[:-len('.nc')].split('.')
+    entry = {'path':path,'directory':None,'metric':None,'masksname':None,'factor':1,'qualifiers':[]}
+    roots = {'verify':'verifypathroot','regionalmean':'regionalmeanpathroot',
+             'climatology':'climatologypathroot','correlation':'correlationpathroot'}
+    kind = None
+    for name,root in roots.items():
+        root = _normpath(sysconfig[root])
+        if (name in ['verify','regionalmean']) and (os.path.dirname(directory)==root):
+            kind = name
+            entry['directory'] = os.path.basename(directory)
+        elif (name in ['climatology','correlation']) and (directory==root):
+            kind = name
+    if kind is None:
+        return None
+    entry['kind'] = kind
+    if kind=='correlation':
+        entry['metric'],entry['variable'] = parts[:2]
+        entry['component'] = None
+        rest = parts[2:]
+        entry['frequency'] = next((p for p in rest if p in _frequencies),None)
+        rest = [p for p in rest if p!=entry['frequency']]
+    else:
+        entry['component'],entry['variable'],entry['frequency'] = parts[:3]
+        rest = parts[3:]
+        if (entry['directory'] is not None) and entry['directory'].startswith('verify.'):
+            metric = re.search(r'(?:^|\.)metric-([^.]*)',entry['directory'])
+            entry['metric'] = metric.group(1) if metric is not None else None
+    for part in rest:
+        factor = re.fullmatch(r'coarsen(\d+)',part)
+        if factor is not None:
+            entry['factor'] = int(factor.group(1))
+        elif (kind!='correlation') and (entry['masksname'] is None) and (not part.startswith('nharmonics')):
+            entry['masksname'] = part
+        else:
+            entry['qualifiers'].append(part)
+    return entry
+
+def register_product(path,ds=None):
+    """
+    Record the product at [path] in the catalog, with the variables and dimensions of [ds]
+    (or of the file, if [ds] is not given), and return its entry. Products outside the 
+    product directories are not recorded.
+    """
+    entry = describe_product(path)
+    if entry is None:
+        return
+    if ds is None:
+        with xr.open_dataset(path) as ds:
+            return register_product(path,ds)
+    entry['resolution'] = ds.attrs.get('resolution')
+    entry['variables'] = sorted(ds.data_vars)
+    entry['sizes'] = dict(ds.sizes)
+    entry['mtime'] = os.path.getmtime(path)
+    row = [json.dumps(entry[c]) if c in ['qualifiers','variables','sizes'] else entry[c] for c in _columns]
+    try:
+        with _opencatalog() as connection:
+            connection.execute("INSERT OR REPLACE INTO products VALUES ("+",".join(["?"]*len(_columns))+")",row)
+    except sqlite3.Error as error:
+        print("Could not record "+path+" in the catalog ("+str(error)+").")
+    return entry
+
+def save_product(ds,path):
+    """
+    Write [ds] to netCDF at [path] (see cache.to_netcdf_atomic) and record it in the catalog.
+    The file is not rewritten if it already holds [ds] (see cache.is_saved).
+    """
+    if is_saved(ds,path):
+        if len(query_catalog(path=_normpath(path)))==0:
+            register_product(path,ds)
+        return
+    to_netcdf_atomic(ds,path)
+    register_product(path,ds)
+
+def query_catalog(**criteria):
+    """
+    Return the catalog entries (as dictionaries) whose fields equal [criteria], e.g.
+        query_catalog(kind='regionalmean',directory='ensemble',masksname='basin')
+    A criterion of None matches an empty field. Entries whose file has been removed are
+    dropped from the catalog, and those whose file has been rewritten are recorded again.
+    """
+    for c in criteria:
+        if c not in _columns:
+            raise Exception("Unknown catalog field {"+c+"}; choose from "+str(_columns)+".")
+    query = "SELECT "+",".join(_columns)+" FROM products"
+    if len(criteria)>0:
+        query += " WHERE "+" AND ".join([c+" IS ?" for c in criteria])
+    try:
+        with _opencatalog() as connection:
+            rows = connection.execute(query,list(criteria.values())).fetchall()
+    except sqlite3.Error as error:
+        print("Could not read the catalog ("+str(error)+").")
+        return []
+    entries = []
+    for row in rows:
+        entry = dict(zip(_columns,row))
+        for c in ['qualifiers','variables','sizes']:
+            entry[c] = json.loads(entry[c])
+        if not os.path.exists(entry['path']):
+            remove_product(entry['path'])
+            continue
+        if os.path.getmtime(entry['path'])!=entry['mtime']:
+            entry = register_product(entry['path'])
+        if entry is not None:
+            entries.append(entry)
+    return entries
+
+def remove_product(path):
+    """
+    Remove the product at [path] from the catalog (the file itself is not removed).
+    """
+    try:
+        with _opencatalog() as connection:
+            connection.execute("DELETE FROM products WHERE path IS ?",[_normpath(path)])
+    except sqlite3.Error as error:
+        print("Could not update the catalog ("+str(error)+").")
+
+def build_catalog():
+    """
+    Record all of the products in the product directories in the catalog, e.g. those saved
+    before the catalog existed. Return the number of products recorded.
+    """
+    paths = (glob.glob('/'.join([sysconfig['verifypathroot'],'*','*.nc']))+
+             glob.glob('/'.join([sysconfig['regionalmeanpathroot'],'*','*.nc']))+
+             glob.glob('/'.join([sysconfig['climatologypathroot'],'*.nc']))+
+             glob.glob('/'.join([sysconfig['correlationpathroot'],'*.nc'])))
+    nrecorded = 0
+    for path in paths:
+        if describe_product(path) is not None:
+            register_product(path)
+            nrecorded += 1
+    return nrecorded
+
+def _same_indexes(ds,other):
+    """
+    Return True if [ds] and [other] have the same dimensions and index coordinates.
+    """
+    if (dict(ds.sizes)!=dict(other.sizes)) or (set(ds.indexes)!=set(other.indexes)):
+        return False
+    return all(ds.indexes[name].equals(other.indexes[name]) for name in ds.indexes)
+
+def _record_unrecorded(pattern,entries):
+    """
+    Record the files matching [pattern] (a glob of the files of a product), and their
+    pyramid levels, that are not among the catalog [entries]. The directory is only
+    searched if there are no [entries] or it has changed since it was last searched. Return
+    True if it was searched.
+    """
+    directory = _normpath(os.path.dirname(pattern))
+    try:
+        mtime = os.path.getmtime(directory)
+    except OSError:
+        return False
+    try:
+        with _opencatalog() as connection:
+            scanned = connection.execute("SELECT mtime FROM scans WHERE directory IS ?",[directory]).fetchall()
+    except sqlite3.Error:
+        scanned = []
+    if (len(entries)>0) and (len(scanned)>0) and (scanned[0][0]==mtime):
+        return False
+    recorded = set(entry['path'] for entry in entries)
+    for path in glob.glob(pattern)+glob.glob(pattern[:-len('.nc')]+'.coarsen*.nc'):
+        if _normpath(path) not in recorded:
+            register_product(path)
+    try:
+        with _opencatalog() as connection:
+            connection.execute("INSERT OR REPLACE INTO scans VALUES (?,?)",[directory,mtime])
+    except sqlite3.Error as error:
+        print("Could not update the catalog ("+str(error)+").")
+    return True
+
+def open_catalog(variables=None,resolution=None,pattern=None,**criteria):
+    """
+    Open the products in the catalog that match [criteria] (see query_catalog), for only
+    [variables] if given, as a single lazy Dataset. If [resolution] (in degrees) is given,
+    each variable is opened from the coarsest level of its pyramid that meets it (see
+    pyramid.get_pyramidlevel), and otherwise at full resolution. If [pattern] (a glob of
+    the files of the products) is given, any matching files and their pyramid levels that
+    are not in the catalog, e.g. saved before it existed, are recorded first, so that every
+    product on disk is opened. Their directory is only searched when nothing in it is
+    recorded or it has changed since it was last searched. The files are opened directly, in order of variable, and
+    merged without aligning their coordinates if they all have the same index coordinates.
+    Return None if there are no matching products.
+    """
+    entries = query_catalog(**criteria)
+    if (pattern is not None) and _record_unrecorded(pattern,entries):
+        entries = query_catalog(**criteria)
+    byvariable = {}
+    for entry in entries:
+        if (variables is None) or (entry['variable'] in variables):
+            byvariable.setdefault(entry['variable'],[]).append(entry)
+    chosen = []
+    for variable in sorted(byvariable):
+        entries = sorted(byvariable[variable],key=lambda e:e['factor'])
+        entry = entries[0] if entries[0]['factor']==1 else None
+        if resolution is not None:
+            for e in entries:
+                if (e['resolution'] is not None) and (e['resolution']<=resolution):
+                    entry = e
+        if entry is not None:
+            chosen.append(entry)
+    if len(chosen)==0:
+        return None
+    datasets = [xr.open_dataset(e['path'],chunks={}) for e in chosen]
+    join = 'override' if all(_same_indexes(ds,datasets[0]) for ds in datasets[1:]) else 'outer'
+    return xr.merge(datasets,compat='override',join=join,combine_attrs='override')
@@ -0,0 +1,206 @@
+"""
+Collection of functions for choosing chunk layouts of the zarr stores and rechunking them.
+
+Different analyses favour different layouts: maps of skill at each lead ('spatial') want
+whole fields in a chunk, regional means ('regional') want whole fields and many time steps,
+and time-series operations such as climatologies and control variances ('timeseries') want
+the whole time (or lead) axis in a chunk. Alternative layouts of a store are written to a
+sibling store (see organization.get_zarrpath) so that they can be opened by name. The
+'wet' layout additionally holds only the ocean cells, along a single "cell" dimension (see
+masks.compress_wetcells).
+"""
+
+import glob
+import itertools
+import os
+import numpy as np
+import xarray as xr
+
+from esm4ppe.version import sysconfig
+from esm4ppe.organization import *
+from esm4ppe.encoding import apply_encoding
+from esm4ppe.cache import stamp_store, get_stamppath
+from esm4ppe.masks import compress_wetcells
+
+workloads = ['spatial','regional','timeseries']
+
+def _grow(chunks,sizes,dims,itemsize,target):
+    """
+    Enlarge the chunks along [dims], in order, to their full size until [target] bytes is
+    reached. The last dimension enlarged is given as many elements as will fit.
+    """
+    for dim in dims:
+        nbytes = itemsize*int(np.prod(list(chunks.values())))
+        fit = max(1,int(target//(nbytes/chunks[dim])))
+        chunks[dim] = min(sizes[dim],fit)
+        if chunks[dim]<sizes[dim]:
+            break
+    return chunks
+
+def plan_chunks(sizes,itemsize=4,workload='spatial',target=100e6):
+    """
+    Return a dictionary of chunk sizes for an array with dimension [sizes] and elements of
+    [itemsize] bytes, suited to [workload], with chunks of no more than about [target] bytes.
+
+    'spatial': whole (yh, xh) fields, then as many members, inits and leads as fit.
+    'regional': whole (yh, xh) fields, then as many leads (time), members and inits as fit.
+    'timeseries': the whole lead (time), member and init axes, tiled in (yh, xh) to fit.
+    In the wet-cell layout, the single "cell" dimension takes the place of (yh, xh).
+    """
+    if workload not in workloads:
+        raise Exception("Unknown workload {"+workload+"}; choose from "+str(workloads)+".")
+    sizes = dict(sizes)
+    spatial = [d for d in sizes if d in ['yh','xh','cell']]
+    time = [d for d in ['lead','time'] if d in sizes]
+    ensemble = [d for d in ['member','init'] if d in sizes]
+    other = [d for d in sizes if d not in spatial+time+ensemble]
+    chunks = {d:1 for d in sizes}
+    if workload=='spatial':
+        chunks = _grow(chunks,sizes,other+spatial+ensemble+time,itemsize,target)
+    elif workload=='regional':
+        chunks = _grow(chunks,sizes,other+spatial+time+ensemble,itemsize,target)
+    elif workload=='timeseries':
+        chunks = _grow(chunks,sizes,other+time+ensemble,itemsize,target)
+        # Square tiles in the horizontal
+        nbytes = itemsize*int(np.prod(list(chunks.values())))
+        side = max(1,int((target/nbytes)**(1/max(1,len(spatial)))))
+        for d in spatial:
+            chunks[d] = min(sizes[d],side)
+    return chunks
+
+def list_layouts(variable,frequency,ensembleorcontrol):
+    """
+    Return the names of the alternative layouts available for the given variable.
+    """
+    zarrpath = get_zarrpath(variable,frequency,ensembleorcontrol)
+    localname = zarrpath.split('/')[-2]
+    layouts = []
+    for path in glob.glob('/'.join([sysconfig['zarrpathroot'],localname+'.*',
+                                    get_zarrdir(variable,frequency),variable])):
+        layouts.append(path.split('/')[-3][len(localname)+1:])
+    return sorted(layouts)
+
+def rechunk_zarr(variable,frequency,ensembleorcontrol,workload,target=100e6,memory=2e9,overwrite=False):
+    """
+    Write the [variable] of the ensemble or control zarr store to an alternative store with
+    the chunk layout planned for [workload] (see plan_chunks), and return its path.
+
+    The store is rechunked in regions of whole chunks, each of which is loaded into memory
+    and written into the new store, so that no more than about [memory] bytes are held at
+    once, through an intermediate store if the source would otherwise be read several times
+    over (see write_slabs).
+    """
+    src = get_zarrpath(variable,frequency,ensembleorcontrol)
+    dst = get_zarrpath(variable,frequency,ensembleorcontrol,layout=workload)
+    if os.path.exists('/'.join([dst,variable])):
+        if overwrite:
+            os.system("rm -rf "+'/'.join([dst,variable]))
+        else:
+            print("Layout {"+workload+"} already available for {"+variable+"}.")
+            return dst
+    ds = xr.open_zarr(src)[[variable]]
+    chunks = plan_chunks(ds[variable].sizes,ds[variable].dtype.itemsize,workload,target)
+    write_slabs(ds,variable,dst,chunks,workload,memory)
+    return dst
+
+def compress_zarr(variable,frequency,ensembleorcontrol,static,workload='spatial',target=100e6,memory=2e9,overwrite=False):
+    """
+    Write the [variable] of the ensemble or control zarr store to the 'wet' layout, which
+    holds only the ocean cells of [static] (see masks.compress_wetcells), with the chunks
+    planned for [workload], and return its path.
+    """
+    src = get_zarrpath(variable,frequency,ensembleorcontrol)
+    dst = get_zarrpath(variable,frequency,ensembleorcontrol,layout='wet')
+    if os.path.exists('/'.join([dst,variable])):
+        if overwrite:
+            os.system("rm -rf "+'/'.join([dst,variable]))
+        else:
+            print("Layout {wet} already available for {"+variable+"}.")
+            return dst
+    ds = compress_wetcells(xr.open_zarr(src)[[variable]],static)
+    chunks = plan_chunks(ds[variable].sizes,ds[variable].dtype.itemsize,workload,target)
+    write_slabs(ds,variable,dst,chunks,'wet',memory)
+    return dst
+
+def _plan_region(sizes,chunks,readchunks,itemsize,memory):
+    """
+    Return the size along each dimension of the regions in which an array with dimension
+    [sizes] is written with [chunks], read from an array with [readchunks]. Regions are whole
+    numbers of written chunks of no more than about [memory]/2 bytes, enlarged first along
+    the dimensions in which the read chunks are larger, so that whole chunks are read.
+    """
+    region = {d:chunks[d] for d in sizes}
+    nbytes = itemsize*int(np.prod(list(region.values())))
+    if nbytes>memory/2:
+        raise Exception("A single chunk of "+str(chunks)+" ("+str(round(nbytes/1e6))+" MB) does not fit "+
+                        "in half of [memory] ("+str(round(memory/2e6))+" MB); use a smaller target.")
+    for d in sorted(sizes,key=lambda d:readchunks[d]<=chunks[d]):
+        fit = int((memory/2)//(nbytes/region[d]))
+        region[d] = min(sizes[d],chunks[d]*max(1,fit//chunks[d]))
+        nbytes = itemsize*int(np.prod(list(region.values())))
+        if region[d]<sizes[d]:
+            break
+    return region
+
+def _get_readchunks(da):
+    """
+    Return the largest chunk of [da] along each dimension, or 1 if [da] is in memory.
+    """
+    if da.chunks is None:
+        return {d:1 for d in da.dims}
+    return {d:max(c) for d,c in zip(da.dims,da.chunks)}
+
+def write_slabs(ds,variable,dst,chunks,layout,memory=2e9,maxamplification=2):
+    """
+    Write the [variable] of [ds] to the zarr store at [dst] with [chunks], recording [layout]
+    in its attributes. The data are written in regions of whole chunks (see _plan_region),
+    each of which is loaded into memory and written into the store, so that no more than
+    about [memory] bytes are held at once.
+
+    A region smaller than the chunks of [ds] along a dimension still reads (and decompresses)
+    those chunks whole, so the source is read several times over, e.g. ny/side times over
+    when whole (yh, xh) fields are rechunked to horizontal tiles of [side] cells with the
+    whole lead axis. If the source would be read more than [maxamplification] times over,
+    it is first written to an intermediate store with the smaller of the two chunk sizes
+    along each dimension, which can be written from and read into whole chunks.
+    """
+    da = ds[variable]
+    itemsize = da.dtype.itemsize
+    readchunks = _get_readchunks(da)
+    region = _plan_region(da.sizes,chunks,readchunks,itemsize,memory)
+    amplification = float(np.prod([max(1,readchunks[d]/region[d]) for d in da.dims]))
+    intermediate = None
+    if amplification>maxamplification:
+        intermediate = '.'.join([dst,variable,'intermediate'])
+        print("Writing through an intermediate store (reads "+str(round(amplification))+" times over otherwise).")
+        if os.path.exists('/'.join([intermediate,variable])):
+            os.system("rm -rf "+'/'.join([intermediate,variable]))
+        write_slabs(ds,variable,intermediate,{d:min(chunks[d],readchunks[d]) for d in da.dims},
+                    layout,memory,maxamplification=np.inf)
+        ds = xr.open_zarr(intermediate)[[variable]]
+        da = ds[variable]
+        readchunks = _get_readchunks(da)
+        region = _plan_region(da.sizes,chunks,readchunks,itemsize,memory)
+
+    # Write the metadata and coordinates of the new store
+    template = ds.chunk({d:c for d,c in chunks.items() if d in ds.dims})
+    for v in template.variables:
+        template[v].encoding = {}
+    template[variable].attrs['layout'] = layout
+    template,kwargs = apply_encoding(template,variable,dst)
+    template.to_zarr(dst,mode='a',compute=False,**kwargs)
+
+    # Write region by region
+    starts = [range(0,da.sizes[d],region[d]) for d in da.dims]
+    for start in itertools.product(*starts):
+        regions = {d:slice(i,min(i+region[d],da.sizes[d])) for d,i in zip(da.dims,start)}
+        split = [d for d in da.dims if region[d]<da.sizes[d]]
+        print("Writing "+", ".join([d+" "+str(regions[d].start)+"-"+str(regions[d].stop) for d in split])+"...",end=" ")
+        slab = ds.isel(regions).load().chunk(chunks)
+        slab = slab.drop_vars([v for v in slab.variables if len(set(slab[v].dims)&set(regions))==0])
+        slab,kwargs = apply_encoding(slab,variable,dst)
+        slab.to_zarr(dst,region={d:regions[d] for d in regions if d in slab.dims},**kwargs)
+        print("done.")
+    stamp_store(dst,variable)
+    if intermediate is not None:
+        os.system("rm -rf "+intermediate+" "+get_stamppath(intermediate,variable))
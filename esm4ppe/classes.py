@@ -1,15 +1,25 @@
 """ Module for the esm4ppeObj class """
 import xarray as xr
-import climpred as cp
 import time
-from dask.diagnostics import ProgressBar
 import os
 
 from esm4ppe.version import sysconfig
 from esm4ppe.processing import *
 from esm4ppe.calculations import *
 from esm4ppe.organization import *
-from esm4ppe.masks import get_masks
+from esm4ppe.masks import get_maskindex, expand_wetcells
+from esm4ppe.virtual import open_virtualensemble, get_virtualpath
+from esm4ppe.cache import get_storeidentity, stamp_store, get_cachekey, read_cache, write_cache, read_saved
+from esm4ppe.catalog import save_product, open_catalog
+from esm4ppe.chunking import rechunk_zarr, compress_zarr, list_layouts
+from esm4ppe.correlation import calc_laggedcorrelation
+from esm4ppe.encoding import apply_encoding
+from esm4ppe.pyramid import write_pyramid, get_pyramidlevel
+from esm4ppe.utils import lazy_import
+
+cp = lazy_import('climpred')
+dask = lazy_import('dask')
+diagnostics = lazy_import('dask.diagnostics')
 
 class esm4ppeObj:
     def __init__(self,variable,frequency,constraint=None):
@@ -24,11 +34,39 @@ class esm4ppeObj:
         print("static opened.")
         
         self.coords = self.static.coords
+        # identity of the data held in each dataset, for caching derived results
+        self.identity = {}
         
-    def add_ensemble(self,write=False,check=True,startyear='*',startmonth=None,controlasmember=True):
+    def add_ensemble(self,write=False,check=True,startyear='*',startmonth=None,controlasmember=True,incremental=False,virtual=False,layout=None):
+        if virtual:
+            # read the raw files in place through a reference index
+            print("Opening virtual ensemble...",end=" ")
+            ensemble = open_virtualensemble(self.variable,self.frequency,self.constraint,build=write)
+            if controlasmember:
+                control = open_control(self.variable,self.frequency,self.constraint)
+                ensemble = add_controlasmember(ensemble,control,modelcomponent=self.modelcomponent)
+            print("virtual ensemble opened.")
+            self.ensemble = ensemble
+            self.identity['ensemble'] = get_cachekey('virtual',
+                                                     [get_storeidentity(get_virtualpath(self.variable,self.frequency))],
+                                                     {'controlasmember':controlasmember})
+            return self
+        if layout is not None:
+            # open an alternative chunk layout of the store
+            self.ensemble = open_layout(self.variable,self.frequency,'ensemble',layout)
+            self.identity['ensemble'] = get_storeidentity(get_zarrpath(self.variable,self.frequency,'ensemble',layout=layout),self.variable)
+            return self
         zarrpath = get_zarrpath(self.variable,self.frequency,ensembleorcontrol='ensemble')
         self.zarrpath_climpred = zarrpath
         zarrpresent = os.path.exists(zarrpath+'/'+self.variable)
+        # write (or resume writing) the store one initialization at a time
+        if write and incremental:
+            write_ensemble_byinit(self.variable,self.frequency,self.constraint,
+                                  startyear=startyear,startmonth=startmonth,
+                                  controlasmember=controlasmember,
+                                  modelcomponent=self.modelcomponent)
+            write = False
+            zarrpresent = True
         # look for the zarr store and either open it, or delete it if you wish to overwrite
         if zarrpresent:
             if write:
@@ -53,8 +91,10 @@ class esm4ppeObj:
                 print("... ensemble opened. Elapsed time: "+str(round(end-start))+" seconds.")
                 ensemble = ensemble.drop(['time_bnds','nv']).chunk({'member':-1,'init':-1,'lead':1,'xh':"auto"})
                 print("Saving to zarr store...",end=" ")
-                with ProgressBar():
-                    ensemble.to_zarr(zarrpath,mode='a')
+                ensemble,kwargs = apply_encoding(ensemble,self.variable,zarrpath)
+                with diagnostics.ProgressBar():
+                    ensemble.to_zarr(zarrpath,mode='a',**kwargs)
+                stamp_store(zarrpath,self.variable)
                 print("zarr store saved... ensemble opened.")
             else:
                 raise Exception("Zarr store not available for "+
@@ -66,10 +106,17 @@ class esm4ppeObj:
         if type(ensemble)==xr.DataArray:
             ensemble = ensemble.to_dataset()
         self.ensemble = ensemble
+        self.identity['ensemble'] = get_storeidentity(zarrpath,self.variable)
         return self
     
-    def add_control(self,write=False,check=True):
+    def add_control(self,write=False,check=True,layout=None):
         
+        if layout is not None:
+            # open an alternative chunk layout of the store
+            self.control = open_layout(self.variable,self.frequency,'control',layout)
+            self.identity['control'] = get_storeidentity(get_zarrpath(self.variable,self.frequency,'control',layout=layout),self.variable)
+            print("control opened.")
+            return self
         zarrpath = get_zarrpath(self.variable,self.frequency,ensembleorcontrol='control')
         self.zarrpath_control = zarrpath
         zarrpresent = os.path.exists(zarrpath+'/'+self.variable)
@@ -91,8 +138,10 @@ class esm4ppeObj:
                 control = open_control(self.variable,self.frequency,self.constraint)
                 control = control.chunk({"time":1,"xh":"auto","yh":"auto"})
                 print("saving to zarr store...",end=" ")
-                with ProgressBar():
-                    control.to_zarr(zarrpath,mode='a')
+                control,kwargs = apply_encoding(control,self.variable,zarrpath)
+                with diagnostics.ProgressBar():
+                    control.to_zarr(zarrpath,mode='a',**kwargs)
+                stamp_store(zarrpath,self.variable)
                 print("zarr store saved...")
             else:
                 raise Exception("Zarr store not available for "+
@@ -104,35 +153,173 @@ class esm4ppeObj:
         if type(control)==xr.DataArray:
             control = control.to_dataset()
         self.control = control
+        self.identity['control'] = get_storeidentity(zarrpath,self.variable)
         print("control opened.")
         return self
         
-    def verify(self,metric,saveskill=False,**pm_args):
-        verifypath = get_verifypath(metric,**pm_args)
+    def verify(self,metric,saveskill=False,cache=True,leadsummary=None,threshold=0.5,savepyramid=False,**pm_args):
+        summaryargs = _get_leadsummaryargs(leadsummary,threshold)
+        verifypath = get_verifypath(metric,**pm_args,**summaryargs)
         filenamelist = get_filenamelist(self.variable,self.frequency)
         if hasattr(self,'masksname'):
             filenamelist.append(self.masksname)
         filename = build_ncfilename(filenamelist)
         path = '/'.join([verifypath,filename])
-        try:
-            vs = xr.open_dataset(path)
+        # look for the result in the cache, keyed on the inputs, the metric and its arguments
+        key,params = self._get_verifykey(metric,dict(pm_args,**summaryargs),native=(metric=='ppp'),cache=cache)
+        vs = read_cache('verify',key)
+        if vs is None:
+            vs = read_saved(path,key)
+        if vs is not None:
             print("Opening skill metric... skill metric opened.")
-        except:
+        else:
             print("Calculating skill metric...",end=" ")
             vs = self._verify(metric,**pm_args)
+            if leadsummary is not None:
+                # reduce over leads in the same pass, without holding the full skill field
+                vs = calc_leadsummary(vs,leadsummary,threshold)
+            with diagnostics.ProgressBar():
+                vs = write_cache('verify',key,vs,params)
             print("...skill metric calculated.")
-            if saveskill:
-                isExist = os.path.exists(verifypath)
-                if not isExist:
-                    os.mkdir(verifypath)
-                print("Saving skill metric...",end=" ")
-                with ProgressBar():
-                    vs.to_netcdf(path)
-                print("...skill metric saved")
+        if saveskill:
+            print("Saving skill metric...",end=" ")
+            with diagnostics.ProgressBar():
+                save_product(vs,path)
+            print("...skill metric saved")
+        if saveskill and savepyramid:
+            print("Saving coarsened skill metric...",end=" ")
+            write_pyramid(vs,path,self.static)
+            print("...coarsened skill metric saved")
         self.vs = vs
+        self.identity['vs'] = key
         self.verifypath = verifypath
         return self
     
+    def verify_batch(self,metrics,saveskill=False,cache=True,leadsummary=None,threshold=0.5,savepyramid=False,**pm_args):
+        """
+        Calculate several skill metrics in one pass over the ensemble. Each item of [metrics] is
+        either the name of a metric, calculated with [pm_args], or a (metric, dict) pair whose
+        dict updates [pm_args] for that metric, e.g.
+            es.verify_batch(['acc','rmse','msess',('crps',{'comparison':'m2c'}),
+                             ('ppp',{'groupby':'month'})],comparison='m2e',dim=['init','member'])
+        Metrics with the same comparison and dim are calculated from shared intermediate
+        quantities with calc_skill; any that calc_skill does not support are calculated with
+        climpred. All are computed together, so that the ensemble is read once, and each is
+        saved to its get_verifypath location if [saveskill]. If [leadsummary] is given, each
+        metric is reduced over leads (see calculations.calc_leadsummary) in the same pass, and
+        if [savepyramid] the coarsened levels of each are saved alongside it (see
+        pyramid.write_pyramid). The results are held in self.skill, keyed by their verify 
+        directory name.
+        """
+        summaryargs = _get_leadsummaryargs(leadsummary,threshold)
+        filenamelist = get_filenamelist(self.variable,self.frequency)
+        if hasattr(self,'masksname'):
+            filenamelist.append(self.masksname)
+        filename = build_ncfilename(filenamelist)
+        
+        skill = {}
+        tocompute = {}
+        groups = {}
+        for item in metrics:
+            if isinstance(item,str):
+                metric,args = item,dict(pm_args)
+            else:
+                metric,args = item[0],dict(pm_args,**item[1])
+            name = get_verifydirectoryname(metric,**args,**summaryargs)
+            native = _is_nativeskill(metric,args)
+            key,params = self._get_verifykey(metric,dict(args,**summaryargs),native=native,cache=cache)
+            vs = read_cache('verify',key)
+            if vs is None:
+                vs = read_saved('/'.join([sysconfig['verifypathroot'],name,filename]),key)
+            if vs is not None:
+                print("Opening "+metric+"... "+metric+" opened.")
+                skill[name] = vs
+            elif native:
+                # group the metrics that share a comparison
+                group = (args.get('comparison') or 'm2e',tuple(args.get('dim') or ['init','member']),args.get('groupby'))
+                groups.setdefault(group,[]).append((metric,name))
+                tocompute[name] = (None,key,params,args,metric)
+            else:
+                tocompute[name] = (self._verify(metric,**args),key,params,args,metric)
+        for (comparison,dim,groupby),members in groups.items():
+            results = calc_skill(self.ensemble,getattr(self,'control',None),[m for m,n in members],
+                                 comparison=comparison,dim=list(dim),groupby=groupby,
+                                 frequency=self.frequency)
+            for metric,name in members:
+                tocompute[name] = (results[metric],)+tocompute[name][1:]
+        if leadsummary is not None:
+            for name in tocompute:
+                tocompute[name] = (calc_leadsummary(tocompute[name][0],leadsummary,threshold),)+tocompute[name][1:]
+        
+        if len(tocompute)>0:
+            names = list(tocompute.keys())
+            print("Calculating skill metrics "+str([tocompute[n][4] for n in names])+"...",end=" ")
+            with diagnostics.ProgressBar():
+                computed = dask.compute(*[tocompute[n][0] for n in names])
+            print("...skill metrics calculated.")
+            for name,vs in zip(names,computed):
+                vs,key,params,args,metric = (vs,)+tocompute[name][1:]
+                skill[name] = write_cache('verify',key,vs,params)
+        if saveskill:
+            print("Saving skill metrics...",end=" ")
+            for name,vs in skill.items():
+                save_product(vs,'/'.join([sysconfig['verifypathroot'],name,filename]))
+                if savepyramid:
+                    write_pyramid(vs,'/'.join([sysconfig['verifypathroot'],name,filename]),self.static)
+            print("...skill metrics saved")
+        self.skill = skill
+        return self
+    
+    def bootstrap(self,metric,iterations=1000,sig=95,seed=None,saveskill=False,cache=True,**pm_args):
+        """
+        Calculate a skill metric ('ppp' or 'acc') with its confidence interval and p-value from
+        [iterations] resamplings of the members (see calculations.calc_bootstrap). The result
+        is held in self.vs, along the dimension 'results'.
+        """
+        pm_args = dict(pm_args,bootstrap=str(iterations),sig=str(sig))
+        verifypath = get_verifypath(metric,**pm_args)
+        filenamelist = get_filenamelist(self.variable,self.frequency)
+        if hasattr(self,'masksname'):
+            filenamelist.append(self.masksname)
+        filename = build_ncfilename(filenamelist)
+        key,params = self._get_verifykey(metric,dict(pm_args,seed=seed),native=True,cache=cache)
+        vs = read_cache('verify',key)
+        if vs is None:
+            vs = read_saved('/'.join([verifypath,filename]),key)
+        if vs is not None:
+            print("Opening bootstrapped skill metric... skill metric opened.")
+        else:
+            print("Bootstrapping skill metric...",end=" ")
+            vs = calc_bootstrap(self.ensemble,getattr(self,'control',None),metric,
+                                iterations=iterations,sig=sig,groupby=pm_args.get('groupby'),
+                                frequency=self.frequency,seed=seed)
+            with diagnostics.ProgressBar():
+                vs = write_cache('verify',key,vs,params)
+            print("...skill metric bootstrapped.")
+        if saveskill:
+            print("Saving skill metric...",end=" ")
+            with diagnostics.ProgressBar():
+                save_product(vs,'/'.join([verifypath,filename]))
+            print("...skill metric saved")
+        self.vs = vs
+        self.identity['vs'] = key
+        self.verifypath = verifypath
+        return self
+    
+    def _get_verifykey(self,metric,pm_args,native=False,cache=True):
+        """
+        Return the cache key and parameters of a skill metric, calculated with calc_skill if
+        [native] and with climpred otherwise.
+        """
+        inputs = [self.identity.get('ensemble')]
+        params = {'variable':self.variable,'frequency':self.frequency,'metric':metric,'pm_args':pm_args}
+        if metric=='ppp':
+            inputs.append(self.identity.get('control'))
+        if not native:
+            params['climpred'] = cp.__version__
+        key = get_cachekey('verify',inputs,params) if cache else None
+        return key,params
+    
     def _verify(self,metric,**pm_args):
         if metric=='ppp':
             if 'groupby' in pm_args.keys():
@@ -144,15 +331,16 @@ class esm4ppeObj:
             pm = cp.PerfectModelEnsemble(self.ensemble)
             return pm.verify(metric=metric,**pm_args)
     
-    def regionalmean(self,masksname,omit=None,saveregionalmean=False,verbose=False):
+    def regionalmean(self,masksname,omit=None,saveregionalmean=False,verbose=False,cache=True,savestore=False):
         # Get masks
         self.masksname = masksname
-        masks = get_masks(self.masksname,self.static)
+        masks = get_maskindex(self.masksname,self.static)
         # Specify file locations
         rmpathroot = sysconfig['regionalmeanpathroot']
         filenamelist = get_filenamelist(self.variable,self.frequency)
         filenamelist.append(masksname)
         filename = build_ncfilename(filenamelist)
+        params = {'variable':self.variable,'frequency':self.frequency,'masksname':masksname}
         
         # Loop through datasets
         dsnamelist = ['control','ensemble','vs']
@@ -172,60 +360,171 @@ class esm4ppeObj:
                     da = self.ensemble
                 elif dsname == 'vs':
                     da = self.vs
-                    
-                try:
-                    da = xr.open_dataset('/'.join([rmpath,filename]))
+                
+                key = get_cachekey('regionalmean',[self.identity.get(dsname)],params) if cache else None
+                rm = read_cache('regionalmean',key)
+                if rm is None:
+                    rm = read_saved('/'.join([rmpath,filename]),key)
+                if rm is not None:
                     print("Opening regional means of "+dsname+"... regional means of "+dsname+" opened.")
-                except:
+                else:
                     start = time.time()
                     print("Calculating regional means for "+dsname+"...",end=" ")
-                    da = calc_regionalmean(da[self.variable],masks,self.static.areacello,verbose=verbose)
+                    rm = calc_regionalmean(da[self.variable],masks,self.static.areacello,verbose=verbose).to_dataset()
+                    rm = write_cache('regionalmean',key,rm,params)
                     end = time.time()
                     print("...regional means for "+dsname+" calculated. Elapsed time: "+str(round(end-start))+" seconds.")
                     
-                    if saveregionalmean:
-                        isExist = os.path.exists(rmpath)
-                        if not isExist:
-                            os.mkdir(rmpath)
-                        da.to_netcdf('/'.join([rmpath,filename]))
-                    da = da.to_dataset()
+                if saveregionalmean:
+                    save_product(rm,'/'.join([rmpath,filename]))
+                if savestore:
+                    # add to the store of all variables' regional means
+                    write_regionalmeanstore(rm,self.variable,masksname,self.frequency,localdir,overwrite=True)
                     
                 if dsname == 'control':
-                    self.control = da
+                    self.control = rm
                 elif dsname == 'ensemble':
-                    self.ensemble = da
+                    self.ensemble = rm
                 elif dsname == 'vs':
-                    self.vs = da
+                    self.vs = rm
+                self.identity[dsname] = key
         return self
                           
-    def climatology(self,saveclimatology=True):
+    def climatology(self,saveclimatology=True,cache=True,nharmonics=None,savepyramid=False):
+        if not hasattr(self,'control'):
+            raise Exception("Calculating the climatology requires that the control dataset is present in esm4ppObj.")
         climpathroot = sysconfig['climatologypathroot']
         filenamelist = get_filenamelist(self.variable,self.frequency)
         if hasattr(self,'masksname'):
             filenamelist.append(self.masksname)
+        if nharmonics is not None:
+            filenamelist.append('nharmonics'+str(nharmonics))
         filename = build_ncfilename(filenamelist)
         climpath = '/'.join([climpathroot,filename])
-        try:
-            clim = xr.open_dataset(climpath)
+        
+        params = {'variable':self.variable,'frequency':self.frequency,'nharmonics':nharmonics}
+        key = get_cachekey('climatology',[self.identity.get('control')],params) if cache else None
+        clim = read_cache('climatology',key)
+        if clim is None:
+            clim = read_saved(climpath,key)
+        if clim is not None:
             print("Opening climatology... climatology opened.")
-        except:
-            if hasattr(self,'control'):
-                print('Calculating climatology...',end=' ')
-                
-                if self.frequency=='monthly':
-                    groupby='time.month'
-                elif self.frequency=='daily':
-                    groupby='time.dayofyear'
-                    
-                clim = calc_climatology(self.control,groupby)
-                if saveclimatology:
-                    print('... climatology calculated. Saving to netcdf...',end=' ')
-                    with ProgressBar():
-                        clim.to_netcdf(climpath)
-                    print('...climatology saved.')
-            else:
-                raise Exception("Calculating the climatology requires that the control dataset is present in esm4ppObj.")
+        else:
+            print('Calculating climatology...',end=' ')
+            # single pass over the control, rather than grouping
+            clim = calc_climatologicalmean(self.control,self.frequency)
+            if (nharmonics is not None) and (self.frequency=='daily'):
+                clim = calc_harmonicsmoothing(clim,nharmonics,get_climatologygroup(self.frequency))
+            with diagnostics.ProgressBar():
+                clim = write_cache('climatology',key,clim,params)
+            print('... climatology calculated.',end=' ')
+        if saveclimatology:
+            print('Saving to netcdf...',end=' ')
+            with diagnostics.ProgressBar():
+                save_product(clim,climpath)
+            if savepyramid:
+                write_pyramid(clim,climpath,self.static)
+            print('...climatology saved.')
         self.control = clim
+        self.identity['control'] = key
+        return self
+    
+    def correlate(self,other,dataset='control',lags=[0],method='pearson',savecorrelation=True,cache=True):
+        """
+        Calculate the correlation of this variable with that of [other] (an esm4ppeObj at the
+        same frequency) in their 'control' or 'ensemble' datasets, at each of [lags] (positive
+        when [other] lags; see correlation.calc_laggedcorrelation). Gridded data, regional
+        means and anomalies are correlated in whichever state the datasets are held. The result
+        is held in self.correlation and saved under get_path_correlation if [savecorrelation].
+        """
+        x = getattr(self,dataset)[self.variable]
+        y = getattr(other,dataset)[other.variable]
+        name = '-'.join([self.variable,other.variable])
+        args = {self.frequency:True,'ensemble':dataset=='ensemble'}
+        if hasattr(self,'masksname'):
+            args[self.masksname] = True
+        if get_lagsname(lags) is not None:
+            args[get_lagsname(lags)] = True
+        path = get_path_correlation(self.variable,other.variable,self.frequency,metric=method,**args)
+        
+        params = {'variables':name,'frequency':self.frequency,'dataset':dataset,
+                  'lags':list(lags),'method':method}
+        inputs = [self.identity.get(dataset),other.identity.get(dataset)]
+        key = get_cachekey('correlation',inputs,params) if cache else None
+        correlation = read_cache('correlation',key)
+        if correlation is None:
+            correlation = read_saved(path,key)
+        if correlation is not None:
+            print("Opening correlation... correlation opened.")
+        else:
+            print("Calculating correlation of "+name+"...",end=" ")
+            correlation = calc_laggedcorrelation(x,y,lags=lags,method=method).to_dataset(name=name)
+            with diagnostics.ProgressBar():
+                correlation = write_cache('correlation',key,correlation,params)
+            print("...correlation calculated.")
+        if savecorrelation:
+            save_product(correlation,path)
+        self.correlation = correlation
+        return self
+    
+    def add_anomalies(self,write=False,nharmonics=None,overwrite=False):
+        """
+        Open the anomalies of the control and ensemble about the climatology of the control
+        in place of the data. If [write], the anomaly stores are first written from the zarr
+        stores (see processing.write_anomalies).
+        """
+        if write:
+            write_anomalies(self.variable,self.frequency,nharmonics=nharmonics,overwrite=overwrite)
+        for dsname in ['control','ensemble']:
+            path = get_anomalypath(self.variable,self.frequency,dsname)
+            if not os.path.exists(path+'/'+self.variable):
+                raise Exception("Anomaly store not available for "+dsname+" of "+self.variable+"."+
+                                " Set write=True to calculate and save the anomalies.")
+            print("Opening anomalies of "+dsname+"...",end=" ")
+            ds = xr.open_zarr(path)[[self.variable]]
+            if dsname == 'control':
+                self.control = ds
+            elif dsname == 'ensemble':
+                self.ensemble = ds
+            self.identity[dsname] = get_storeidentity(path,self.variable)
+            print("anomalies of "+dsname+" opened.")
+        return self
+    
+    def rechunk(self,dataset,workload,target=100e6,memory=2e9,overwrite=False):
+        """
+        Write an alternative layout of the ensemble or control zarr store, chunked for 
+        [workload] ('spatial', 'regional' or 'timeseries'), and open it in its place.
+        """
+        rechunk_zarr(self.variable,self.frequency,dataset,workload,
+                     target=target,memory=memory,overwrite=overwrite)
+        if dataset=='ensemble':
+            return self.add_ensemble(layout=workload)
+        elif dataset=='control':
+            return self.add_control(layout=workload)
+    
+    def compress(self,dataset,workload='spatial',target=100e6,memory=2e9,overwrite=False):
+        """
+        Write the ensemble or control zarr store in the wet-cell layout, which holds only the
+        ocean cells along a single "cell" dimension (see chunking.compress_zarr), and open it
+        in its place. Regional means and skill metrics are calculated directly on this layout,
+        and expand returns any of the datasets to the full grid.
+        """
+        compress_zarr(self.variable,self.frequency,dataset,self.static,workload,
+                      target=target,memory=memory,overwrite=overwrite)
+        if dataset=='ensemble':
+            return self.add_ensemble(layout='wet')
+        elif dataset=='control':
+            return self.add_control(layout='wet')
+    
+    def expand(self,dataset):
+        """
+        Expand [dataset] ('control', 'ensemble' or 'vs') from the wet-cell layout onto the
+        full grid, with NaN on land.
+        """
+        ds = getattr(self,dataset)
+        if 'cell' in ds.dims:
+            setattr(self,dataset,expand_wetcells(ds,self.static))
+            self.identity[dataset] = get_cachekey('expand',[self.identity.get(dataset)],{})
         return self
     
     def issue_dmget(self,dataset=None,wait=False):
@@ -238,6 +537,30 @@ class esm4ppeObj:
         elif dataset=='control':
             issue_dmget_esm4ppe(self.variable,self.frequency,self.constraint,wait=wait)
     
+def _get_leadsummaryargs(leadsummary,threshold):
+    """
+    Return the arguments that identify a reduction of skill over leads, for naming and caching.
+    """
+    if leadsummary is None:
+        return {}
+    if isinstance(leadsummary,str):
+        leadsummary = [leadsummary]
+    args = {'leadsummary':list(leadsummary)}
+    if 'horizon' in leadsummary:
+        args['threshold'] = str(threshold)
+    return args
+
+def _is_nativeskill(metric,pm_args):
+    """
+    Return whether a skill metric with [pm_args] can be calculated with calc_skill.
+    """
+    if metric not in skillmetrics:
+        return False
+    if metric=='ppp':
+        return set(pm_args).issubset(['groupby','comparison','dim'])
+    return (set(pm_args).issubset(['comparison','dim'])
+            and (pm_args.get('comparison') or 'm2e') in comparisons)
+
 def open_controlzarr(component,frequency):
     zarrpath = '/'.join([sysconfig['zarrpathroot'],'control_zarr','.'.join([component,frequency])])
     return xr.open_zarr(zarrpath)
@@ -246,32 +569,85 @@ def open_climpredzarr(component,frequency):
     zarrpath = '/'.join([sysconfig['zarrpathroot'],'climpred_zarr','.'.join([component,frequency])])
     return xr.open_zarr(zarrpath)
 
-def open_verify(component,frequency,metric,**pm_args):
+def open_verify(component,frequency,metric,resolution=None,variables=None,**pm_args):
+    """
+    Open the skill metric for all variables of [component], or only [variables]. If 
+    [resolution] (in degrees) is given, each is opened from the coarsest level of its 
+    pyramid that meets it (see pyramid.get_pyramidlevel). The files are found in the catalog
+    (see catalog.open_catalog), recording any saved files that are missing from it.
+    """
     verifypath = get_verifypath(metric,**pm_args)
-    filenamelist = [component,'*',frequency]
-    filename = build_ncfilename(filenamelist)
-    return xr.open_mfdataset('/'.join([verifypath,filename]))
+    ds = open_catalog(variables=variables,resolution=resolution,
+                      pattern='/'.join([verifypath,build_ncfilename([component,'*',frequency])]),
+                      kind='verify',directory=get_verifydirectoryname(metric,**pm_args),
+                      component=component,frequency=frequency,masksname=None)
+    if ds is None:
+        raise Exception("No skill metric saved in "+verifypath+" for "+str(variables or component)+".")
+    return ds
+
+def open_climatology(variable,frequency,masksname=None,nharmonics=None,resolution=None):
+    """
+    Open the saved climatology of [variable], from the coarsest level of its pyramid that
+    meets [resolution] (in degrees) if given.
+    """
+    filenamelist = get_filenamelist(variable,frequency)
+    if masksname is not None:
+        filenamelist.append(masksname)
+    if nharmonics is not None:
+        filenamelist.append('nharmonics'+str(nharmonics))
+    climpath = '/'.join([sysconfig['climatologypathroot'],build_ncfilename(filenamelist)])
+    return xr.open_dataset(get_pyramidlevel(climpath,resolution))
 
-def open_ensembleregionalmean(component,frequency,masksname):
-    rmpathroot = sysconfig['regionalmeanpathroot']
-    localdir = 'ensemble'
-    filenamelist = [component,'*',frequency,masksname]
-    filename = build_ncfilename(filenamelist)
-    return xr.open_mfdataset('/'.join([rmpathroot,localdir,filename]))
+def open_ensembleregionalmean(component,frequency,masksname,variables=None):
+    return _open_regionalmean('ensemble',component,frequency,masksname,variables)
 
-def open_controlregionalmean(component,frequency,masksname):
-    rmpathroot = sysconfig['regionalmeanpathroot']
-    localdir = 'control'
-    filenamelist = [component,'*',frequency,masksname]
-    filename = build_ncfilename(filenamelist)
-    return xr.open_mfdataset('/'.join([rmpathroot,localdir,filename]))
+def open_controlregionalmean(component,frequency,masksname,variables=None):
+    return _open_regionalmean('control',component,frequency,masksname,variables)
     
-def open_verifyregionalmean(component,frequency,masksname,metric,**pm_args):
-    verifydirectoryname = get_verifydirectoryname(metric,**pm_args)
-    rmpathroot = sysconfig['regionalmeanpathroot']
-    filenamelist = [component,'*',frequency,masksname]
-    filename = build_ncfilename(filenamelist)
-    return xr.open_mfdataset('/'.join([rmpathroot,verifydirectoryname,filename]))
+def open_verifyregionalmean(component,frequency,masksname,metric,variables=None,**pm_args):
+    return _open_regionalmean(get_verifydirectoryname(metric,**pm_args),component,frequency,masksname,variables)
+
+def _open_regionalmean(localdir,component,frequency,masksname,variables=None):
+    """
+    Open the regional means saved in the directory [localdir] of all variables of
+    [component] (or only [variables]), found in the catalog (see catalog.open_catalog),
+    recording any saved files that are missing from it.
+    """
+    rmpath = '/'.join([sysconfig['regionalmeanpathroot'],localdir])
+    ds = open_catalog(variables=variables,
+                      pattern='/'.join([rmpath,build_ncfilename([component,'*',frequency,masksname])]),
+                      kind='regionalmean',directory=localdir,
+                      component=component,frequency=frequency,masksname=masksname)
+    if ds is None:
+        raise Exception("No regional means saved in "+rmpath+" for "+str(variables or component)+".")
+    return ds
+
+def open_regionalmeanstore(masksname,frequency,dataset='ensemble',variables=None):
+    """
+    Open the regional means over [masksname] of all variables at [frequency] (or only 
+    [variables]) from the store written with esm4ppeObj.regionalmean(savestore=True).
+    [dataset] is 'control', 'ensemble' or the verify directory name of a skill metric
+    (see organization.get_verifydirectoryname).
+    """
+    path = get_regionalmeanstorepath(masksname,frequency)
+    if not os.path.exists('/'.join([path,dataset])):
+        raise Exception("No regional means of "+dataset+" in the store at "+path+"."+
+                        " Use esm4ppeObj.regionalmean with savestore=True to add them.")
+    ds = xr.open_zarr(path,group=dataset)
+    if variables is not None:
+        ds = ds[variables]
+    return ds
+
+def open_layout(variable,frequency,ensembleorcontrol,layout):
+    """
+    Open an alternative chunk layout of the ensemble or control zarr store.
+    """
+    zarrpath = get_zarrpath(variable,frequency,ensembleorcontrol,layout=layout)
+    if not os.path.exists(zarrpath+'/'+variable):
+        raise Exception("Layout {"+layout+"} not available for "+variable+"."+
+                        " Available layouts: "+str(list_layouts(variable,frequency,ensembleorcontrol))+"."+
+                        " Use esm4ppeObj.rechunk to create it.")
+    return xr.open_zarr(zarrpath)[[variable]]
 
 def delete_zarrvariable(variable,frequency,ensembleorcontrol,check=True):
     zarrpath = get_zarrvariablepath(variable,frequency,ensembleorcontrol)
@@ -287,6 +663,11 @@ def delete_zarrvariable(variable,frequency,ensembleorcontrol,check=True):
 
         if answer == 'yes':
             os.system("rm -rf "+zarrpath)
+            if ensembleorcontrol=='ensemble':
+                # remove the record of any incremental ingestion
+                recordpath = get_ingestrecordpath(get_zarrpath(variable,frequency,ensembleorcontrol),variable)
+                if os.path.exists(recordpath):
+                    os.remove(recordpath)
             print("... zarr store for variable {"+variable+"} removed.")
             zarrpresent=False
         else:
@@ -0,0 +1,84 @@
+"""
+Collection of functions for (lagged) correlations between variables.
+
+Pearson correlations are calculated from joint moments accumulated chunk by chunk (see
+moments.calc_correlation), so that two stores are correlated in a single pass over both
+without loading either. Spearman correlations are the Pearson correlations of the ranks,
+which need the whole sample in one chunk, so for these the inputs are first rechunked to a
+'timeseries' layout (see chunking.plan_chunks).
+"""
+
+import numpy as np
+import xarray as xr
+
+from esm4ppe.moments import calc_correlation
+from esm4ppe.chunking import plan_chunks
+from esm4ppe.utils import lazy_import
+
+stats = lazy_import('scipy.stats')
+
+correlationmethods = ['pearson','spearman']
+
+def get_sampledims(da):
+    """
+    Return the dimensions over which correlations are calculated: time for the control and
+    (init, member) for the ensemble, at each lead.
+    """
+    if 'time' in da.dims:
+        return ['time']
+    return ['init','member']
+
+def get_lagdim(da):
+    """
+    Return the dimension along which correlations are lagged: time for the control and lead
+    for the ensemble.
+    """
+    if 'time' in da.dims:
+        return 'time'
+    return 'lead'
+
+def _rank(x,ndim):
+    shape = x.shape
+    x = x.reshape(shape[:-ndim]+(-1,))
+    return stats.rankdata(x,axis=-1,nan_policy='omit').reshape(shape)
+
+def calc_rank(da,dims):
+    """
+    Rank [da] over [dims], ignoring NaNs and averaging ties.
+    """
+    if da.chunks:
+        da = da.chunk(plan_chunks(da.sizes,8,'timeseries'))
+        da = da.chunk({d:-1 for d in dims})
+    return xr.apply_ufunc(_rank,da,
+                          input_core_dims=[dims],output_core_dims=[dims],
+                          kwargs={'ndim':len(dims)},
+                          dask='parallelized',output_dtypes=['f8']).transpose(*da.dims)
+
+def calc_laggedcorrelation(x,y,lags=[0],method='pearson',dim=None,lagdim=None):
+    """
+    Calculate the correlation of the DataArrays [x] and [y] over [dim] (default
+    get_sampledims), for each of [lags] along [lagdim] (default get_lagdim), returned along
+    the dimension 'lag'. At a positive lag, [y] lags [x], i.e. x(t) is correlated with
+    y(t+lag). [method] is 'pearson' or 'spearman'. Only the points where both are valid are
+    used, and [x] and [y] are aligned on their common coordinates.
+
+    The correlations at all lags are built lazily from the same inputs, so that when they
+    are computed together each chunk of [x] and [y] is read once.
+    """
+    if method not in correlationmethods:
+        raise Exception("Unknown correlation method {"+method+"}; choose from "+str(correlationmethods)+".")
+    if dim is None:
+        dim = get_sampledims(x)
+    if lagdim is None:
+        lagdim = get_lagdim(x)
+    x,y = xr.align(x,y,join='inner')
+    correlation = []
+    for lag in lags:
+        ylag = y.shift({lagdim:-lag})
+        xlag = x
+        if method=='spearman':
+            valid = xlag.notnull() & ylag.notnull()
+            xlag = calc_rank(xlag.where(valid),dim)
+            ylag = calc_rank(ylag.where(valid),dim)
+        correlation.append(calc_correlation(xlag,ylag,dim))
+    return xr.concat(correlation,dim='lag').assign_coords({'lag':list(lags)})
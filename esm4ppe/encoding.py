@@ -0,0 +1,125 @@
+"""
+Collection of functions for the encoding (precision and compression) of the zarr stores.
+
+Each variable is written with an encoding profile: the dtype it is stored as, optional
+rounding of the mantissa to a number of significant bits (which is lossy, but makes the data
+far more compressible), the compressor and its level, and the fill value for land. The
+profile is chosen by sysconfig['encodingprofile'], and can be overridden for individual
+variables in sysconfig['encodingvariables'], e.g.
+    sysconfig['encodingvariables'] = {'thetao':'float32','tos':{'keepbits':12}}
+The 'default' and 'lossless' profiles keep the dtype of the source and are lossless; the
+others cast to float32 and, for 'compact', round the mantissa, so must be chosen explicitly.
+Chunks that are entirely fill value (e.g. land) are not written.
+"""
+
+import os
+import numpy as np
+import xarray as xr
+
+from esm4ppe.version import sysconfig
+from esm4ppe.utils import lazy_import
+
+zarr = lazy_import('zarr')
+numcodecs = lazy_import('numcodecs')
+
+# compressor is one of the blosc compressors ('zstd','lz4','lz4hc','blosclz','zlib') or None,
+# shuffle is 'shuffle', 'bitshuffle' or None, and keepbits is the number of mantissa bits kept
+encodingprofiles = {
+    'default':{'dtype':None,'compressor':'zstd','level':3,'shuffle':'bitshuffle',
+               'keepbits':None,'fillvalue':np.nan},
+    'lossless':{'dtype':None,'compressor':'zstd','level':5,'shuffle':'bitshuffle',
+                'keepbits':None,'fillvalue':np.nan},
+    'float32':{'dtype':'float32','compressor':'zstd','level':3,'shuffle':'bitshuffle',
+               'keepbits':None,'fillvalue':np.nan},
+    'fast':{'dtype':'float32','compressor':'lz4','level':5,'shuffle':'shuffle',
+            'keepbits':None,'fillvalue':np.nan},
+    'compact':{'dtype':'float32','compressor':'zstd','level':9,'shuffle':'bitshuffle',
+               'keepbits':10,'fillvalue':np.nan},
+    'none':{'dtype':None,'compressor':None,'level':None,'shuffle':None,
+            'keepbits':None,'fillvalue':np.nan},
+}
+
+def get_encodingprofile(variable,profile=None):
+    """
+    Return the encoding profile for [variable]: the named [profile] (default
+    sysconfig['encodingprofile']) updated with any entry for [variable] in
+    sysconfig['encodingvariables'], which is either a profile name or a dictionary of settings.
+    """
+    if profile is None:
+        profile = sysconfig.get('encodingprofile','default')
+    override = sysconfig.get('encodingvariables',{}).get(variable,{})
+    if isinstance(override,str):
+        profile,override = override,{}
+    if isinstance(profile,dict):
+        return dict(encodingprofiles['default'],**profile,**override)
+    if profile not in encodingprofiles:
+        raise Exception("Unknown encoding profile {"+profile+"}; choose from "+str(list(encodingprofiles))+".")
+    return dict(encodingprofiles[profile],**override)
+
+def round_bits(x,keepbits):
+    """
+    Round the float32 or float64 numpy array [x] to [keepbits] bits of mantissa (round to
+    nearest, ties to even), setting the remaining bits to zero. NaNs and infinities are kept.
+    """
+    x = np.asarray(x)
+    if x.dtype==np.float32:
+        uint,nmantissa = np.uint32,23
+    elif x.dtype==np.float64:
+        uint,nmantissa = np.uint64,52
+    else:
+        raise Exception("Bit rounding is only available for float32 and float64, not "+str(x.dtype)+".")
+    maskbits = nmantissa-keepbits
+    if maskbits<=0:
+        return x
+    bits = x.view(uint)
+    half = uint((1<<(maskbits-1))-1)
+    mask = ~uint((1<<maskbits)-1)
+    rounded = ((bits+((bits>>uint(maskbits))&uint(1))+half)&mask).view(x.dtype)
+    return np.where(np.isfinite(x),rounded,x)
+
+def calc_bitround(da,keepbits):
+    """
+    Round [da] to [keepbits] bits of mantissa (see round_bits), chunk by chunk.
+    """
+    return xr.apply_ufunc(round_bits,da,kwargs={'keepbits':keepbits},
+                          dask='parallelized',output_dtypes=[da.dtype],keep_attrs=True)
+
+def get_compressorencoding(compressor,level,shuffle):
+    """
+    Return the zarr encoding entry for a blosc [compressor] at [level] with [shuffle], for
+    the installed version of zarr.
+    """
+    if int(zarr.__version__.split('.')[0])>=3:
+        if compressor is None:
+            return {'compressors':None}
+        return {'compressors':(zarr.codecs.BloscCodec(cname=compressor,clevel=level,
+                                                      shuffle=shuffle or 'noshuffle'),)}
+    if compressor is None:
+        return {'compressor':None}
+    shuffles = {None:numcodecs.Blosc.NOSHUFFLE,'shuffle':numcodecs.Blosc.SHUFFLE,
+                'bitshuffle':numcodecs.Blosc.BITSHUFFLE}
+    return {'compressor':numcodecs.Blosc(cname=compressor,clevel=level,shuffle=shuffles[shuffle])}
+
+def apply_encoding(ds,variable,zarrpath,profile=None):
+    """
+    Apply the encoding profile of [variable] (see get_encodingprofile) to [ds] for writing to
+    the zarr store at [zarrpath]: cast to the profile dtype and round to its number of bits.
+    Return [ds] and the keyword arguments for to_zarr. The encoding is only included if the
+    variable is not yet in the store, since it cannot be changed when appending.
+    """
+    settings = get_encodingprofile(variable,profile)
+    da = ds[variable]
+    kwargs = {'write_empty_chunks':False}
+    if da.dtype.kind!='f':
+        return ds,kwargs
+    if settings['dtype'] is not None:
+        da = da.astype(settings['dtype'])
+    if settings['keepbits'] is not None:
+        da = calc_bitround(da,settings['keepbits'])
+        da.attrs['keepbits'] = settings['keepbits']
+    ds = ds.assign({variable:da})
+    if not os.path.exists('/'.join([zarrpath,variable])):
+        encoding = get_compressorencoding(settings['compressor'],settings['level'],settings['shuffle'])
+        encoding['_FillValue'] = settings['fillvalue']
+        kwargs['encoding'] = {variable:encoding}
+    return ds,kwargs
@@ -1,18 +1,189 @@
 """
-Collection of functions to load or generate datasets with spatial masks on ESM4 grid
+Collection of functions to load or generate datasets with spatial masks on ESM4 grid, and
+to convert data between the full grid and the wet-cell layout, which holds only the ocean
+cells along a single "cell" dimension.
 """
 
 import xarray as xr
 import numpy as np
 import re
+import os
+import hashlib
 from esm4ppe.version import sysconfig
 
+# In-process cache of compact masks, keyed on mask name and grid
+_maskcache = {}
+
 def get_masks(name,static):
+    """
+    Return the [name] masks on the grid of [static] as a Dataset of boolean DataArrays.
+    """
+    return expand_maskindex(get_maskindex(name,static))
+
+def _build_masks(name,static):
     if name=='LME':
         return _LMEmask()
     if name=='basin':
         return _basinmask(static)
 
+def get_maskindex(name,static):
+    """
+    Return the [name] masks on the grid of [static] in compact form (see build_maskindex).
+    The compact masks are cached in memory and on disk, keyed on the static grid, so that
+    they are only constructed once.
+    """
+    key = '.'.join([name,_get_gridkey(static)])
+    if key in _maskcache:
+        return _maskcache[key]
+    path = '/'.join([sysconfig['otherpathroot'],'masks',key+'.nc'])
+    if os.path.exists(path):
+        maskindex = xr.load_dataset(path)
+    else:
+        maskindex = build_maskindex(_build_masks(name,static))
+        try:
+            os.makedirs(os.path.dirname(path),exist_ok=True)
+            maskindex.to_netcdf(path+'.'+str(os.getpid()))
+            os.replace(path+'.'+str(os.getpid()),path)
+        except OSError:
+            pass
+    _maskcache[key] = maskindex
+    return maskindex
+
+def _get_gridkey(static,geolon='geolon',geolat='geolat'):
+    """
+    Return a short hash identifying the grid (and basin codes) of [static].
+    """
+    h = hashlib.sha1()
+    for v in [geolon,geolat,'basin']:
+        if v in static.variables:
+            h.update(np.ascontiguousarray(static[v].values).tobytes())
+    return h.hexdigest()[:12]
+
+def build_maskindex(masks):
+    """
+    Convert a Dataset of boolean masks into a compact form: for each region, the list of
+    (flattened) indices of the cells it contains. Regions are contiguous slices of the
+    "index" variable, given by "start" and "count". The grid coordinates are retained, and
+    the order of the flattened dimensions is recorded in the "dims" attribute.
+    """
+    maskarray = masks.to_array('region')
+    dims = [d for d in maskarray.dims if d!='region']
+    maskarray = maskarray.transpose('region',*dims).fillna(0).astype(bool)
+    flat = maskarray.values.reshape(maskarray.shape[0],-1)
+    index = [np.flatnonzero(m) for m in flat]
+    count = np.array([len(i) for i in index],dtype='int64')
+    start = np.concatenate([[0],np.cumsum(count)[:-1]])
+    maskindex = xr.Dataset({'index':('entry',np.concatenate(index).astype('int64')),
+                            'start':('region',start),
+                            'count':('region',count)},
+                           coords={'region':list(maskarray['region'].values)})
+    maskindex = maskindex.assign_coords({d:masks[d] for d in dims if d in masks.coords})
+    maskindex.attrs['dims'] = ' '.join(dims)
+    maskindex.attrs['shape'] = [maskarray.sizes[d] for d in dims]
+    return maskindex
+
+def expand_maskindex(maskindex):
+    """
+    Convert masks in compact form back into a Dataset of boolean DataArrays.
+    """
+    dims = maskindex.attrs['dims'].split(' ')
+    shape = [int(n) for n in np.atleast_1d(maskindex.attrs['shape'])]
+    coords = {d:maskindex[d] for d in dims if d in maskindex.coords}
+    index = maskindex['index'].values
+    masks = xr.Dataset()
+    for name,start,count in zip(maskindex['region'].values,
+                                maskindex['start'].values,
+                                maskindex['count'].values):
+        mask = np.zeros(int(np.prod(shape)),dtype=bool)
+        mask[index[start:start+count]] = True
+        masks[name] = xr.DataArray(mask.reshape(shape),dims=dims,coords=coords)
+    return masks
+
+def get_wetindex(static,dims=['yh','xh']):
+    """
+    Return the indices, in the grid flattened over [dims], of the ocean cells of [static]:
+    those where its "wet" mask is set or, if it has none, where "areacello" is positive.
+    """
+    if 'wet' in static.variables:
+        wet = static['wet'].fillna(0)>0
+    elif 'areacello' in static.variables:
+        wet = static['areacello'].fillna(0)>0
+    else:
+        raise Exception("Static grid has neither wet nor areacello; cannot identify the ocean cells.")
+    return np.flatnonzero(wet.transpose(*dims).values)
+
+def _gather(x,index,ndim):
+    return x.reshape(x.shape[:-ndim]+(-1,))[...,index]
+
+def _scatter(x,index,shape):
+    out = np.full(x.shape[:-1]+(int(np.prod(shape)),),np.nan,dtype=np.promote_types(x.dtype,'f4'))
+    out[...,index] = x
+    return out.reshape(x.shape[:-1]+tuple(shape))
+
+def compress_wetcells(ds,static,dims=['yh','xh']):
+    """
+    Return [ds] (a Dataset or DataArray) in the wet-cell layout, in which the [dims] of the
+    full grid are replaced by a single dimension "cell" holding only the ocean cells of 
+    [static] (see get_wetindex). The "cell" coordinate is the index of each cell in the 
+    flattened grid, with the grid dimensions recorded in its "dims" attribute. Variables
+    without the grid dimensions are unchanged, and the grid coordinates of a Dataset are
+    retained so that it can be expanded without the static grid (see expand_wetcells).
+    """
+    if isinstance(ds,xr.DataArray):
+        return compress_wetcells(ds.to_dataset(name=ds.name or '__da__'),static,dims)[ds.name or '__da__']
+    index = get_wetindex(static,dims)
+    cell = xr.DataArray(index,dims='cell',
+                        attrs={'dims':' '.join(dims),'long_name':'index of the ocean cell in the flattened grid'})
+    out = xr.Dataset(attrs=ds.attrs)
+    for name,da in ds.data_vars.items():
+        if not all(d in da.dims for d in dims):
+            out[name] = da
+            continue
+        if da.chunks is not None:
+            da = da.chunk({d:-1 for d in dims})
+        out[name] = xr.apply_ufunc(_gather,da,
+                                   kwargs={'index':index,'ndim':len(dims)},
+                                   input_core_dims=[dims],
+                                   output_core_dims=[['cell']],
+                                   dask='parallelized',
+                                   output_dtypes=[da.dtype],
+                                   dask_gufunc_kwargs={'output_sizes':{'cell':len(index)}},
+                                   keep_attrs=True)
+    return out.assign_coords({'cell':cell}).assign_coords({d:ds[d] for d in dims if d in ds.coords})
+
+def expand_wetcells(ds,static=None):
+    """
+    Return [ds] (a Dataset or DataArray in the wet-cell layout, see compress_wetcells) on 
+    the full grid, with NaN on land. The grid coordinates are taken from [static] or, if it
+    is not given, from those retained in [ds] (only a Dataset retains them).
+    """
+    if isinstance(ds,xr.DataArray):
+        return expand_wetcells(ds.to_dataset(name=ds.name or '__da__'),static)[ds.name or '__da__']
+    if static is None:
+        static = ds
+    dims = ds['cell'].attrs.get('dims','yh xh').split(' ')
+    if not all(d in static.coords for d in dims):
+        raise Exception("Grid coordinates "+str(dims)+" not available; provide the static grid to expand the wet cells.")
+    shape = [static.sizes[d] for d in dims]
+    index = ds['cell'].values
+    out = xr.Dataset(attrs=ds.attrs)
+    for name,da in ds.data_vars.items():
+        if 'cell' not in da.dims:
+            out[name] = da
+            continue
+        if da.chunks is not None:
+            da = da.chunk({'cell':-1})
+        out[name] = xr.apply_ufunc(_scatter,da,
+                                   kwargs={'index':index,'shape':shape},
+                                   input_core_dims=[['cell']],
+                                   output_core_dims=[dims],
+                                   dask='parallelized',
+                                   output_dtypes=[np.promote_types(da.dtype,'f4')],
+                                   dask_gufunc_kwargs={'output_sizes':dict(zip(dims,shape))},
+                                   keep_attrs=True)
+    out = out.drop_vars([v for v in ['cell']+dims if v in out.variables])
+    return out.assign_coords({d:static[d] for d in dims})
+
 def _LMEmask():
     path = sysconfig['datasetspathroot']+'/LargeMarineEcos/derived_masks/LME66.ESM4.nc'
     return xr.open_dataset(path)
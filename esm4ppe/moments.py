@@ -0,0 +1,258 @@
+"""
+Collection of functions for single-pass, streaming calculation of variances.
+
+Moments are held as count/mean/M2 accumulators (Welford), which are computed for each chunk
+and merged across chunks (Chan et al.), so that a variance is obtained in one read of the
+data and accumulated in float64 regardless of the precision of the stored data.
+"""
+
+import xarray as xr
+import numpy as np
+
+from esm4ppe.utils import lazy_import
+
+dsa = lazy_import('dask.array')
+
+def calc_moments(x,axis,keepdims=True):
+    """
+    Return the moments of the numpy array [x] along [axis] as a dictionary with entries
+    n (count), mean and M2 (sum of squared deviations from the mean). NaNs are ignored.
+    """
+    x = np.asarray(x,dtype='f8')
+    valid = np.isfinite(x)
+    n = valid.sum(axis=axis,keepdims=keepdims).astype('f8')
+    with np.errstate(invalid='ignore',divide='ignore'):
+        mean = np.where(valid,x,0).sum(axis=axis,keepdims=keepdims)/n
+        if keepdims:
+            dev = x-mean
+        else:
+            dev = x-np.expand_dims(mean,axis)
+    M2 = np.where(valid,dev**2,0).sum(axis=axis,keepdims=keepdims)
+    return {'n':n,'mean':np.where(n>0,mean,0),'M2':M2}
+
+def merge_moments(a,b):
+    """
+    Merge two sets of moments, as returned by calc_moments, into the moments of the union
+    of the underlying samples.
+    """
+    n = a['n']+b['n']
+    delta = b['mean']-a['mean']
+    with np.errstate(invalid='ignore',divide='ignore'):
+        fb = np.where(n>0,b['n']/n,0)
+    mean = a['mean']+delta*fb
+    M2 = a['M2']+b['M2']+delta**2*a['n']*fb
+    return {'n':n,'mean':mean,'M2':M2}
+
+def finalize_variance(moments,ddof=0):
+    """
+    Return the variance from a set of moments. Points with no more than [ddof] valid
+    samples are NaN.
+    """
+    with np.errstate(invalid='ignore',divide='ignore'):
+        return np.where(moments['n']>ddof,moments['M2']/(moments['n']-ddof),np.nan)
+
+def _moments_chunk(x,axis=None,keepdims=True,computing_meta=False,**kwargs):
+    if computing_meta:
+        return x
+    return calc_moments(x,axis,keepdims=True)
+
+def _moments_combine(pairs,axis=None,keepdims=True,computing_meta=False,**kwargs):
+    if computing_meta:
+        return pairs
+    from dask.core import flatten
+    pairs = list(flatten(pairs,container=list)) if isinstance(pairs,list) else [pairs]
+    moments = pairs[0]
+    for pair in pairs[1:]:
+        moments = merge_moments(moments,pair)
+    return moments
+
+def _moments_agg(pairs,axis=None,keepdims=False,ddof=0,computing_meta=False,**kwargs):
+    if computing_meta:
+        return pairs
+    variance = finalize_variance(_moments_combine(pairs),ddof)
+    if not keepdims:
+        variance = np.squeeze(variance,axis=axis)
+    return variance
+
+def _variance(x,axis,ddof=0):
+    """
+    Variance of the numpy or dask array [x] along [axis], in a single pass over the data.
+    """
+    if isinstance(x,dsa.Array):
+        return dsa.reduction(x,_moments_chunk,
+                             lambda pairs,**kwargs: _moments_agg(pairs,ddof=ddof,**kwargs),
+                             combine=_moments_combine,
+                             axis=axis,keepdims=False,dtype='f8',
+                             concatenate=False,meta=np.array((),dtype='f8'))
+    return finalize_variance(calc_moments(x,axis,keepdims=False),ddof)
+
+def _select_numeric(ds,dim):
+    """
+    Return the numeric data variables of the Dataset [ds] that have all of [dim] (a list of
+    dimension names), dropping others such as the cftime average_T1, average_T2 and 
+    average_DT of the raw files. A DataArray is returned unchanged.
+    """
+    if isinstance(ds,xr.DataArray):
+        return ds
+    return ds[[v for v in ds.data_vars 
+               if np.issubdtype(ds[v].dtype,np.number) and set(dim)<=set(ds[v].dims)]]
+
+def calc_variance(ds,dim,ddof=0):
+    """
+    Calculate the variance of [ds] along [dim] (a dimension name or list of names) in a
+    single pass using streaming moments. Only the numeric variables with [dim] are kept
+    (see _select_numeric).
+    """
+    if isinstance(dim,str):
+        dim = [dim]
+    ds = _select_numeric(ds,dim)
+    return xr.apply_ufunc(_variance,ds,
+                          input_core_dims=[dim],
+                          kwargs={'axis':tuple(range(-len(dim),0)),'ddof':ddof},
+                          dask='allowed',
+                          keep_attrs=True)
+
+def calc_comoments(x,y,axis,keepdims=True):
+    """
+    Return the joint moments of the numpy arrays [x] and [y] along [axis], over the points
+    where both are valid, as a dictionary with entries n, meanx, meany, M2x, M2y and Cxy
+    (sum of products of deviations from the means).
+    """
+    x = np.asarray(x,dtype='f8')
+    y = np.asarray(y,dtype='f8')
+    valid = np.isfinite(x) & np.isfinite(y)
+    n = valid.sum(axis=axis,keepdims=True).astype('f8')
+    with np.errstate(invalid='ignore',divide='ignore'):
+        meanx = np.where(n>0,np.where(valid,x,0).sum(axis=axis,keepdims=True)/n,0)
+        meany = np.where(n>0,np.where(valid,y,0).sum(axis=axis,keepdims=True)/n,0)
+    dx = np.where(valid,x-meanx,0)
+    dy = np.where(valid,y-meany,0)
+    moments = {'n':n,'meanx':meanx,'meany':meany,
+               'M2x':(dx**2).sum(axis=axis,keepdims=True),
+               'M2y':(dy**2).sum(axis=axis,keepdims=True),
+               'Cxy':(dx*dy).sum(axis=axis,keepdims=True)}
+    if not keepdims:
+        moments = {key:np.squeeze(value,axis=axis) for key,value in moments.items()}
+    return moments
+
+def merge_comoments(a,b):
+    """
+    Merge two sets of joint moments, as returned by calc_comoments, into the joint moments
+    of the union of the underlying samples.
+    """
+    n = a['n']+b['n']
+    dx = b['meanx']-a['meanx']
+    dy = b['meany']-a['meany']
+    with np.errstate(invalid='ignore',divide='ignore'):
+        fb = np.where(n>0,b['n']/n,0)
+    return {'n':n,
+            'meanx':a['meanx']+dx*fb,
+            'meany':a['meany']+dy*fb,
+            'M2x':a['M2x']+b['M2x']+dx**2*a['n']*fb,
+            'M2y':a['M2y']+b['M2y']+dy**2*a['n']*fb,
+            'Cxy':a['Cxy']+b['Cxy']+dx*dy*a['n']*fb}
+
+def finalize_correlation(moments):
+    """
+    Return the Pearson correlation from a set of joint moments. Points with fewer than two
+    valid pairs are NaN.
+    """
+    with np.errstate(invalid='ignore',divide='ignore'):
+        return np.where(moments['n']>1,moments['Cxy']/np.sqrt(moments['M2x']*moments['M2y']),np.nan)
+
+def _comoments_chunk(xy,axis=None,keepdims=True,computing_meta=False,**kwargs):
+    if computing_meta:
+        return xy
+    # x and y are stacked on the leading axis, which is reduced along with [axis]
+    return calc_comoments(xy[0],xy[1],tuple(a-1 for a in axis if a!=0),keepdims=True)
+
+def _comoments_combine(pairs,axis=None,keepdims=True,computing_meta=False,**kwargs):
+    if computing_meta:
+        return pairs
+    from dask.core import flatten
+    pairs = list(flatten(pairs,container=list)) if isinstance(pairs,list) else [pairs]
+    moments = pairs[0]
+    for pair in pairs[1:]:
+        moments = merge_comoments(moments,pair)
+    return moments
+
+def _comoments_agg(pairs,axis=None,keepdims=False,computing_meta=False,**kwargs):
+    if computing_meta:
+        return pairs
+    correlation = finalize_correlation(_comoments_combine(pairs))
+    if not keepdims:
+        correlation = np.squeeze(correlation,axis=tuple(a-1 for a in axis if a!=0))
+    return correlation
+
+def _correlation(x,y,axis):
+    """
+    Pearson correlation of the numpy or dask arrays [x] and [y] along [axis] (negative axes),
+    in a single pass over the data.
+    """
+    if isinstance(x,dsa.Array) or isinstance(y,dsa.Array):
+        xy = dsa.stack([dsa.asarray(x),dsa.asarray(y)]).rechunk({0:2})
+        return dsa.reduction(xy,_comoments_chunk,_comoments_agg,
+                             combine=_comoments_combine,
+                             axis=(0,)+tuple(a%xy.ndim for a in axis),keepdims=False,dtype='f8',
+                             concatenate=False,meta=np.array((),dtype='f8'))
+    return finalize_correlation(calc_comoments(x,y,axis,keepdims=False))
+
+def calc_correlation(x,y,dim):
+    """
+    Calculate the Pearson correlation of [x] and [y] along [dim] (a dimension name or list
+    of names), over the points where both are valid, in a single pass using streaming
+    joint moments.
+    """
+    if isinstance(dim,str):
+        dim = [dim]
+    return xr.apply_ufunc(_correlation,x,y,
+                          input_core_dims=[dim,dim],
+                          kwargs={'axis':tuple(range(-len(dim),0))},
+                          dask='allowed')
+
+def calc_climatologicalvariance(control,frequency,ddof=0):
+    """
+    Calculate the variance of the control about its climatology, i.e. for each month
+    (frequency='monthly') or dayofyear (frequency='daily') separately, or over all time
+    (frequency='annual').
+
+    Rather than grouping, the (contiguous) time axis is reshaped into (year, month) or
+    (year, dayofyear), padding the first and last years, so that all groups are reduced
+    together in a single pass over the data.
+    """
+    if frequency=='annual':
+        return calc_variance(control,'time',ddof)
+    control = _select_numeric(control,['time'])
+    control,group = _construct_climatologicalgroups(control,frequency)
+    cvar = calc_variance(control,'year',ddof)
+    return cvar.assign_coords({group:np.arange(1,control.sizes[group]+1)})
+
+def calc_climatologicalmean(control,frequency):
+    """
+    Calculate the climatology of the control, i.e. its mean for each month
+    (frequency='monthly') or dayofyear (frequency='daily'), or over all time
+    (frequency='annual'), in a single pass over the data as in calc_climatologicalvariance.
+    """
+    control = _select_numeric(control,['time'])
+    if frequency=='annual':
+        return control.mean('time',keep_attrs=True)
+    control,group = _construct_climatologicalgroups(control,frequency)
+    clim = control.mean('year',keep_attrs=True)
+    return clim.assign_coords({group:np.arange(1,control.sizes[group]+1)})
+
+def _construct_climatologicalgroups(control,frequency):
+    """
+    Reshape the (contiguous) time axis of the control into (year, month) or
+    (year, dayofyear), padding the first and last years with NaN.
+    """
+    if frequency=='monthly':
+        group = 'month'
+        ngroup = 12
+    elif frequency=='daily':
+        group = 'dayofyear'
+        ngroup = 365
+    offset = int(getattr(control['time'].dt,group)[0])-1
+    control = control.drop_vars([v for v in control.coords if 'time' in control[v].dims])
+    control = control.pad(time=(offset,0))
+    control = control.coarsen(time=ngroup,boundary='pad').construct(time=('year',group))
+    return control,group
@@ -1,9 +1,14 @@
 """ Collection of functions for navigating the ESM4 PPE file structure on PP/AN """
 
 import re
-import gfdl_utils as gu
+import os
+import json
+import hashlib
 
 from esm4ppe.version import sysconfig
+from esm4ppe.utils import lazy_import, lock_store
+
+gu = lazy_import('gfdl_utils')
 
 ### READING FROM RAW DATA ###
 def get_ensembleid(startyearstr,startmonthstr):
@@ -68,7 +73,7 @@ def get_ppname(variable, frequency, pp=None, constraint=None):
         # For the purposes of finding the ppname, startmonth is irrelevant
         # so it isn't carried here
         pp = get_pp()
-    ppnames = gu.core.find_variable(pp,variable)
+    ppnames = find_variable(pp,variable)
     if len(ppnames)==1:
         ppname = ppnames[0]
         if confirm_frequency(pp,ppname,frequency):
@@ -76,7 +81,7 @@ def get_ppname(variable, frequency, pp=None, constraint=None):
         else:
             raise Exception(("Variable {"+variable
                              +"} only found in {"+ppname
-                             +"}, which has frequency {"+gu.core.get_timefrequency(pp,ppname)
+                             +"}, which has frequency {"+get_timefrequency(pp,ppname)
                              +"} but frequency {"+frequency
                              +"} was requested."))
     for ppname in ppnames:
@@ -113,7 +118,173 @@ def confirm_frequency(pp,ppname,frequency):
     """
     Check that the frequency of the ppname matches the desired frequency.
     """
-    return gu.core.get_timefrequency(pp,ppname)==frequency
+    return get_timefrequency(pp,ppname)==frequency
+
+### CATALOG OF PP CONTENTS ###
+# In-process memoization of the on-disk catalog, keyed on pp
+_ppcatalog = {}
+# The (pp,ppname) pairs whose modification time has been checked in this process
+_ppchecked = set()
+
+def get_ppcatalogpath():
+    """
+    Return the path of the on-disk catalog of pp contents.
+    """
+    return '/'.join([sysconfig['otherpathroot'],'ppcatalog.json'])
+
+def _get_ppnamemtime(pp,ppname,depth=3):
+    """
+    Return the latest modification time of the directory of [ppname] in [pp] and of its 
+    subdirectories up to [depth] levels below it (e.g. ts/monthly/5yr), to which new files
+    are added. Files are not examined.
+    """
+    mtime = None
+    dirs = [os.path.join(pp,ppname)]
+    for level in range(depth+1):
+        subdirs = []
+        for d in dirs:
+            try:
+                mtime = max(mtime or 0,os.path.getmtime(d))
+                if level<depth:
+                    with os.scandir(d) as entries:
+                        subdirs += [entry.path for entry in entries if entry.is_dir()]
+            except OSError:
+                continue
+        dirs = subdirs
+    return mtime
+
+def _read_ppcatalog():
+    try:
+        with open(get_ppcatalogpath()) as f:
+            return json.load(f)
+    except (OSError,ValueError):
+        return {}
+
+def _get_ppcatalogentry(pp):
+    """
+    Return the catalog entry for [pp], a dictionary holding the ppnames in which each 
+    variable has been found, the frequency of each ppname, and the modification times of
+    [pp] and of the ppnames looked up. On first use in a session the entry is read from
+    disk and checked against the modification time of the pp directory: if ppnames have 
+    been added or removed, the variables are looked up again. The ppnames are checked
+    individually when they are used (see _check_ppname).
+    """
+    if pp in _ppcatalog:
+        return _ppcatalog[pp]
+    try:
+        mtime = os.path.getmtime(pp)
+    except OSError:
+        mtime = None
+    entry = _read_ppcatalog().get(pp)
+    if (entry is None) or ('mtime' not in entry):
+        entry = {'mtime':mtime,'mtimes':{},'variables':{},'frequency':{}}
+    elif entry['mtime']!=mtime:
+        entry = {'mtime':mtime,'mtimes':entry['mtimes'],'variables':{},'frequency':entry['frequency']}
+    _ppcatalog[pp] = entry
+    return entry
+
+def _drop_ppnames(entry,ppnames):
+    """
+    Remove from the catalog [entry] the frequency of [ppnames] and the variables found in them.
+    """
+    for ppname in ppnames:
+        entry['frequency'].pop(ppname,None)
+    for variable in [v for v,found in entry['variables'].items() if set(found)&set(ppnames)]:
+        entry['variables'].pop(variable)
+
+def _check_ppname(pp,entry,ppname):
+    """
+    On first use of [ppname] in a session, compare its modification time (see
+    _get_ppnamemtime) with the one recorded in the catalog [entry], and drop what was
+    recorded for it if it has changed.
+    """
+    if (pp,ppname) in _ppchecked:
+        return
+    mtime = _get_ppnamemtime(pp,ppname)
+    if entry['mtimes'].get(ppname)!=mtime:
+        _drop_ppnames(entry,[ppname])
+        entry['mtimes'][ppname] = mtime
+    _ppchecked.add((pp,ppname))
+
+def _merge_ppcatalogentry(old,new):
+    """
+    Merge the catalog entry [new] into [old], keeping what [old] holds for the ppnames whose
+    modification times agree.
+    """
+    if (old is None) or (old.get('mtime')!=new['mtime']):
+        return new
+    merged = {'mtime':new['mtime'],
+              'mtimes':{**old['mtimes'],**new['mtimes']},
+              'variables':dict(old['variables']),
+              'frequency':dict(old['frequency'])}
+    _drop_ppnames(merged,[ppname for ppname,mtime in old['mtimes'].items()
+                          if new['mtimes'].get(ppname,mtime)!=mtime])
+    merged['variables'].update(new['variables'])
+    merged['frequency'].update(new['frequency'])
+    return merged
+
+def _write_ppcatalog():
+    """
+    Merge the in-process catalog into the on-disk catalog, replacing the file atomically.
+    Writers hold a lock on the catalog (see utils.lock_store), so that entries added by
+    concurrent processes are not lost. If the catalog cannot be written, the in-process
+    catalog is still used.
+    """
+    path = get_ppcatalogpath()
+    try:
+        with lock_store(path,timeout=60):
+            catalog = _read_ppcatalog()
+            for pp,entry in _ppcatalog.items():
+                catalog[pp] = _merge_ppcatalogentry(catalog.get(pp),entry)
+                _ppcatalog[pp] = catalog[pp]
+            with open(path+'.'+str(os.getpid()),'w') as f:
+                json.dump(catalog,f)
+            os.replace(path+'.'+str(os.getpid()),path)
+    except OSError:
+        pass
+
+def find_variable(pp,variable):
+    """
+    Return the ppnames in [pp] that contain [variable], using the catalog where possible.
+    The ppnames found are checked for changes (see _check_ppname). Variables that are not
+    found are not recorded. A variable added to a ppname in which it was not found before
+    is picked up once the pp directory, or one of the ppnames it was found in, changes.
+    """
+    entry = _get_ppcatalogentry(pp)
+    for ppname in entry['variables'].get(variable,[]):
+        _check_ppname(pp,entry,ppname)
+    if variable in entry['variables']:
+        return entry['variables'][variable]
+    ppnames = list(gu.core.find_variable(pp,variable))
+    if len(ppnames)>0:
+        for ppname in ppnames:
+            _check_ppname(pp,entry,ppname)
+        entry['variables'][variable] = ppnames
+        _write_ppcatalog()
+    return ppnames
+
+def get_timefrequency(pp,ppname):
+    """
+    Return the time frequency of [ppname] in [pp], using the catalog where possible.
+    """
+    entry = _get_ppcatalogentry(pp)
+    _check_ppname(pp,entry,ppname)
+    if ppname not in entry['frequency']:
+        entry['frequency'][ppname] = gu.core.get_timefrequency(pp,ppname)
+        _write_ppcatalog()
+    return _ppcatalog[pp]['frequency'][ppname]
+
+def clear_ppcatalog(pp=None):
+    """
+    Clear the in-process catalog for [pp] (or for all pp if None), so that it is re-read 
+    from disk and checked against the directory modification time on next use.
+    """
+    if pp is None:
+        _ppcatalog.clear()
+        _ppchecked.clear()
+    else:
+        _ppcatalog.pop(pp,None)
+        _ppchecked.difference_update([key for key in _ppchecked if key[0]==pp])
 
 def get_pathDict(variable,frequency,constraint=None,startyear=None,startmonth=None,member=None,time='*',out='ts'):
     """
@@ -175,15 +346,46 @@ def get_zarrdir(variable,frequency):
     modelcomponent = get_modelcomponent(variable,frequency)
     return '.'.join([modelcomponent,frequency])
 
-def get_zarrpath(variable,frequency,ensembleorcontrol):
+def get_zarrpath(variable,frequency,ensembleorcontrol,layout=None):
+    """
+    Return the zarr store path for the ensemble or control. If [layout] is given, return
+    the path of the store holding that alternative chunk layout (see chunking.rechunk_zarr).
+    """
     if ensembleorcontrol=='ensemble':
         localname='climpred_zarr'
     elif ensembleorcontrol=='control':
         localname='control_zarr'
+    if layout is not None:
+        localname = '.'.join([localname,layout])
+    return '/'.join([sysconfig['zarrpathroot'],localname,get_zarrdir(variable,frequency)])
+
+def get_anomalypath(variable,frequency,ensembleorcontrol):
+    """
+    Return the path of the zarr store holding the anomalies of the ensemble or control
+    about the climatology of the control (see processing.write_anomalies).
+    """
+    if ensembleorcontrol=='ensemble':
+        localname='climpred_zarr_anomaly'
+    elif ensembleorcontrol=='control':
+        localname='control_zarr_anomaly'
     return '/'.join([sysconfig['zarrpathroot'],localname,get_zarrdir(variable,frequency)])
 
-def get_zarrvariablepath(variable,frequency,ensembleorcontrol):
-    return '/'.join([get_zarrpath(variable,frequency,ensembleorcontrol),variable])
+def get_pyramidpath(path,factor):
+    """
+    Return the path of the level of the pyramid of the netcdf file at [path] that is 
+    coarsened by [factor] (see pyramid.write_pyramid).
+    """
+    return path[:-len('.nc')]+'.coarsen'+str(factor)+'.nc'
+
+def get_regionalmeanstorepath(masksname,frequency):
+    """
+    Return the path of the zarr store holding the regional means over the [masksname] masks
+    of all variables at [frequency] (see processing.write_regionalmeanstore).
+    """
+    return '/'.join([sysconfig['regionalmeanpathroot'],'regionalmean_zarr','.'.join([masksname,frequency])])
+
+def get_zarrvariablepath(variable,frequency,ensembleorcontrol,layout=None):
+    return '/'.join([get_zarrpath(variable,frequency,ensembleorcontrol,layout),variable])
 
 def get_modelcomponent(variable,frequency):
     """
@@ -200,6 +402,19 @@ def get_savefilelist_correlation(var1,var2,frequency='monthly',metric='pearson',
             savefilelist.append(key)
     return savefilelist
 
+def get_lagsname(lags):
+    """
+    Return the part of a correlation file name that identifies its [lags]: the lags joined
+    by '_' (e.g. 'lags-12_0_12'), or a short hash of them if there are more than 5. Returns
+    None if the only lag is 0.
+    """
+    lags = [int(lag) for lag in lags]
+    if lags==[0]:
+        return None
+    if len(lags)>5:
+        return 'lags'+hashlib.sha1(json.dumps(lags).encode()).hexdigest()[:8]
+    return 'lags'+'_'.join([str(lag) for lag in lags])
+
 def get_path_correlation(var1,var2,frequency='monthly',metric='pearson',**args):
     savefilelist = get_savefilelist_correlation(var1,var2,frequency=frequency,metric=metric,**args)
     savedir = sysconfig['correlationpathroot']
@@ -0,0 +1,122 @@
+"""
+Pipeline for preprocessing a batch of variables, overlapping the recall of files from tape
+with the conversion of already-recalled variables to zarr.
+
+Usage from the command line:
+    python -m esm4ppe.pipeline tos sos intpp --frequency monthly
+"""
+
+import argparse
+import asyncio
+import datetime
+import os
+import time
+
+from esm4ppe.version import sysconfig
+from esm4ppe.organization import *
+from esm4ppe.processing import *
+from esm4ppe.classes import esm4ppeObj
+from esm4ppe.recallmanager import RecallManager
+
+class PreprocessJob:
+    """
+    A single (variable, frequency) to be recalled from tape and written to zarr.
+    """
+    def __init__(self,variable,frequency,constraint=None):
+        self.variable = variable
+        self.frequency = frequency
+        self.constraint = constraint
+
+    def __repr__(self):
+        return '.'.join([self.variable,self.frequency])
+
+    def get_paths(self):
+        """
+        Return the files of the ensemble and the control needed for this job.
+        """
+        if not hasattr(self,'paths'):
+            self.paths = (get_paths_esm4ppe(self.variable,self.frequency,self.constraint,startyear='*')
+                          +get_paths_esm4ppe(self.variable,self.frequency,self.constraint))
+        return self.paths
+
+    def ingest(self):
+        """
+        Write the ensemble (resuming if partially written) and the control to zarr.
+        """
+        es = esm4ppeObj(self.variable,self.frequency,self.constraint)
+        es.add_ensemble(write=True,check=False,incremental=True)
+        if not os.path.exists(get_zarrvariablepath(self.variable,self.frequency,'control')):
+            es.add_control(write=True,check=False)
+
+async def _run_pipeline(jobs,nahead,manager):
+    pending = list(jobs)
+    recalls = {}
+    failed = {}
+    while len(pending)>0:
+        # Keep [nahead] recalls in flight
+        inflight = [job for job in pending if job in recalls]
+        for job in [job for job in pending if job not in recalls][:max(0,nahead-len(inflight))]:
+            print("Issuing dmget for "+str(job)+".")
+            futures = manager.request(job.get_paths())
+            recalls[job] = asyncio.ensure_future(asyncio.gather(*futures.values()))
+        inflight = [recalls[job] for job in pending if job in recalls]
+        if not any(recall.done() for recall in inflight):
+            print("Waiting for files from tape at :",end=" ")
+            print(datetime.datetime.now())
+            await asyncio.wait(inflight,return_when=asyncio.FIRST_COMPLETED)
+        # Convert the first job whose files are all on disk, while the other recalls continue
+        job = next(job for job in pending if (job in recalls) and recalls[job].done())
+        pending.remove(job)
+        if recalls[job].exception() is not None:
+            print("Recall failed for "+str(job)+": "+str(recalls[job].exception()))
+            failed[str(job)] = recalls[job].exception()
+            continue
+        print("Converting "+str(job)+" to zarr.")
+        start = time.time()
+        await asyncio.to_thread(job.ingest)
+        end = time.time()
+        print(str(job)+" converted. Elapsed time: "+str(round(end-start))+" seconds.")
+    return failed
+
+def run_pipeline(variables,frequencies,constraint=None,nahead=2,poll=60,maxpoll=600,
+                 retrytime=3600,maxretries=3):
+    """
+    Recall and convert to zarr every combination of [variables] and [frequencies].
+
+    Tape recalls are kept in flight for up to [nahead] jobs at a time, and jobs are converted
+    to zarr in whichever order their files become available on disk, so that recall of
+    upcoming variables overlaps with conversion of earlier ones. Recalls are managed by
+    recallmanager.RecallManager, which checks the disk every [poll] seconds, backing off to [maxpoll],
+    and reissues dmget for files still on tape after [retrytime] seconds, up to [maxretries]
+    times. Jobs whose files could not be recalled are skipped, and an Exception listing them
+    is raised once the other jobs are converted.
+    """
+    if isinstance(variables,str):
+        variables = [variables]
+    if isinstance(frequencies,str):
+        frequencies = [frequencies]
+    jobs = [PreprocessJob(variable,frequency,constraint)
+            for variable in variables for frequency in frequencies]
+    async def _run():
+        manager = RecallManager(poll=poll,maxpoll=maxpoll,retrytime=retrytime,maxretries=maxretries)
+        return await _run_pipeline(jobs,nahead,manager)
+    failed = asyncio.run(_run())
+    if len(failed)>0:
+        raise Exception("Files could not be recalled from tape for "+str(list(failed))+": "+
+                        "; ".join(str(error) for error in failed.values()))
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Recall ESM4 PPE variables from tape and convert them to zarr.")
+    parser.add_argument('variables',nargs='+',help="variables to preprocess")
+    parser.add_argument('--frequency',nargs='+',default=['monthly'],help="output frequencies")
+    parser.add_argument('--constraint',default=None,help="string that must be found in the ppname")
+    parser.add_argument('--nahead',type=int,default=2,help="number of tape recalls to keep in flight")
+    parser.add_argument('--poll',type=float,default=60,help="initial polling interval (seconds)")
+    parser.add_argument('--maxretries',type=int,default=3,help="number of times to reissue a failed dmget")
+    args = parser.parse_args(args)
+    run_pipeline(args.variables,args.frequency,constraint=args.constraint,
+                 nahead=args.nahead,poll=args.poll,maxretries=args.maxretries)
+
+if __name__ == '__main__':
+    main()
@@ -2,24 +2,43 @@
 
 import xarray as xr
 import numpy as np
-import cftime
 import datetime
 import time
+import glob
+import re
+import json
+import os
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 from esm4ppe.version import sysconfig
 from esm4ppe.organization import *
+from esm4ppe.recallmanager import recall
+from esm4ppe.calculations import (get_climatologygroup, calc_climatologicalmean, calc_harmonicsmoothing,
+                                  calc_controlanomaly, calc_ensembleanomaly)
+from esm4ppe.encoding import apply_encoding
+from esm4ppe.cache import stamp_store
+from esm4ppe.utils import lazy_import, lock_store
 
-def preprocess_climpred(ds):
+gu = lazy_import('gfdl_utils')
+cftime = lazy_import('cftime')
+zarr = lazy_import('zarr')
+
+def get_climpredheader(ds):
     """
-    Preprocessing function for use with xr.open_mfdataset. This processsing transforms the 
-    dataset being opened into one that is compatible with the climpred format.
+    Return a dictionary of the ensemble details of a single raw ensemble file: the start 
+    year and month and member (from the "title" attribute), and the first lead, the number 
+    of leads and their units (from "time" and "time_bnds").
     """
     nt = len(ds['time'])
     # determine time frequency from time_bnds
-    firstdiff =  ds['time_bnds'].diff('nv')[0].values[0]
+    firstdiff =  ds['time_bnds'].isel(time=0).diff('nv').values[0]
     # if timedelta object, convert to seconds
     if type(firstdiff)==datetime.timedelta:
         firstdiff = firstdiff.total_seconds()
+    elif isinstance(firstdiff,np.timedelta64):
+        firstdiff = firstdiff/np.timedelta64(1,'s')
     if int(firstdiff) == 86400:
         leadunits = 'days'
     elif int(firstdiff) > 31*86400:
@@ -36,50 +55,187 @@ def preprocess_climpred(ds):
     startyear = int(ensembleid[0:4])
     startmonth = int(ensembleid[4:6])
     # Check if getting first saved pp file
-    yearssincestart = ds['time'][0].dt.year.values-startyear
+    yearssincestart = int(ds['time'][0].dt.year.values)-startyear
     if yearssincestart==0:
         leadstart = 1
     else:
         leadstart = yearssincestart*leadunitsperyear[leadunits]+1
-        
+    return {'startyear':startyear,
+            'startmonth':startmonth,
+            'member':member,
+            'leadstart':leadstart,
+            'nt':nt,
+            'leadunits':leadunits}
+
+def apply_climpredheader(ds,header):
+    """
+    Transform a raw ensemble file into the climpred format, using its [header] as returned
+    by get_climpredheader.
+    """
+    leadstart = header['leadstart']
     # Expand init dimension
-    init = cftime.DatetimeNoLeap(startyear,startmonth,1)
+    init = cftime.DatetimeNoLeap(header['startyear'],header['startmonth'],1)
     ds = ds.expand_dims({'init':[init]})
     # Expand member dimension
-    ds = ds.expand_dims({'member':[member]})
+    ds = ds.expand_dims({'member':[header['member']]})
     # Assign "lead" coordinate
-    ds = ds.rename({'time':'lead'}).assign_coords({'lead':np.arange(leadstart,leadstart+nt)})
-    ds['lead'].attrs['units']=leadunits
+    ds = ds.rename({'time':'lead'}).assign_coords({'lead':np.arange(leadstart,leadstart+header['nt'])})
+    ds['lead'].attrs['units']=header['leadunits']
     
     ds = ds.chunk({'lead':-1})
     return ds
 
-def add_controlasmember(ds,control,modelcomponent=None):
+def preprocess_climpred(ds):
     """
-    Add the control simulation, over the appropriate time slice, as an ensemble member when
-    opening the ensemble. Because of differences in dimension names, you need to specify which
-    model component the variable is from.
+    Preprocessing function for use with xr.open_mfdataset. This processsing transforms the 
+    dataset being opened into one that is compatible with the climpred format.
+    """
+    return apply_climpredheader(ds,get_climpredheader(ds))
+
+def read_fileheader(path):
+    """
+    Return the climpred header (see get_climpredheader) of the file at [path], along with
+    the file's size and modification time.
+    """
+    with xr.open_dataset(path,chunks={}) as ds:
+        header = get_climpredheader(ds)
+    stat = os.stat(path)
+    header['size'] = stat.st_size
+    header['mtime'] = stat.st_mtime
+    return header
+
+def get_headerindexpath(variable,frequency):
+    """
+    Return the path of the persisted header index for the ensemble files of a variable.
+    """
+    return '/'.join([sysconfig['otherpathroot'],'headerindex',
+                     '.'.join([get_zarrdir(variable,frequency),variable,'json'])])
+
+def build_headerindex(paths,indexpath=None,nworkers=8,minparallel=500):
+    """
+    Return a {path: header} dictionary of the ensemble details of every file in [paths]. 
+    If [indexpath] is given, the index is persisted there and only files that are new or
+    have changed since are read.
+
+    When at least [minparallel] files are to be read, the headers are read by [nworkers]
+    processes, as reads of netCDF files from several threads are serialized by the HDF5
+    library. The processes are spawned rather than forked, since forking a process in which
+    zarr's I/O thread is running can deadlock. Scripts calling this must therefore guard
+    their entry point with `if __name__ == '__main__':`.
+    """
+    index = {}
+    if (indexpath is not None) and os.path.exists(indexpath):
+        with open(indexpath) as f:
+            index = json.load(f)
+    paths = [os.path.abspath(path) for path in paths]
+    toread = []
+    for path in paths:
+        header = index.get(path)
+        if header is None:
+            toread.append(path)
+            continue
+        stat = os.stat(path)
+        if (header['size']!=stat.st_size) or (header['mtime']!=stat.st_mtime):
+            toread.append(path)
+    if len(toread)>0:
+        nworkers = min(nworkers,len(toread))
+        if (nworkers>1) and (len(toread)>=minparallel):
+            with ProcessPoolExecutor(max_workers=nworkers,
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                headers = list(executor.map(read_fileheader,toread,
+                                            chunksize=max(1,len(toread)//(4*nworkers))))
+        else:
+            headers = [read_fileheader(path) for path in toread]
+        index.update(zip(toread,headers))
+        if indexpath is not None:
+            try:
+                os.makedirs(os.path.dirname(indexpath),exist_ok=True)
+                with open(indexpath+'.'+str(os.getpid()),'w') as f:
+                    json.dump(index,f)
+                os.replace(indexpath+'.'+str(os.getpid()),indexpath)
+            except OSError:
+                pass
+    return {path:index[path] for path in paths}
+
+def _preprocess_fromindex(ds,index):
+    """
+    Preprocessing function for use with xr.open_mfdataset, taking the ensemble details of
+    each file from a header index rather than from the file.
+    """
+    return apply_climpredheader(ds,index[os.path.abspath(ds.encoding['source'])])
+
+def open_fromindex(paths,index):
+    """
+    Open the ensemble files in [paths] as a single dataset, taking the ensemble details of
+    each file from a header [index] (see build_headerindex). The files at the same position
+    along "lead" are concatenated along "member" and "init", and these along "lead", so that
+    the order of the files is known without reading or comparing their coordinates.
+    Initializations that are run for fewer leads have fewer files, and are filled with NaN.
+    """
+    tiles = {}
+    for path in paths:
+        header = index[os.path.abspath(path)]
+        tiles.setdefault((header['startyear'],header['startmonth']),{}).setdefault(header['member'],[]).append(path)
+    members = sorted(set(member for tile in tiles.values() for member in tile))
+    for init,tile in tiles.items():
+        if sorted(tile)!=members or len(set(len(files) for files in tile.values()))>1:
+            raise Exception("The members of the initialization "+str(init)+" do not have the same files.")
+    positions = []
+    for init in sorted(tiles):
+        for member in members:
+            files = sorted(tiles[init][member],key=lambda path:index[os.path.abspath(path)]['leadstart'])
+            for n,path in enumerate(files):
+                if n==len(positions):
+                    positions.append({})
+                positions[n].setdefault(init,[]).append(path)
+    datasets = []
+    for position in positions:
+        grid = [[_preprocess_fromindex(xr.open_dataset(position[init][m],chunks={}),index)
+                 for init in position] for m in range(len(members))]
+        datasets.append(xr.combine_nested(grid,concat_dim=['member','init'],join='outer',combine_attrs='override'))
+    ds = xr.combine_nested(datasets,concat_dim='lead',join='outer',combine_attrs='override')
+    if not (ds.indexes['lead'].is_monotonic_increasing and ds.indexes['lead'].is_unique):
+        raise Exception("The files of different initializations do not cover the same leads.")
+    return ds
+
+def get_controlindex(ds,control,modelcomponent=None):
+    """
+    Return an integer (init, lead) DataArray giving, for every initialization and lead of
+    the ensemble, the position along "time" of the corresponding control time step. Leads 
+    beyond the length of the control slice for that initialization are flagged with -1.
     """
     if modelcomponent in ['ocean',None]:
         bndsdim = 'nv'
     elif modelcomponent in ['atm','land']:
         bndsdim = 'bnds'
-    cs = ds.isel(member=0).copy().expand_dims({'member':[0]})
-    for init in ds['init']:
-        # Get appropriate slice
-        if init.dt.month==1:
-            nlead = len(ds['lead'])
-        else:
-            nlead = int(3*len(ds['lead'])/10)
-        timeslice = slice(
-            ds['time_bnds'].sel(init=init).isel({bndsdim:0,'member':0,'lead':0}).values,
-            ds['time_bnds'].sel(init=init).isel({bndsdim:1,'member':0,'lead':nlead-1}).values)
-        daslice = control.sel(time=timeslice)
-        daslice = daslice.rename({'time':'lead'}).assign_coords({'lead':np.arange(1,nlead+1)})
-        # Add slice to "controlmember" dataset
-        da = cs.sel(init=init)
-        da.loc[{'lead':np.arange(1,nlead+1)}]=daslice
-        cs.loc[{'init':init}] = da
+    nlead = len(ds['lead'])
+    # Start of the first lead of each initialization
+    if 'time_bnds' in ds.variables:
+        start = ds['time_bnds'].isel({bndsdim:0,'member':0,'lead':0}).values
+    else:
+        start = ds['init'].values
+    istart = np.searchsorted(control['time'].values,start)
+    # January initializations are run for the full length, others are shorter
+    nleadinit = np.where(ds['init'].dt.month==1,nlead,int(3*nlead/10))
+    lead = np.arange(nlead)
+    index = istart[:,np.newaxis]+lead[np.newaxis,:]
+    index = np.where(lead[np.newaxis,:]<nleadinit[:,np.newaxis],index,-1)
+    index = np.where(index<len(control['time']),index,-1)
+    return xr.DataArray(index,dims=['init','lead'],coords={'init':ds['init'],'lead':ds['lead']})
+
+def add_controlasmember(ds,control,modelcomponent=None):
+    """
+    Add the control simulation, over the appropriate time slice, as an ensemble member when
+    opening the ensemble. Because of differences in dimension names, you need to specify which
+    model component the variable is from.
+    
+    The control slices for all initializations are gathered with a single indexed selection.
+    """
+    index = get_controlindex(ds,control,modelcomponent)
+    variables = [v for v in ds.data_vars if v in control.data_vars]
+    cs = control[variables].isel(time=index.where(index>=0,0))
+    cs = cs.where(index>=0).drop_vars('time')
+    cs = cs.assign_coords({'init':ds['init'],'lead':ds['lead']}).expand_dims({'member':[0]})
     return xr.concat([cs,ds],dim='member')
 
 def open_control(variable,frequency,constraint=None):
@@ -102,10 +258,14 @@ def open_static(variable,frequency,constraint=None):
     pathDict = get_pathDict(variable,frequency,constraint=constraint)
     return gu.core.open_static(pathDict['pp'],pathDict['ppname'])
 
-def open_ensemble(variable,frequency,constraint=None,startyear="*",startmonth=None,controlasmember=True,modelcomponent=None):
+def open_ensemble(variable,frequency,constraint=None,startyear="*",startmonth=None,controlasmember=True,modelcomponent=None,useindex=True):
     """
     Open the ensemble data for the given variable and frequency, and for the specified startyear and start month.
     If no start year and month are specified then the function returns the full ensemble.
+    
+    If useindex, the ensemble details (init, member, lead) of each file are taken from a
+    persisted header index, only updated for new files, and the files are combined in the
+    order given by the index (see open_fromindex) rather than by their coordinates.
     """
     pathDict = get_pathDict(variable,frequency,constraint,startyear,startmonth)
     path = gu.core.get_pathspp(**pathDict)
@@ -114,7 +274,12 @@ def open_ensemble(variable,frequency,constraint=None,startyear="*",startmonth=No
         ondisk = gu.core.query_ondisk(path)
         if list(ondisk.values()).count(False)>0:
             raise Exception("Not all files (ENSEMBLES) available on disk. Use issue_dmget_esm4ppe(variable,frequency,...) to migrate from tape.")
-    ds = xr.open_mfdataset(path,preprocess=preprocess_climpred)
+    if useindex:
+        paths = get_paths_esm4ppe(variable,frequency,constraint,startyear,startmonth)
+        index = build_headerindex(paths,get_headerindexpath(variable,frequency))
+        ds = open_fromindex(paths,index)
+    else:
+        ds = xr.open_mfdataset(path,preprocess=preprocess_climpred)
     # only open 1st year of data for daily data
     if (frequency == "daily") & (sysconfig['nt_fordaily'] is not None):
         ds = ds.isel(lead=slice(0,sysconfig['nt_fordaily']))
@@ -124,6 +289,18 @@ def open_ensemble(variable,frequency,constraint=None,startyear="*",startmonth=No
         ds = add_controlasmember(ds,control,modelcomponent=modelcomponent)
     return ds
 
+def get_paths_esm4ppe(variable,frequency,constraint=None,startyear=None,startmonth=None):
+    """
+    Return the sorted list of files for the given variable and frequency, and for the start
+    year and month specified. If no start year or month is specified, the files of the control
+    simulation are returned.
+    """
+    pathDict = get_pathDict(variable,frequency,constraint,startyear,startmonth)
+    path = gu.core.get_pathspp(**pathDict)
+    if isinstance(path,str):
+        path = glob.glob(path)
+    return sorted(path)
+
 def issue_dmget_esm4ppe(variable,frequency,constraint=None,startyear=None,startmonth=None,wait=False):
     """
     Issue a dmget command for the relevant variable and frequency and for the start year and month
@@ -143,16 +320,257 @@ def issue_dmget_esm4ppe(variable,frequency,constraint=None,startyear=None,startm
         return
     else:
         print("Issuing dmget.")
-        out = gu.core.issue_dmget(list(ontape.keys()))
         if wait:
-            # Sleep for a moment to make sure the command has issued
-            time.sleep(3)
-            # Now check
-            count = 0
-            while gu.core.query_dmget()==1:
-                count+=1
-                if count%500==0:
-                    print("Still in queue at :",end=" ")
-                    print(datetime.datetime.now())
+            # Track the requested files until they are all on disk
+            recall(list(ontape.keys()))
+        else:
+            gu.core.issue_dmget(list(ontape.keys()))
         return ontape.keys()
 
+
+def get_ensembleinits(variable,frequency,constraint=None,startyear='*',startmonth=None):
+    """
+    Return a sorted list of the (startyear,startmonth) pairs for which ensemble files exist.
+    """
+    path = get_paths_esm4ppe(variable,frequency,constraint,startyear,startmonth)
+    inits = set()
+    for p in path:
+        match = re.search('ensemble-([0-9]{4})([0-9]{2})01-[0-9]{2}',p)
+        if match is not None:
+            inits.add((int(match.group(1)),int(match.group(2))))
+    return sorted(inits)
+
+def get_ingestrecordpath(zarrpath,variable):
+    """
+    Return the path of the file recording which initializations of [variable] have been
+    written to the zarr store at [zarrpath]. The record is kept beside the store.
+    """
+    return '.'.join([zarrpath,variable,'ingest','json'])
+
+def read_ingestrecord(zarrpath,variable):
+    """
+    Return the ingestion record as a dictionary of {ensembleid: [members]}.
+    """
+    path = get_ingestrecordpath(zarrpath,variable)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def write_ingestrecord(zarrpath,variable,record):
+    """
+    Write the ingestion record, replacing the existing file atomically.
+    """
+    path = get_ingestrecordpath(zarrpath,variable)
+    with open(path+'.tmp','w') as f:
+        json.dump(record,f)
+    os.replace(path+'.tmp',path)
+
+def _open_ensembleinit(variable,frequency,constraint,startyear,startmonth,control=None,modelcomponent=None,lead=None):
+    """
+    Open a single initialization of the ensemble, adding the control as a member if provided.
+    If given, the ensemble is first reindexed to [lead], the leads of the full ensemble, so
+    that the control slice has the same length as when the full ensemble is opened.
+    """
+    ds = open_ensemble(variable,frequency,constraint,startyear=startyear,startmonth=startmonth,
+                       controlasmember=False)
+    if lead is not None:
+        ds = ds.reindex(lead=lead)
+    if control is not None:
+        ds = add_controlasmember(ds,control,modelcomponent=modelcomponent)
+    return ds.drop_vars(['time_bnds','nv'],errors='ignore')
+
+def write_ensemble_byinit(variable,frequency,constraint=None,startyear='*',startmonth=None,controlasmember=True,modelcomponent=None):
+    """
+    Write the ensemble to its zarr store one initialization at a time. 
+    
+    On the first call the store is pre-sized to hold every initialization found in the
+    archive, and each initialization is then written into its own region of the store. 
+    Completed initializations are recorded alongside the store, so that an interrupted
+    ingestion resumes from where it stopped. Start dates that are not yet in the store are
+    appended along "init", without rewriting those already present.
+
+    Each initialization is aligned with the leads of the full-length (January) ensemble
+    before the control is added as a member, so that the control slice is not shortened for
+    non-January initializations. All variables sharing a store must hold the same start
+    dates: a variable added to a store that already holds others is written on their "init"
+    coordinate, and start dates that would extend it raise an exception.
+    """
+    zarrpath = get_zarrpath(variable,frequency,ensembleorcontrol='ensemble')
+    inits = get_ensembleinits(variable,frequency,constraint,startyear,startmonth)
+    record = read_ingestrecord(zarrpath,variable)
+    todo = [(y,m) for y,m in inits 
+            if get_ensembleid(str(y).zfill(4),str(m).zfill(2)) not in record]
+    if len(todo)==0:
+        print("All initializations already in zarr store.")
+        return
+    print(str(len(inits)-len(todo))+" of "+str(len(inits))+" initializations already in zarr store.")
+    
+    if controlasmember:
+        control = open_control(variable,frequency,constraint)
+    else:
+        control = None
+    chunks = {'member':-1,'init':1,'lead':1,'xh':"auto"}
+    
+    # Other variables in the store share its "init" coordinate
+    others = []
+    if os.path.exists(zarrpath):
+        existing = xr.open_zarr(zarrpath)
+        others = [v for v in existing.data_vars if (v!=variable) and ('init' in existing[v].dims)]
+    
+    if os.path.exists(zarrpath+'/'+variable):
+        store = xr.open_zarr(zarrpath)[variable]
+    else:
+        # Pre-size the store from a full-length (January) initialization, which is taken
+        # from the whole archive if none was requested
+        january = [(y,m) for y,m in todo if m==1]
+        if len(january)==0:
+            january = [(y,m) for y,m in get_ensembleinits(variable,frequency,constraint) if m==1]
+        if len(january)>0:
+            y,m = january[0]
+            lead = open_ensemble(variable,frequency,constraint,startyear=y,startmonth=m,
+                                 controlasmember=False)['lead']
+        else:
+            lead = None
+        y,m = todo[0]
+        template = _open_ensembleinit(variable,frequency,constraint,y,m,control,modelcomponent,lead=lead)
+        initsall = [cftime.DatetimeNoLeap(y,m,1) for y,m in inits]
+        if len(others)>0:
+            storeinits = list(existing['init'].values)
+            missing = [i for i in initsall if i not in storeinits]
+            if len(missing)>0:
+                raise Exception("Start dates "+str([str(i) for i in missing])+" of {"+variable+"} are not"+
+                                " in the zarr store at "+zarrpath+", which holds "+str(others)+" on"+
+                                " its init coordinate. Ingest the same start dates for all variables.")
+            initsall = storeinits
+        template = template.reindex(init=initsall).chunk(chunks)
+        template,kwargs = apply_encoding(template,variable,zarrpath)
+        template.to_zarr(zarrpath,mode='a',compute=False,**kwargs)
+        store = xr.open_zarr(zarrpath)[variable]
+    storeinits = list(store['init'].values)
+    
+    for y,m in todo:
+        ensembleid = get_ensembleid(str(y).zfill(4),str(m).zfill(2))
+        print("Writing initialization "+ensembleid+"...",end=" ")
+        start = time.time()
+        ds = _open_ensembleinit(variable,frequency,constraint,y,m,control,modelcomponent,
+                                lead=store['lead'])
+        ds = ds.reindex(member=store['member']).chunk(chunks)
+        ds,kwargs = apply_encoding(ds,variable,zarrpath)
+        members = [int(member) for member in ds['member'].values]
+        init = cftime.DatetimeNoLeap(y,m,1)
+        if init in storeinits:
+            i = storeinits.index(init)
+            ds = ds.drop_vars([v for v in ds.variables if 'init' not in ds[v].dims])
+            ds.to_zarr(zarrpath,region={'init':slice(i,i+1)},**kwargs)
+        else:
+            if len(others)>0:
+                raise Exception("Start date "+ensembleid+" of {"+variable+"} is not in the zarr store at "+
+                                zarrpath+"; appending it would extend the init coordinate shared with "+
+                                str(others)+". Ingest the same start dates for all variables.")
+            ds.to_zarr(zarrpath,append_dim='init',**kwargs)
+            storeinits.append(init)
+        record[ensembleid] = members
+        write_ingestrecord(zarrpath,variable,record)
+        stamp_store(zarrpath,variable)
+        end = time.time()
+        print("written. Elapsed time: "+str(round(end-start))+" seconds.")
+
+def write_anomalies(variable,frequency,nharmonics=None,overwrite=False):
+    """
+    Write the anomalies of the control and ensemble zarr stores about the climatology of the
+    control to companion stores (see organization.get_anomalypath), and return the
+    climatology. The climatology is calculated in a single pass over the control store, and
+    for daily data is optionally smoothed to its first [nharmonics] harmonics. The ensemble
+    anomalies are aligned with the climatology by initialization month and lead, and the
+    climatology is selected chunk by chunk as the anomalies are written. Existing
+    anomaly stores are kept unless [overwrite].
+    """
+    control = xr.open_zarr(get_zarrpath(variable,frequency,'control'))[[variable]]
+    print("Calculating climatology...",end=" ")
+    clim = calc_climatologicalmean(control,frequency)
+    if (nharmonics is not None) and (frequency=='daily'):
+        clim = calc_harmonicsmoothing(clim,nharmonics,get_climatologygroup(frequency))
+    clim = clim.astype(control[variable].dtype).load()
+    print("climatology calculated.")
+    for ensembleorcontrol in ['control','ensemble']:
+        path = get_anomalypath(variable,frequency,ensembleorcontrol)
+        if os.path.exists('/'.join([path,variable])):
+            if overwrite:
+                os.system("rm -rf "+'/'.join([path,variable]))
+            else:
+                print("Anomalies of "+ensembleorcontrol+" already available for {"+variable+"}.")
+                continue
+        if ensembleorcontrol=='control':
+            anomaly = calc_controlanomaly(control,clim,frequency)
+        else:
+            ensemble = xr.open_zarr(get_zarrpath(variable,frequency,'ensemble'))[[variable]]
+            anomaly = calc_ensembleanomaly(ensemble,clim,frequency)
+        for v in anomaly.variables:
+            anomaly[v].encoding = {}
+        anomaly[variable].attrs['climatology'] = str(get_climatologygroup(frequency))
+        if nharmonics is not None:
+            anomaly[variable].attrs['nharmonics'] = nharmonics
+        print("Writing anomalies of "+ensembleorcontrol+"...",end=" ")
+        anomaly,kwargs = apply_encoding(anomaly,variable,path)
+        anomaly.to_zarr(path,mode='a',**kwargs)
+        stamp_store(path,variable)
+        print("written.")
+    return clim
+
+def write_regionalmeanstore(rm,variable,masksname,frequency,dataset,overwrite=False):
+    """
+    Write the regional means [rm] of [variable] to the group [dataset] ('control', 
+    'ensemble', or the verify directory name of a skill metric) of the store holding all
+    variables' regional means over [masksname] at [frequency] (see 
+    organization.get_regionalmeanstorepath). 
+
+    Variables share the dimensions (region, init, member, lead or time) of the group. A 
+    variable whose coordinates are a subset of those already in the group is reindexed onto
+    them (with NaN where it is missing). If it has coordinates that the group does not, the
+    group is extended to the union of the two: it is rewritten, with the variables already
+    in it reindexed onto the union, and replaces the old group once complete. Writers hold a
+    lock on the store (see lock_store), so that variables can be added by concurrent
+    processes, and the metadata of the store is consolidated after each write so that all
+    groups and variables are opened with a single read. A variable already in the group is
+    kept unless [overwrite].
+    """
+    path = get_regionalmeanstorepath(masksname,frequency)
+    ds = rm[[variable]]
+    with lock_store(path):
+        grow = {}
+        if os.path.exists('/'.join([path,dataset])):
+            store = xr.open_zarr(path,group=dataset,consolidated=False)
+            if (variable in store.data_vars) and (not overwrite):
+                print("Regional means of "+dataset+" already in store for {"+variable+"}.")
+                return path
+            for dim in ds.dims:
+                if (dim not in store.indexes) or ds.indexes[dim].equals(store.indexes[dim]):
+                    continue
+                union = store.indexes[dim].union(ds.indexes[dim])
+                if not union.equals(store.indexes[dim]):
+                    grow[dim] = union
+                ds = ds.reindex({dim:union})
+            if len(grow)>0:
+                # Rewrite the group with the extended coordinates
+                print("Extending "+str(list(grow))+" of the regional means of "+dataset+"...",end=" ")
+                store = store.drop_vars([v for v in store.data_vars if v==variable]).reindex(grow)
+                ds = xr.merge([store,ds],compat='override',join='exact',combine_attrs='override')
+            else:
+                # Leave the shared coordinates of the group as they are
+                ds = ds.drop_vars([v for v in ds.coords if v in store.variables])
+        for v in ds.variables:
+            ds[v].encoding = {}
+        ds = ds.chunk({d:-1 for d in ds.dims})
+        if len(grow)>0:
+            tmp = '/'.join([path,dataset+'.tmp'])
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp)
+            ds.to_zarr(path,group=dataset+'.tmp',mode='w',consolidated=False)
+            shutil.rmtree('/'.join([path,dataset]))
+            os.replace(tmp,'/'.join([path,dataset]))
+            print("extended.")
+        else:
+            ds.to_zarr(path,group=dataset,mode='a',consolidated=False)
+        zarr.consolidate_metadata(path)
+    return path
@@ -0,0 +1,113 @@
+"""
+Collection of functions for multi-resolution pyramids of gridded results.
+
+A pyramid holds area-weighted coarsenings of a result (e.g. a skill metric or climatology)
+by a series of factors, in netcdf files alongside the full-resolution file (see
+organization.get_pyramidpath). Maps can then be browsed from the coarsest level that
+resolves the features of interest, which is a fraction of the size of the full field.
+"""
+
+import glob
+import os
+import re
+import numpy as np
+import xarray as xr
+
+from esm4ppe.organization import get_pyramidpath
+from esm4ppe.masks import expand_wetcells
+from esm4ppe.catalog import save_product
+from esm4ppe.cache import get_resultkey, get_savedkey
+
+pyramidfactors = [2,4,8,16]
+
+def get_gridresolution(ds,dim='xh'):
+    """
+    Return the nominal resolution (in degrees) of the grid of [ds], from the spacing of [dim].
+    """
+    return float(np.median(np.abs(np.diff(ds[dim].values))))
+
+def calc_coarsen(ds,weights,factor,dims=['yh','xh']):
+    """
+    Return the mean of [ds] over blocks of [factor] cells in each of [dims], weighted by 
+    [weights] (e.g. areacello). NaN cells are excluded from both the sum and the weights, so
+    that a block with no valid cells is NaN. Blocks at the edges may be partial. Variables
+    without [dims] are unchanged, and the coordinates of [dims] are the block means.
+    """
+    window = {d:factor for d in dims}
+    weights = weights.fillna(0).reset_coords(drop=True).drop_vars(dims,errors='ignore')
+    out = xr.Dataset(attrs=ds.attrs)
+    for name,da in ds.data_vars.items():
+        if not all(d in da.dims for d in dims):
+            out[name] = da
+            continue
+        da = da.drop_vars([c for c in da.coords if any(d in da[c].dims for d in dims)])
+        w = weights.where(da.notnull(),0)
+        num = (da*w).coarsen(window,boundary='pad').sum()
+        den = w.coarsen(window,boundary='pad').sum()
+        out[name] = (num/den.where(den>0)).assign_attrs(da.attrs)
+    for d in dims:
+        if d in ds.coords:
+            coord = ds[d].coarsen({d:factor},boundary='pad').mean()
+            out = out.assign_coords({d:(d,coord.values,ds[d].attrs)})
+    return out
+
+def write_pyramid(ds,path,static,factors=pyramidfactors):
+    """
+    Write the levels of the pyramid of [ds], whose full-resolution result is at [path], 
+    coarsened by each of [factors] with the cell areas of [static]. Data in the wet-cell
+    layout are first expanded onto the full grid. The resolution of each level (in degrees)
+    and its factor are recorded in its attributes, along with the cache key of [ds] (see
+    cache.write_cache), and levels that already hold that key are not rewritten. Return the
+    paths of the levels.
+    """
+    key = get_resultkey(ds)
+    paths = [get_pyramidpath(path,factor) for factor in factors]
+    if (key is not None) and all(get_savedkey(levelpath)==key for levelpath in paths):
+        return paths
+    record = ds.attrs.get('esm4ppe_cache')
+    if 'cell' in ds.dims:
+        ds = expand_wetcells(ds,static)
+    ds = ds.load()
+    resolution = get_gridresolution(static)
+    for factor,levelpath in zip(factors,paths):
+        level = calc_coarsen(ds,static['areacello'],factor)
+        level.attrs['coarsenfactor'] = factor
+        level.attrs['resolution'] = resolution*factor
+        if record is not None:
+            level.attrs['esm4ppe_cache'] = record
+        save_product(level,levelpath)
+    return paths
+
+def list_pyramid(path):
+    """
+    Return a dictionary of the levels of the pyramid of [path] that are available, keyed by
+    their coarsening factor.
+    """
+    levels = {}
+    for levelpath in glob.glob(get_pyramidpath(glob.escape(path),'*')):
+        factor = re.search(r'\.coarsen(\d+)\.nc$',levelpath)
+        if factor is not None:
+            levels[int(factor.group(1))] = levelpath
+    return dict(sorted(levels.items()))
+
+def get_pyramidlevel(path,resolution=None):
+    """
+    Return the path of the coarsest level of the pyramid of [path] whose resolution (in 
+    degrees) is no coarser than [resolution], or [path] itself if none is (or if 
+    [resolution] is None).
+    """
+    if resolution is None:
+        return path
+    chosen = path
+    for factor,levelpath in list_pyramid(path).items():
+        with xr.open_dataset(levelpath) as level:
+            if level.attrs['resolution']<=resolution:
+                chosen = levelpath
+    return chosen
+
+def open_pyramid(path,resolution=None):
+    """
+    Open the coarsest level of the pyramid of [path] that meets [resolution] (see
+    get_pyramidlevel).
+    """
+    return xr.open_dataset(get_pyramidlevel(path,resolution))
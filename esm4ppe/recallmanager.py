@@ -0,0 +1,149 @@
+"""
+Asynchronous manager for recalling files from tape with dmget.
+
+The manager tracks the specific files it has requested, rather than the user's dmget queue,
+polling their on-disk status with backoff and reissuing dmget for files that fail to migrate.
+"""
+
+import asyncio
+import concurrent.futures
+import time
+
+from esm4ppe.utils import lazy_import
+
+gu = lazy_import('gfdl_utils')
+
+class RecallError(Exception):
+    """
+    Raised when a file could not be recalled from tape after the allowed number of retries.
+    """
+    pass
+
+class RecallManager:
+    """
+    Recall files from tape and signal completion for each file.
+
+    Each requested file is given an asyncio Future, resolved once the file is on disk.
+    Files that are still on tape [retrytime] seconds after their dmget was issued have it
+    reissued, up to [maxretries] times, after which their Future raises RecallError.
+
+    The functions used to query and migrate files default to those in gfdl_utils, and can
+    be replaced (e.g. by a local stand-in) through [query_ondisk] and [issue_dmget]. They have
+    the same signatures: query_ondisk(paths) returns a {path: bool} dictionary, and
+    issue_dmget(paths) starts migration of the given paths.
+    """
+    def __init__(self,query_ondisk=None,issue_dmget=None,poll=10,maxpoll=300,retrytime=3600,maxretries=3):
+        if query_ondisk is None:
+            query_ondisk = gu.core.query_ondisk
+        if issue_dmget is None:
+            issue_dmget = gu.core.issue_dmget
+        self.query_ondisk = query_ondisk
+        self.issue_dmget = issue_dmget
+        self.poll = poll
+        self.maxpoll = maxpoll
+        self.retrytime = retrytime
+        self.maxretries = maxretries
+        self.futures = {}
+        self.issued = {}
+        self.retries = {}
+        self._task = None
+
+    def request(self,paths,callback=None):
+        """
+        Request the recall of [paths], returning a {path: Future} dictionary. If given,
+        [callback] is called with the path once each file is on disk. Must be called from
+        within a running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        new = [path for path in paths if path not in self.futures]
+        for path in new:
+            self.futures[path] = loop.create_future()
+            self.retries[path] = 0
+        futures = {path:self.futures[path] for path in paths}
+        if callback is not None:
+            for path,future in futures.items():
+                future.add_done_callback(
+                    lambda future,path=path: callback(path)
+                    if (not future.cancelled()) and (future.exception() is None) else None)
+        if len(new)>0:
+            ondisk = self.query_ondisk(new)
+            self._resolve(ondisk)
+            self._issue([path for path in new if not ondisk.get(path,False)])
+        if (self._task is None) or self._task.done():
+            self._task = loop.create_task(self._run())
+        return futures
+
+    async def wait(self,paths,callback=None):
+        """
+        Request the recall of [paths] and wait until all are on disk.
+        """
+        futures = self.request(paths,callback)
+        await asyncio.gather(*futures.values())
+
+    def pending(self):
+        """
+        Return the paths that have been requested but are not yet on disk.
+        """
+        return [path for path,future in self.futures.items() if not future.done()]
+
+    def _issue(self,paths):
+        if len(paths)>0:
+            self.issue_dmget(paths)
+            now = time.time()
+            for path in paths:
+                self.issued[path] = now
+
+    def _resolve(self,ondisk):
+        for path,present in ondisk.items():
+            future = self.futures.get(path)
+            if present and (future is not None) and (not future.done()):
+                future.set_result(path)
+
+    def _retry(self):
+        now = time.time()
+        expired = [path for path in self.pending() if now-self.issued[path]>self.retrytime]
+        reissue = []
+        for path in expired:
+            if self.retries[path]>=self.maxretries:
+                self.futures[path].set_exception(
+                    RecallError("Failed to recall {"+path+"} after "+str(self.maxretries)+" retries."))
+            else:
+                self.retries[path]+=1
+                reissue.append(path)
+        self._issue(reissue)
+
+    async def _run(self):
+        wait = self.poll
+        while len(self.pending())>0:
+            await asyncio.sleep(wait)
+            pending = self.pending()
+            ondisk = self.query_ondisk(pending)
+            self._resolve(ondisk)
+            self._retry()
+            if len(self.pending())<len(pending):
+                wait = self.poll
+            else:
+                wait = min(2*wait,self.maxpoll)
+
+async def arecall(paths,**kwargs):
+    """
+    Recall [paths] from tape and wait until all are on disk, from within a running event loop.
+    Keyword arguments are passed to RecallManager.
+    """
+    await RecallManager(**kwargs).wait(paths)
+
+def recall(paths,**kwargs):
+    """
+    Recall [paths] from tape and block until all are on disk. Keyword arguments are passed
+    to RecallManager.
+
+    If an event loop is already running in this thread (e.g. in a Jupyter notebook), the
+    recall is run on its own loop in a worker thread; use arecall to await it instead.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        asyncio.run(arecall(paths,**kwargs))
+        return
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(asyncio.run,arecall(paths,**kwargs)).result()
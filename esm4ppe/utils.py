@@ -2,8 +2,63 @@
 Collection of miscellaneous utility functions
 """
 
+import importlib
+import os
+import shutil
+import socket
+import time
+from contextlib import contextmanager
+
 def get_dimensionslesstime(da):
     return [dim for dim in list(da.dims) if dim not in ['time','month','lead']]
 
 def get_dimensionslessxy(da):
-    return [dim for dim in list(da.dims) if (dim!='xh') & (dim!='yh')]
\ No newline at end of file
+    return [dim for dim in list(da.dims) if (dim!='xh') & (dim!='yh')]
+
+class _LazyModule:
+    """
+    Stand-in for a module that is only imported when one of its attributes is first accessed.
+    """
+    def __init__(self,name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self,attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module,attr)
+
+def lazy_import(name):
+    """
+    Return a stand-in module for [name], so that heavy dependencies are only imported when used.
+    """
+    return _LazyModule(name)
+
+@contextmanager
+def lock_store(path,poll=0.5,timeout=3600):
+    """
+    Hold an exclusive lock on the store at [path] for the duration of a with block, so that
+    concurrent writers take turns. The lock is a directory beside the store, created with
+    mkdir, which is atomic on NFS and Lustre (where fcntl locks may be ignored or only held
+    within a node), so it also excludes writers on other nodes. A lock left behind by a
+    writer that was killed is not released: if the lock is not acquired within [timeout]
+    seconds, an Exception names the lock directory to be removed.
+    """
+    lockpath = path.rstrip('/')+'.lockdir'
+    os.makedirs(os.path.dirname(lockpath),exist_ok=True)
+    start = time.time()
+    while True:
+        try:
+            os.mkdir(lockpath)
+            break
+        except FileExistsError:
+            if time.time()-start>timeout:
+                raise Exception("Could not lock the store at "+path+" within "+str(timeout)+" seconds."+
+                                " If no other process is writing to it, remove "+lockpath+".")
+            time.sleep(poll)
+    try:
+        with open('/'.join([lockpath,'owner']),'w') as f:
+            f.write(socket.gethostname()+' '+str(os.getpid()))
+        yield
+    finally:
+        shutil.rmtree(lockpath,ignore_errors=True)
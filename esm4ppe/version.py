@@ -24,8 +24,15 @@ sysconfig['correlationpathroot'] = basedirwork+'/projects/esm4_ppe/data/processe
 sysconfig['regionalmeanpathroot'] = basedirwork+'/projects/esm4_ppe/data/processed/regionalmean'
 sysconfig['climatologypathroot'] = basedirwork+'/projects/esm4_ppe/data/processed/climatology/seasonal'
 sysconfig['otherpathroot'] = basedirwork+'/projects/esm4_ppe/data/processed/other'
+sysconfig['cachepathroot'] = basedirwork+'/projects/esm4_ppe/data/processed/cache'
+# size above which the least recently used cached results are removed
+sysconfig['cachemaxbytes'] = 500e9
 
 sysconfig['datasetspathroot'] = basedirdatasets
 
+# encoding of the zarr stores (see esm4ppe.encoding), with any overrides for individual variables
+sysconfig['encodingprofile'] = 'default'
+sysconfig['encodingvariables'] = {}
+
 # limit the amount of daily data that is opened and saved
 sysconfig['nt_fordaily'] = 365 # set to None if you want all data
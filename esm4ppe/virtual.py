@@ -0,0 +1,205 @@
+"""
+Collection of functions for building a virtual (reference-based) zarr store of the ensemble.
+
+Rather than copying the raw netCDF4/HDF5 files into zarr, the byte range of every chunk of
+the variable in every ensemble file is recorded in a reference index, laid out as an
+(init, member, lead, ...) zarr array, with the other dimensions of the variable (e.g. yh, xh)
+following lead. The index can be opened with xarray through
+fsspec's reference filesystem, so that the raw files are read in place.
+"""
+
+import base64
+import json
+import os
+import numpy as np
+import xarray as xr
+
+from esm4ppe.version import sysconfig
+from esm4ppe.organization import *
+from esm4ppe.processing import get_paths_esm4ppe, build_headerindex, get_headerindexpath
+from esm4ppe.utils import lazy_import
+
+h5py = lazy_import('h5py')
+cftime = lazy_import('cftime')
+
+# HDF5 and netCDF attributes that are not carried into the zarr metadata
+_internalattrs = ['DIMENSION_LIST','REFERENCE_LIST','CLASS','NAME','_Netcdf4Dimid',
+                  '_Netcdf4Coordinates','_FillValue','_nc3_strict']
+
+def get_virtualpath(variable,frequency):
+    """
+    Return the path of the reference index for the virtual ensemble store of a variable.
+    """
+    return '/'.join([sysconfig['zarrpathroot'],'virtual_zarr',
+                     '.'.join([get_zarrdir(variable,frequency),variable,'json'])])
+
+def _to_json(value):
+    if isinstance(value,bytes):
+        return value.decode()
+    if isinstance(value,np.ndarray):
+        value = value.tolist()
+        return value[0] if len(value)==1 else value
+    if isinstance(value,np.generic):
+        return value.item()
+    return value
+
+def _get_fillvalue(value):
+    if value is None:
+        return None
+    value = _to_json(value)
+    if isinstance(value,float) and np.isnan(value):
+        return 'NaN'
+    return value
+
+def _get_dims(dset,path):
+    """
+    Return the names of the dimensions of the HDF5 dataset [dset], from the netCDF
+    dimension scales attached to it.
+    """
+    dims = []
+    for dim in dset.dims:
+        if len(dim)==0:
+            raise Exception("Variable "+dset.name+" in "+path+" has a dimension without a name;"+
+                            " only netCDF4 files are supported.")
+        dims.append(dim[0].name.split('/')[-1])
+    return dims
+
+def read_chunkrefs(path,variable):
+    """
+    Return the storage layout of [variable] in the netCDF4/HDF5 file at [path]: its
+    dimensions, shape, chunk shape, dtype, compression filters, fill value and attributes,
+    and a list of (chunk index, byte offset, size) for every stored chunk. The first
+    dimension of [variable] must be time.
+    """
+    with h5py.File(path,'r') as f:
+        dset = f[variable]
+        dims = _get_dims(dset,path)
+        if (len(dims)==0) or (dims[0]!='time'):
+            raise Exception("Variable {"+variable+"} in "+path+" has dimensions "+str(dims)+
+                            "; the virtual store requires time as the first dimension.")
+        shape = dset.shape
+        if dset.chunks is None:
+            # Contiguous (uncompressed) storage is split into one chunk per time step
+            chunks = (1,)+shape[1:]
+            nbytes = int(np.prod(chunks))*dset.dtype.itemsize
+            refs = [((t,)+(0,)*(len(shape)-1),dset.id.get_offset()+t*nbytes,nbytes)
+                    for t in range(shape[0])]
+        else:
+            chunks = dset.chunks
+            refs = []
+            for i in range(dset.id.get_num_chunks()):
+                info = dset.id.get_chunk_info(i)
+                index = tuple(o//c for o,c in zip(info.chunk_offset,chunks))
+                refs.append((index,info.byte_offset,info.size))
+        if dset.fletcher32 or (dset.compression not in [None,'gzip']):
+            raise Exception("Unsupported compression {"+str(dset.compression)+"} in "+path)
+        fillvalue = dset.attrs.get('_FillValue',dset.fillvalue)
+        attrs = {key:_to_json(value) for key,value in dset.attrs.items()
+                 if key not in _internalattrs}
+        return {'dims':dims,
+                'shape':shape,
+                'chunks':chunks,
+                'dtype':dset.dtype.str,
+                'shuffle':bool(dset.shuffle),
+                'compression':dset.compression_opts if dset.compression=='gzip' else None,
+                'fillvalue':_get_fillvalue(fillvalue),
+                'attrs':attrs,
+                'refs':refs}
+
+def _inline_array(refs,name,values,dims,attrs={}):
+    """
+    Add a small coordinate array to [refs], storing its data inline.
+    """
+    values = np.ascontiguousarray(values)
+    refs[name+'/.zarray'] = json.dumps({'chunks':list(values.shape),'compressor':None,
+                                        'dtype':values.dtype.str,'fill_value':None,
+                                        'filters':None,'order':'C',
+                                        'shape':list(values.shape),'zarr_format':2})
+    refs[name+'/.zattrs'] = json.dumps(dict(attrs,_ARRAY_DIMENSIONS=dims))
+    refs[name+'/'+'.'.join(['0']*values.ndim)] = 'base64:'+base64.b64encode(values.tobytes()).decode()
+
+def build_virtualensemble(variable,frequency,constraint=None,startyear='*',startmonth=None,save=True):
+    """
+    Build the reference index of the virtual ensemble store for the given variable and
+    frequency, saving it to get_virtualpath if [save]. The init, member and lead of each file
+    are taken from the header index (see processing.build_headerindex). All files must share
+    the same chunk layout, and the first lead of each file must fall on a chunk boundary.
+    """
+    paths = get_paths_esm4ppe(variable,frequency,constraint,startyear,startmonth)
+    index = build_headerindex(paths,get_headerindexpath(variable,frequency))
+    inits = sorted({(h['startyear'],h['startmonth']) for h in index.values()})
+    members = sorted({h['member'] for h in index.values()})
+    nlead = max([h['leadstart']-1+h['nt'] for h in index.values()])
+    leadunits = list(index.values())[0]['leadunits']
+
+    refs = {'.zgroup':json.dumps({'zarr_format':2}),'.zattrs':json.dumps({})}
+    layout = None
+    for path,header in index.items():
+        filelayout = read_chunkrefs(path,variable)
+        if layout is None:
+            layout = filelayout
+            ct = layout['chunks'][0]
+        elif (filelayout['chunks']!=layout['chunks']) or (filelayout['dims']!=layout['dims']):
+            raise Exception("Chunk layout of "+path+" differs from that of the other files.")
+        leadoffset = header['leadstart']-1
+        if leadoffset%ct!=0:
+            raise Exception("First lead of "+path+" does not fall on a chunk boundary.")
+        i = inits.index((header['startyear'],header['startmonth']))
+        m = members.index(header['member'])
+        for chunkindex,offset,size in filelayout['refs']:
+            key = '.'.join([str(i),str(m),str(leadoffset//ct+chunkindex[0])]+[str(c) for c in chunkindex[1:]])
+            refs[variable+'/'+key] = [path,int(offset),int(size)]
+
+    filters = None
+    if layout['shuffle']:
+        filters = [{'id':'shuffle','elementsize':np.dtype(layout['dtype']).itemsize}]
+    compressor = None
+    if layout['compression'] is not None:
+        compressor = {'id':'zlib','level':int(layout['compression'])}
+    refs[variable+'/.zarray'] = json.dumps({'chunks':[1,1]+list(layout['chunks']),'compressor':compressor,
+                                            'dtype':layout['dtype'],
+                                            'fill_value':layout['fillvalue'],
+                                            'filters':filters,'order':'C',
+                                            'shape':[len(inits),len(members),nlead]+list(layout['shape'][1:]),
+                                            'zarr_format':2})
+    refs[variable+'/.zattrs'] = json.dumps(dict(layout['attrs'],
+                                                _ARRAY_DIMENSIONS=['init','member','lead']+layout['dims'][1:]))
+    # Coordinates of the other dimensions, for those that have a coordinate variable
+    with h5py.File(list(index.keys())[0],'r') as f:
+        for dim in layout['dims'][1:]:
+            if str(_to_json(f[dim].attrs.get('NAME',b''))).startswith('This is a netCDF dimension'):
+                continue
+            attrs = {key:_to_json(value) for key,value in f[dim].attrs.items()
+                     if key not in _internalattrs}
+            _inline_array(refs,dim,f[dim][:],[dim],attrs)
+    initdays = cftime.date2num([cftime.DatetimeNoLeap(y,m,1) for y,m in inits],
+                               'days since 0001-01-01 00:00:00','noleap')
+    _inline_array(refs,'init',np.array(initdays,dtype='f8'),['init'],
+                  {'units':'days since 0001-01-01 00:00:00','calendar':'noleap'})
+    _inline_array(refs,'member',np.array(members,dtype='i8'),['member'])
+    _inline_array(refs,'lead',np.arange(1,nlead+1,dtype='i8'),['lead'],{'units':leadunits})
+
+    refs = {'version':1,'refs':refs}
+    if save:
+        path = get_virtualpath(variable,frequency)
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        with open(path+'.'+str(os.getpid()),'w') as f:
+            json.dump(refs,f)
+        os.replace(path+'.'+str(os.getpid()),path)
+    return refs
+
+def open_virtualensemble(variable,frequency,constraint=None,build=False):
+    """
+    Open the virtual ensemble store for the given variable and frequency, reading the raw
+    files in place. If [build], or if the reference index does not exist, it is built first.
+    """
+    path = get_virtualpath(variable,frequency)
+    if build or (not os.path.exists(path)):
+        build_virtualensemble(variable,frequency,constraint)
+    ds = xr.open_dataset('reference://',engine='zarr',chunks={},
+                         backend_kwargs={'consolidated':False,
+                                         'storage_options':{'fo':path}})
+    # only open 1st year of data for daily data
+    if (frequency == "daily") & (sysconfig['nt_fordaily'] is not None):
+        ds = ds.isel(lead=slice(0,sysconfig['nt_fordaily']))
+    return ds
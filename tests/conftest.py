@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+import pytest
+
+
+class FakeTape:
+    """
+    Stand-in for query_ondisk and issue_dmget: each file reaches the disk after a given
+    number of dmgets (never, if None).
+    """
+    def __init__(self, needed):
+        self.needed = needed
+        self.dmgets = {path: 0 for path in needed}
+        self.queries = 0
+
+    def query_ondisk(self, paths):
+        self.queries += 1
+        return {path: (self.needed[path] is not None) and (self.dmgets[path] >= self.needed[path])
+                for path in paths}
+
+    def issue_dmget(self, paths):
+        for path in paths:
+            self.dmgets[path] += 1
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Replace the sleeps and the clock of the manager with a simulated clock, recording the
+    polling intervals.
+    """
+    class Clock:
+        now = 0.
+        waits = []
+
+        def time(self):
+            return self.now
+
+    clock = Clock()
+    sleep = asyncio.sleep
+
+    async def fakesleep(wait):
+        clock.waits.append(wait)
+        clock.now += wait
+        await sleep(0)
+
+    monkeypatch.setattr(asyncio, 'sleep', fakesleep)
+    monkeypatch.setattr(time, 'time', clock.time)
+    return clock
+
+
+@pytest.fixture
+def faketape():
+    return FakeTape
@@ -0,0 +1,38 @@
+import cftime
+import numpy as np
+import xarray as xr
+
+from esm4ppe.moments import calc_climatologicalmean
+from esm4ppe.calculations import calc_controlanomaly, calc_ensembleanomaly
+
+
+def _control():
+    rng = np.random.default_rng(0)
+    time = xr.date_range('0101-03-01', periods=60, freq='MS', calendar='noleap', use_cftime=True)
+    return xr.Dataset({'tos': (('time', 'yh', 'xh'), rng.normal(size=(60, 4, 5)).astype('f4'))},
+                      coords={'time': time, 'yh': np.arange(4.), 'xh': np.arange(5.)})
+
+
+def test_controlanomaly_keeps_chunks():
+    control = _control().chunk({'time': 7, 'yh': 2})
+    clim = calc_climatologicalmean(control, 'monthly').load()
+    anomaly = calc_controlanomaly(control, clim, 'monthly')
+    assert anomaly['tos'].chunks == control['tos'].chunks
+    # The climatology is not gathered to the length of the control in the graph
+    graph = dict(anomaly['tos'].data.__dask_graph__())
+    assert max(getattr(v, 'nbytes', 0) for v in graph.values()) <= clim['tos'].nbytes
+    np.testing.assert_allclose(anomaly['tos'], control['tos'].groupby('time.month')-clim['tos'], rtol=1e-6)
+
+
+def test_ensembleanomaly_by_initmonth():
+    rng = np.random.default_rng(1)
+    clim = calc_climatologicalmean(_control(), 'monthly')
+    inits = [cftime.DatetimeNoLeap(101, 1, 1), cftime.DatetimeNoLeap(101, 4, 1), cftime.DatetimeNoLeap(102, 1, 1)]
+    ensemble = xr.Dataset({'tos': (('member', 'init', 'lead', 'yh', 'xh'), rng.normal(size=(2, 3, 24, 4, 5)))},
+                          coords={'member': [1, 2], 'init': inits, 'lead': np.arange(1, 25)})
+    anomaly = calc_ensembleanomaly(ensemble.chunk({'lead': 5, 'xh': 2}), clim, 'monthly')
+    expected = ensemble['tos'].values.copy()
+    for i, init in enumerate(inits):
+        for lead in range(24):
+            expected[:, i, lead] -= clim['tos'].sel(month=(init.month-1+lead) % 12+1).values
+    np.testing.assert_allclose(anomaly['tos'], expected)
@@ -0,0 +1,53 @@
+import numpy as np
+import xarray as xr
+
+from esm4ppe.calculations import (get_bootstrapcounts, calc_skill, _resampled_sums,
+                                  _bootstrap_ensemblevariance, _bootstrap_acc)
+
+
+def _members(counts):
+    # The members drawn in each resampling, from the number of times each is drawn
+    return [np.repeat(np.arange(counts.shape[1]), c.astype(int)) for c in counts]
+
+
+def _ensemble(nmember=6, ninit=5):
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(3, 1, ninit, 1))+rng.normal(size=(3, 4, ninit, nmember))
+    x[0, 1, 2, 3] = np.nan
+    return x
+
+
+def test_counts_are_resamplings():
+    counts = get_bootstrapcounts(6, 50, seed=1)
+    assert counts.shape == (50, 6)
+    np.testing.assert_array_equal(counts.sum(axis=1), 6)
+    np.testing.assert_array_equal(get_bootstrapcounts(6, 50, seed=1), counts)
+
+
+def test_resampled_sums_match_explicit_resampling():
+    x = _ensemble()
+    counts = get_bootstrapcounts(6, 20, seed=2)
+    n, s, q = _resampled_sums(x, counts)
+    for k, members in enumerate(_members(counts)):
+        resampled = x[..., members]
+        np.testing.assert_array_equal(n[..., k], np.isfinite(resampled).sum(axis=-1))
+        np.testing.assert_allclose(s[..., k], np.nansum(resampled, axis=-1))
+        np.testing.assert_allclose(q[..., k], np.nansum(resampled**2, axis=-1))
+
+
+def test_bootstrap_variance_matches_explicit_resampling():
+    x = _ensemble()
+    counts = get_bootstrapcounts(6, 20, seed=3)
+    var = _bootstrap_ensemblevariance(x, counts, batch=7)
+    expected = np.stack([np.nanvar(x[..., members], axis=-1) for members in _members(counts)], axis=-1)
+    np.testing.assert_allclose(var, expected, atol=1e-12)
+
+
+def test_bootstrap_acc_matches_skill_of_resampled_ensemble():
+    x = _ensemble()
+    counts = get_bootstrapcounts(6, 20, seed=4)
+    acc = _bootstrap_acc(x, counts, batch=7)
+    for k, members in enumerate(_members(counts)):
+        ds = xr.DataArray(x[..., members], dims=('lead', 'xh', 'init', 'member'))
+        expected = calc_skill(ds, None, ['acc'])['acc'].transpose('lead', 'xh')
+        np.testing.assert_allclose(acc[..., k], expected)
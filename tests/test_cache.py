@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+import xarray as xr
+
+from esm4ppe.cache import get_storeidentity, stamp_store, is_saved, read_saved, to_netcdf_atomic
+
+
+def test_identity_changes_on_region_rewrite(tmp_path):
+    path = str(tmp_path/'store')
+    ds = xr.Dataset({'tos': (('time', 'xh'), np.zeros((8, 3), 'f4'))})
+    ds.chunk({'time': 2}).to_zarr(path)
+    stamp_store(path, 'tos')
+    identity = get_storeidentity(path, 'tos')
+    assert get_storeidentity(path, 'tos') == identity
+    ds.isel(time=slice(4, 6)).assign(tos=lambda d: d['tos']+1).to_zarr(path, region={'time': slice(4, 6)})
+    # The metadata are unchanged: the writers stamp the store
+    stamp_store(path, 'tos')
+    assert get_storeidentity(path, 'tos') != identity
+    # Appending changes the metadata
+    identity = get_storeidentity(path, 'tos')
+    ds.isel(time=slice(0, 2)).to_zarr(path, append_dim='time')
+    assert get_storeidentity(path, 'tos') != identity
+
+
+def test_saved_results(tmp_path):
+    path = str(tmp_path/'result.nc')
+    ds = xr.Dataset({'tos': ('xh', np.arange(3.))})
+    ds.attrs['esm4ppe_cache'] = '{"key": "abc"}'
+    assert not is_saved(ds, path)
+    to_netcdf_atomic(ds, path)
+    assert is_saved(ds, path)
+    assert read_saved(path, 'abc') is not None
+    assert read_saved(path, 'def') is None
+    # Results saved before the cache carry no key and are reused
+    to_netcdf_atomic(xr.Dataset({'tos': ('xh', np.arange(3.))}), path)
+    assert read_saved(path, 'def') is not None
+    assert is_saved(xr.open_dataset(path), path)
+    assert os.listdir(tmp_path) == ['result.nc']
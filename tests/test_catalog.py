@@ -0,0 +1,80 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from esm4ppe import catalog
+from esm4ppe.version import sysconfig
+from esm4ppe.catalog import query_catalog, register_product
+from esm4ppe.cache import to_netcdf_atomic
+from esm4ppe.classes import open_verify
+
+
+@pytest.fixture
+def roots(tmp_path, monkeypatch):
+    for key in ['verifypathroot', 'regionalmeanpathroot', 'climatologypathroot',
+                'correlationpathroot', 'otherpathroot']:
+        monkeypatch.setitem(sysconfig, key, str(tmp_path/key))
+    return tmp_path
+
+
+def _save(variable, xh):
+    path = '/'.join([sysconfig['verifypathroot'], 'verify.metric-ppp', 'ocean.'+variable+'.monthly.nc'])
+    ds = xr.Dataset({variable: (('lead', 'xh'), np.ones((3, len(xh))))},
+                    coords={'lead': [1, 2, 3], 'xh': xh})
+    to_netcdf_atomic(ds, path)
+    return path
+
+
+def test_open_verify_records_missing_files(roots):
+    register_product(_save('tos', [0., 1.]))
+    _save('sos', [0., 1.])
+    assert [e['variable'] for e in query_catalog(kind='verify')] == ['tos']
+    assert sorted(open_verify('ocean', 'monthly', 'ppp').data_vars) == ['sos', 'tos']
+    assert list(open_verify('ocean', 'monthly', 'ppp', variables=['sos']).data_vars) == ['sos']
+    assert len(query_catalog(kind='verify')) == 2
+
+
+def test_open_verify_aligns_different_coordinates(roots):
+    _save('tos', [0., 1.])
+    _save('sos', [1., 2.])
+    ds = open_verify('ocean', 'monthly', 'ppp')
+    assert list(ds['xh'].values) == [0., 1., 2.]
+    assert np.isnan(ds['sos'].sel(xh=0.)).all() and np.isnan(ds['tos'].sel(xh=2.)).all()
+
+
+def test_open_verify_searches_only_changed_directories(roots, monkeypatch):
+    register_product(_save('tos', [0., 1.]))
+    globs = []
+    glob = catalog.glob.glob
+    monkeypatch.setattr(catalog.glob, 'glob', lambda pattern: globs.append(pattern) or glob(pattern))
+    open_verify('ocean', 'monthly', 'ppp')
+    assert len(globs) > 0
+    del globs[:]
+    assert list(open_verify('ocean', 'monthly', 'ppp').data_vars) == ['tos']
+    assert globs == []
+    # A file saved without the catalog changes the directory
+    _save('sos', [0., 1.])
+    assert sorted(open_verify('ocean', 'monthly', 'ppp').data_vars) == ['sos', 'tos']
+
+
+_writer = """
+import sys
+from esm4ppe.version import sysconfig
+from esm4ppe.catalog import register_product
+for key in ['verifypathroot', 'otherpathroot']:
+    sysconfig[key] = '/'.join([sys.argv[1], key])
+for path in sys.argv[2:]:
+    register_product(path)
+"""
+
+
+def test_concurrent_registrations(roots):
+    paths = [_save('v%d' % i, [0., 1.]) for i in range(12)]
+    writers = [subprocess.Popen([sys.executable, '-c', _writer, str(roots)]+paths[i::4]) for i in range(4)]
+    assert [writer.wait() for writer in writers] == [0]*4
+    assert sorted(e['path'] for e in query_catalog(kind='verify')) == sorted(os.path.abspath(p) for p in paths)
+    assert not os.path.exists(catalog.get_catalogpath()+'.lockdir')
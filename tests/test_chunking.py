@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from esm4ppe.chunking import plan_chunks, write_slabs, _plan_region
+
+
+def test_region_fits_memory():
+    # Whole fields of the full ensemble, rechunked to time series
+    sizes = {'member': 11, 'init': 40, 'lead': 120, 'yh': 576, 'xh': 720}
+    readchunks = {'member': 1, 'init': 1, 'lead': 12, 'yh': 576, 'xh': 720}
+    chunks = plan_chunks(sizes, 4, 'timeseries')
+    region = _plan_region(sizes, chunks, readchunks, 4, 2e9)
+    assert 4*np.prod(list(region.values())) <= 1e9
+    assert all(region[d] % chunks[d] == 0 or region[d] == sizes[d] for d in sizes)
+    with pytest.raises(Exception, match='does not fit'):
+        _plan_region(sizes, chunks, readchunks, 4, 1e8)
+
+
+def test_write_slabs_through_intermediate(tmp_path, capsys):
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(2, 3, 24, 16, 20)).astype('f4')
+    ds = xr.Dataset({'tos': (('member', 'init', 'lead', 'yh', 'xh'), data)},
+                    coords={'lead': np.arange(1, 25), 'yh': np.arange(16.), 'xh': np.arange(20.)})
+    ds = ds.chunk({'member': 1, 'init': 1, 'lead': 6, 'yh': 16, 'xh': 20})
+    dst = str(tmp_path/'store')
+    chunks = {'member': 2, 'init': 3, 'lead': 24, 'yh': 4, 'xh': 5}
+    write_slabs(ds, 'tos', dst, chunks, 'timeseries', memory=3e4)
+    assert 'intermediate' in capsys.readouterr().out
+    out = xr.open_zarr(dst)
+    assert out['tos'].encoding['chunks'] == tuple(chunks.values())
+    np.testing.assert_array_equal(out['tos'].values, data)
+    assert sorted(os.listdir(tmp_path)) == ['store', 'store.tos.stamp']
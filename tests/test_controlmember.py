@@ -0,0 +1,50 @@
+import cftime
+import numpy as np
+import xarray as xr
+
+from esm4ppe.processing import add_controlasmember
+
+
+def _months(year, month, n):
+    return [cftime.DatetimeNoLeap(year+(month-1+i)//12, (month-1+i) % 12+1, 1) for i in range(n)]
+
+
+def _control(nyears=8):
+    bnds = _months(101, 1, 12*nyears+1)
+    time = [bnds[i]+(bnds[i+1]-bnds[i])/2 for i in range(12*nyears)]
+    data = np.random.default_rng(0).normal(size=(12*nyears, 2, 3))
+    return xr.Dataset({'tos': (('time', 'yh', 'xh'), data)}, coords={'time': time})
+
+
+def _ensemble(inits, nlead=20):
+    data = np.zeros((2, len(inits), nlead, 2, 3))
+    bnds = np.array([[_months(y, m, nlead+1)[:-1], _months(y, m, nlead+1)[1:]] for y, m in inits])
+    time_bnds = np.broadcast_to(bnds.transpose(0, 2, 1)[np.newaxis], (2, len(inits), nlead, 2))
+    return xr.Dataset({'tos': (('member', 'init', 'lead', 'yh', 'xh'), data),
+                       'time_bnds': (('member', 'init', 'lead', 'nv'), time_bnds)},
+                      coords={'member': [1, 2], 'init': [cftime.DatetimeNoLeap(y, m, 1) for y, m in inits],
+                              'lead': np.arange(1, nlead+1)})
+
+
+def test_controlasmember_matches_time_slices():
+    inits = [(102, 1), (102, 4), (104, 1), (106, 7)]
+    control = _control()
+    ds = add_controlasmember(_ensemble(inits), control)
+    assert list(ds['member'].values) == [0, 1, 2]
+    for i, (y, m) in enumerate(inits):
+        # January initializations are run for all 20 leads, others for 3/10 of them
+        nlead = 20 if m == 1 else 6
+        bnds = _months(y, m, nlead+1)
+        expected = control['tos'].sel(time=slice(bnds[0], bnds[-1])).values
+        member = ds['tos'].isel(member=0, init=i).values
+        np.testing.assert_array_equal(member[:nlead], expected)
+        assert np.isnan(member[nlead:]).all()
+
+
+def test_controlasmember_beyond_control():
+    # The control ends partway through the last initialization
+    control = _control(nyears=4)
+    ds = add_controlasmember(_ensemble([(104, 1)]), control)
+    member = ds['tos'].isel(member=0, init=0).values
+    np.testing.assert_array_equal(member[:12], control['tos'].values[36:])
+    assert np.isnan(member[12:]).all()
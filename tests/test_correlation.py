@@ -0,0 +1,39 @@
+import numpy as np
+import xarray as xr
+from scipy import stats
+
+from esm4ppe.correlation import calc_laggedcorrelation
+
+
+def _pair(dims, shape):
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=shape)
+    y = 0.5*np.roll(x, 2, axis=0)+rng.normal(size=shape)
+    x[3, ...] = np.nan
+    y[7, ...] = np.nan
+    return xr.DataArray(x, dims=dims), xr.DataArray(y, dims=dims)
+
+
+def test_laggedcorrelation_matches_xr_corr():
+    lags = [-3, 0, 2, 5]
+    x, y = _pair(('time', 'xh'), (60, 4))
+    corr = calc_laggedcorrelation(x.chunk({'time': 25}), y.chunk({'time': 25}), lags)
+    for lag in lags:
+        np.testing.assert_allclose(corr.sel(lag=lag), xr.corr(x, y.shift(time=-lag), dim='time'))
+    # The ensemble is correlated over inits and members and lagged along lead
+    x, y = _pair(('lead', 'init', 'member', 'xh'), (12, 5, 4, 3))
+    corr = calc_laggedcorrelation(x.chunk({'init': 2}), y.chunk({'init': 2}), lags)
+    for lag in lags:
+        np.testing.assert_allclose(corr.sel(lag=lag).transpose('lead', 'xh'),
+                                   xr.corr(x, y.shift(lead=-lag), dim=['init', 'member']))
+
+
+def test_spearman_matches_scipy():
+    x, y = _pair(('time', 'xh'), (60, 4))
+    corr = calc_laggedcorrelation(x.chunk({'time': 25}), y.chunk({'time': 25}), [0, 2], method='spearman')
+    for lag in [0, 2]:
+        ylag = y.shift(time=-lag)
+        for ix in range(4):
+            a, b = x.values[:, ix], ylag.values[:, ix]
+            valid = np.isfinite(a) & np.isfinite(b)
+            np.testing.assert_allclose(corr.sel(lag=lag).isel(xh=ix), stats.spearmanr(a[valid], b[valid])[0])
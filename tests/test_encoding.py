@@ -0,0 +1,40 @@
+import numpy as np
+import xarray as xr
+
+from esm4ppe.version import sysconfig
+from esm4ppe.encoding import apply_encoding, round_bits
+
+
+def _round_reference(x, keepbits):
+    # Round the significand (keepbits+1 significant bits) to nearest, ties to even
+    m, e = np.frexp(x.astype('f8'))
+    return np.ldexp(np.round(m*2.**(keepbits+1))/2.**(keepbits+1), e).astype(x.dtype)
+
+
+def test_round_bits_matches_reference():
+    rng = np.random.default_rng(0)
+    for dtype in ['f4', 'f8']:
+        x = (rng.normal(size=1000)*10.**rng.integers(-5, 5, size=1000)).astype(dtype)
+        for keepbits in [1, 7, 12]:
+            np.testing.assert_array_equal(round_bits(x, keepbits), _round_reference(x, keepbits))
+    # Ties go to the even mantissa: 1+2**-8 and 1+3*2**-8 kept to 7 bits
+    x = np.array([1+2**-8, 1+3*2**-8], 'f4')
+    np.testing.assert_array_equal(round_bits(x, 7), np.array([1, 1+4*2**-8], 'f4'))
+    x = np.array([np.nan, np.inf, -np.inf, 0.], 'f4')
+    np.testing.assert_array_equal(round_bits(x, 3), x)
+
+
+def test_default_profile_is_lossless(tmp_path, monkeypatch):
+    monkeypatch.setitem(sysconfig, 'encodingprofile', 'default')
+    monkeypatch.setitem(sysconfig, 'encodingvariables', {})
+    data = np.random.default_rng(1).normal(size=(4, 5))
+    ds = xr.Dataset({'tos': (('yh', 'xh'), data)})
+    path = str(tmp_path/'store')
+    ds, kwargs = apply_encoding(ds, 'tos', path)
+    ds.to_zarr(path, **kwargs)
+    out = xr.open_zarr(path)['tos']
+    assert out.dtype == np.float64
+    np.testing.assert_array_equal(out.values, data)
+    # The lossy profiles are opt-in
+    ds, kwargs = apply_encoding(ds, 'tos', str(tmp_path/'other'), profile='float32')
+    assert ds['tos'].dtype == np.float32
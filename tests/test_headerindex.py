@@ -0,0 +1,33 @@
+import cftime
+import numpy as np
+import xarray as xr
+
+from esm4ppe.processing import build_headerindex
+
+
+def _write_file(path, startyear, startmonth, member, year0, nt):
+    bnds = [cftime.DatetimeNoLeap(year0+(startmonth-1+i)//12, (startmonth-1+i) % 12+1, 1) for i in range(nt+1)]
+    time = [bnds[i]+(bnds[i+1]-bnds[i])/2 for i in range(nt)]
+    ds = xr.Dataset({'tos': (('time', 'yh', 'xh'), np.zeros((nt, 2, 3), 'f4')),
+                     'time_bnds': (('time', 'nv'), np.array([bnds[:-1], bnds[1:]]).T)},
+                    coords={'time': time, 'nv': [1, 2]},
+                    attrs={'title': 'ESM4_piControl_D-ensemble-'+'{:04d}{:02d}01'.format(startyear, startmonth)
+                           +'-'+str(member).zfill(2)})
+    ds.to_netcdf(path)
+
+
+def test_headerindex_parallel_matches_serial(tmp_path):
+    paths = []
+    for member in [1, 2]:
+        for year0 in [123, 125]:
+            path = str(tmp_path/'{}.{}.nc'.format(member, year0))
+            _write_file(path, 123, 1, member, year0, 24)
+            paths.append(path)
+    indexpath = str(tmp_path/'index'/'tos.json')
+    parallel = build_headerindex(paths, indexpath, nworkers=2, minparallel=1)
+    serial = build_headerindex(paths, nworkers=1)
+    assert parallel == serial
+    assert [header['leadstart'] for header in serial.values()] == [1, 25, 1, 25]
+    assert [header['member'] for header in serial.values()] == [1, 1, 2, 2]
+    # Unchanged files are taken from the persisted index
+    assert build_headerindex(paths, indexpath, nworkers=2, minparallel=1) == parallel
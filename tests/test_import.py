@@ -0,0 +1,32 @@
+import subprocess
+import sys
+import types
+
+
+def _run(code):
+    return subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+
+
+def test_import_is_light():
+    heavy = ['climpred', 'dask', 'gfdl_utils', 'scipy', 'xarray', 'zarr']
+    loaded = _run("import sys, esm4ppe; print(' '.join(sorted(sys.modules)))").split()
+    assert [name for name in heavy if name in loaded] == []
+
+
+def test_submodules_and_functions():
+    # The recall function and its submodule have distinct names
+    out = _run("import esm4ppe.recallmanager as r, esm4ppe; print(type(r).__name__, "
+               "type(esm4ppe.recall).__name__)")
+    assert out.split() == ['module', 'function']
+    import esm4ppe
+    from esm4ppe import recall
+    assert isinstance(recall, types.FunctionType)
+    assert isinstance(esm4ppe.moments, types.ModuleType)
+
+
+def test_star_import_exports_only_own_names():
+    names = _run("from esm4ppe import *; print(' '.join(sorted(dir())))").split()
+    assert {'recall', 'RecallManager', 'open_ensemble', 'lazy_import'} <= set(names)
+    # Neither the lazy stand-ins for dependencies nor names imported by the submodules
+    excluded = ['gu', 'dask', 'cp', 'zarr', 'cftime', 'sparse', 'dsa', 'contextmanager', 'LazyModule']
+    assert [name for name in excluded if name in names] == []
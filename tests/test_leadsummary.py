@@ -0,0 +1,13 @@
+import numpy as np
+import xarray as xr
+
+from esm4ppe.calculations import calc_leadsummary
+from esm4ppe.classes import _get_leadsummaryargs
+
+
+def test_single_leadsummary_as_string():
+    skill = xr.DataArray(np.exp(-np.arange(1, 13)/4.), dims='lead', coords={'lead': np.arange(1, 13)})
+    reduced = calc_leadsummary(skill, 'horizon', 0.5)
+    assert list(reduced['summary'].values) == ['horizon']
+    assert reduced.identical(calc_leadsummary(skill, ['horizon'], 0.5))
+    assert _get_leadsummaryargs('horizon', 0.5) == {'leadsummary': ['horizon'], 'threshold': '0.5'}
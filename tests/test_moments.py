@@ -0,0 +1,46 @@
+import cftime
+import numpy as np
+import xarray as xr
+
+from esm4ppe.moments import calc_variance, calc_climatologicalvariance
+from esm4ppe.calculations import calc_ppp
+
+
+def _ensemble_and_control():
+    """
+    A small ensemble and control holding, like those read from the raw files, the cftime
+    average_T1 alongside the data.
+    """
+    rng = np.random.default_rng(0)
+    time = xr.date_range('0101-01-01', periods=48, freq='MS', calendar='noleap', use_cftime=True)
+    control = xr.Dataset({'tos': (('time', 'xh'), rng.normal(size=(48, 3))),
+                          'average_T1': ('time', time.values)},
+                         coords={'time': time})
+    inits = [cftime.DatetimeNoLeap(101, 1, 1), cftime.DatetimeNoLeap(102, 1, 1)]
+    ensemble = xr.Dataset({'tos': (('member', 'init', 'lead', 'xh'), rng.normal(size=(4, 2, 12, 3))),
+                           'average_T1': (('init', 'lead'), np.full((2, 12), inits[0]))},
+                          coords={'member': np.arange(4), 'init': inits, 'lead': np.arange(1, 13)})
+    return ensemble, control
+
+
+def test_variance_drops_nonnumeric():
+    ensemble, control = _ensemble_and_control()
+    evar = calc_variance(ensemble, 'member')
+    assert list(evar.data_vars) == ['tos']
+    np.testing.assert_allclose(evar['tos'], ensemble['tos'].var('member'))
+    evar = calc_variance(ensemble.chunk({'member': 2}), 'member').compute()
+    np.testing.assert_allclose(evar['tos'], ensemble['tos'].var('member'))
+
+
+def test_climatologicalvariance_drops_nonnumeric():
+    ensemble, control = _ensemble_and_control()
+    cvar = calc_climatologicalvariance(control, 'monthly')
+    assert list(cvar.data_vars) == ['tos']
+    np.testing.assert_allclose(cvar['tos'], control['tos'].groupby('time.month').var('time'))
+
+
+def test_ppp_with_nonnumeric():
+    ensemble, control = _ensemble_and_control()
+    ppp = calc_ppp(ensemble, control, None, 'monthly', 12)
+    assert list(ppp.data_vars) == ['tos']
+    assert ppp['tos'].sizes == {'lead': 12, 'xh': 3}
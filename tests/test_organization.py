@@ -0,0 +1,72 @@
+import json
+import os
+import types
+
+import pytest
+
+from esm4ppe import organization
+from esm4ppe.version import sysconfig
+from esm4ppe.organization import (get_lagsname, get_path_correlation, get_ppcatalogpath, find_variable,
+                                  get_timefrequency, clear_ppcatalog)
+
+
+def test_correlation_paths_differ_by_lags():
+    lagsets = [[0], [-12, 0, 12], [0, 6], list(range(-24, 25)), list(range(-12, 13))]
+    paths = [get_path_correlation('tos', 'sos', 'monthly', monthly=True,
+                                  **({get_lagsname(lags): True} if get_lagsname(lags) else {}))
+             for lags in lagsets]
+    assert len(set(paths)) == len(lagsets)
+    assert get_lagsname(range(-12, 13)) == get_lagsname(list(range(-12, 13)))
+
+
+@pytest.fixture
+def pp(tmp_path, monkeypatch):
+    """
+    A pp with two ppnames, and a stand-in for the gfdl_utils lookups counting its calls.
+    """
+    monkeypatch.setitem(sysconfig, 'otherpathroot', str(tmp_path/'other'))
+    pp = str(tmp_path/'pp')
+    for ppname in ['ocean_monthly', 'ocean_annual']:
+        os.makedirs('/'.join([pp, ppname, 'ts', ppname.split('_')[1], '5yr']))
+    calls = []
+
+    def find(pp, variable):
+        calls.append(('find', variable))
+        return {'tos': ['ocean_monthly'], 'sos': ['ocean_monthly'], 'o2': ['ocean_annual']}[variable]
+
+    def frequency(pp, ppname):
+        calls.append(('frequency', ppname))
+        return ppname.split('_')[1]
+
+    core = types.SimpleNamespace(find_variable=find, get_timefrequency=frequency)
+    monkeypatch.setattr(organization, 'gu', types.SimpleNamespace(core=core))
+    clear_ppcatalog()
+    yield pp, calls
+    clear_ppcatalog()
+
+
+def test_ppcatalog_checks_only_ppnames_used(pp):
+    pp, calls = pp
+    assert find_variable(pp, 'tos') == ['ocean_monthly']
+    assert find_variable(pp, 'o2') == ['ocean_annual']
+    assert get_timefrequency(pp, 'ocean_monthly') == 'monthly'
+    # New files in ocean_annual leave the entries of ocean_monthly valid
+    os.makedirs('/'.join([pp, 'ocean_annual', 'ts', 'annual', '10yr']))
+    clear_ppcatalog()
+    del calls[:]
+    assert find_variable(pp, 'tos') == ['ocean_monthly']
+    assert get_timefrequency(pp, 'ocean_monthly') == 'monthly'
+    assert calls == []
+    assert find_variable(pp, 'o2') == ['ocean_annual']
+    assert calls == [('find', 'o2')]
+
+
+def test_ppcatalog_merges_concurrent_writers(pp):
+    pp, calls = pp
+    find_variable(pp, 'tos')
+    # Another process that read the catalog before tos was added to it
+    organization._ppcatalog[pp]['variables'].pop('tos')
+    find_variable(pp, 'sos')
+    with open(get_ppcatalogpath()) as f:
+        assert sorted(json.load(f)[pp]['variables']) == ['sos', 'tos']
+    assert not os.path.exists(get_ppcatalogpath()+'.lockdir')
@@ -0,0 +1,21 @@
+import pytest
+
+from esm4ppe import pipeline
+from esm4ppe.recallmanager import RecallManager
+
+
+def test_pipeline_surfaces_failed_recalls(monkeypatch, clock, faketape):
+    tape = faketape({'tos.0.nc': 1, 'tos.1.nc': 2, 'sos.0.nc': None, 'intpp.0.nc': 0})
+    ingested = []
+    monkeypatch.setattr(pipeline.PreprocessJob, 'get_paths',
+                        lambda job: [path for path in tape.needed if path.startswith(job.variable+'.')])
+    monkeypatch.setattr(pipeline.PreprocessJob, 'ingest', lambda job: ingested.append(str(job)))
+    monkeypatch.setattr(pipeline, 'RecallManager',
+                        lambda **kwargs: RecallManager(query_ondisk=tape.query_ondisk,
+                                                       issue_dmget=tape.issue_dmget, **kwargs))
+    with pytest.raises(Exception, match='sos.monthly'):
+        pipeline.run_pipeline(['tos', 'sos', 'intpp'], 'monthly', nahead=2,
+                              poll=10, maxpoll=10, retrytime=30, maxretries=1)
+    # The other jobs are converted, intpp once tos frees its place in flight
+    assert ingested == ['tos.monthly', 'intpp.monthly']
+    assert tape.dmgets['sos.0.nc'] == 2
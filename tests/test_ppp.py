@@ -0,0 +1,42 @@
+import cftime
+import numpy as np
+import xarray as xr
+
+from esm4ppe.calculations import calc_controlvariance_initmonth, calc_ppp
+
+
+def _control(nyears=10):
+    time = xr.date_range('0101-01-01', periods=12*nyears, freq='MS', calendar='noleap', use_cftime=True)
+    seasonal = 1+np.sin(2*np.pi*np.arange(12*nyears)/12)[:, np.newaxis]
+    data = np.random.default_rng(0).normal(size=(12*nyears, 3))*seasonal
+    return xr.Dataset({'tos': (('time', 'xh'), data)}, coords={'time': time})
+
+
+def _rolled_controlvariance(control, nlead, month):
+    # The expand_dims/roll loop that the gather index replaced
+    cvar = control.groupby('time.month').var()
+    cvar = cvar.sel(month=np.tile(np.arange(1, 13), nlead//12)).rename({'month': 'lead'})
+    cvar = cvar.assign_coords({'lead': np.arange(1, nlead+1)})
+    return cvar.roll(lead=-(month-1))
+
+
+def test_controlvariance_matches_roll():
+    control = _control()
+    cvar = calc_controlvariance_initmonth(control, 'monthly', 36, [1, 4, 11])
+    for month in [1, 4, 11]:
+        expected = _rolled_controlvariance(control, 36, month)
+        np.testing.assert_allclose(cvar['tos'].sel(month=month).transpose(*expected['tos'].dims),
+                                   expected['tos'])
+
+
+def test_ppp_by_initmonth():
+    control = _control()
+    rng = np.random.default_rng(1)
+    inits = [cftime.DatetimeNoLeap(y, m, 1) for y in [102, 103] for m in [1, 7]]
+    ds = xr.Dataset({'tos': (('member', 'init', 'lead', 'xh'), rng.normal(size=(4, 4, 24, 3)))},
+                    coords={'member': np.arange(1, 5), 'init': inits, 'lead': np.arange(1, 25)})
+    ppp = calc_ppp(ds, control, 'month', 'monthly', 24)
+    for month in [1, 7]:
+        evar = ds['tos'].sel(init=ds['init'].dt.month == month).var('member').mean('init')
+        expected = 1-evar/_rolled_controlvariance(control, 24, month)['tos']
+        np.testing.assert_allclose(ppp['tos'].sel(month=month).transpose(*expected.dims), expected)
@@ -0,0 +1,42 @@
+import numpy as np
+import xarray as xr
+
+from esm4ppe.pyramid import calc_coarsen
+
+
+def _field(ny=7, nx=9):
+    rng = np.random.default_rng(0)
+    coords = {'yh': np.linspace(-60, 60, ny), 'xh': np.linspace(0, 360, nx, endpoint=False)}
+    data = rng.normal(size=(3, ny, nx))
+    data[:, :2, :2] = np.nan
+    data[0, 3, 4] = np.nan
+    areacello = xr.DataArray(rng.uniform(1, 2, size=(ny, nx)), dims=('yh', 'xh'), coords=coords)
+    ds = xr.Dataset({'acc': (('lead', 'yh', 'xh'), data, {'units': '1'}),
+                     'lead_bnds': (('lead', 'nv'), np.arange(6).reshape(3, 2))},
+                    coords=dict(coords, lead=np.arange(1, 4)), attrs={'title': 'skill'})
+    return ds, areacello
+
+
+def test_coarsen_matches_block_average():
+    ds, areacello = _field()
+    x, w = ds['acc'].values, areacello.values
+    for factor in [2, 4]:
+        coarse = calc_coarsen(ds, areacello, factor)
+        ny, nx = -(-x.shape[1]//factor), -(-x.shape[2]//factor)
+        assert coarse['acc'].shape == (3, ny, nx)
+        for j in range(ny):
+            for i in range(nx):
+                # Blocks at the edges are partial
+                block = np.s_[j*factor:(j+1)*factor, i*factor:(i+1)*factor]
+                for lead in range(3):
+                    valid = np.isfinite(x[lead][block])
+                    expected = ((x[lead][block]*w[block])[valid].sum()/w[block][valid].sum()
+                                if valid.any() else np.nan)
+                    np.testing.assert_allclose(coarse['acc'].values[lead, j, i], expected)
+                np.testing.assert_allclose(coarse['yh'][j], ds['yh'].values[j*factor:(j+1)*factor].mean())
+                np.testing.assert_allclose(coarse['xh'][i], ds['xh'].values[i*factor:(i+1)*factor].mean())
+        assert coarse.attrs == ds.attrs
+        assert coarse['acc'].attrs == ds['acc'].attrs
+        xr.testing.assert_identical(coarse['lead_bnds'], ds['lead_bnds'])
+    # A block with no valid cells is NaN
+    assert np.isnan(calc_coarsen(ds, areacello, 2)['acc'].values[:, 0, 0]).all()
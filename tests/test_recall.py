@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from esm4ppe.recallmanager import RecallManager, RecallError, arecall, recall
+
+
+def _manager(tape, **kwargs):
+    return RecallManager(query_ondisk=tape.query_ondisk, issue_dmget=tape.issue_dmget, **kwargs)
+
+
+def test_recall_retries_until_ondisk(clock, faketape):
+    tape = faketape({'a.nc': 0, 'b.nc': 1, 'c.nc': 3})
+    done = []
+
+    async def run():
+        await _manager(tape, poll=10, maxpoll=40, retrytime=100, maxretries=3).wait(
+            list(tape.needed), callback=done.append)
+
+    asyncio.run(run())
+    # a.nc was already on disk; c.nc needed two reissues
+    assert tape.dmgets == {'a.nc': 0, 'b.nc': 1, 'c.nc': 3}
+    assert sorted(done) == ['a.nc', 'b.nc', 'c.nc']
+
+
+def test_recall_backoff(clock, faketape):
+    tape = faketape({'a.nc': None})
+
+    async def run():
+        await _manager(tape, poll=10, maxpoll=40, retrytime=1000, maxretries=0).wait(['a.nc'])
+
+    with pytest.raises(RecallError):
+        asyncio.run(run())
+    # The interval doubles while nothing arrives, up to maxpoll
+    assert clock.waits[:4] == [10, 20, 40, 40]
+    assert set(clock.waits[3:]) == {40}
+
+
+def test_recall_error_after_maxretries(clock, faketape):
+    tape = faketape({'a.nc': None, 'b.nc': 1})
+    done = []
+
+    async def run():
+        manager = _manager(tape, poll=10, maxpoll=10, retrytime=30, maxretries=2)
+        futures = manager.request(['a.nc', 'b.nc'], callback=done.append)
+        await asyncio.wait(futures.values())
+        return futures
+
+    futures = asyncio.run(run())
+    assert futures['b.nc'].result() == 'b.nc'
+    with pytest.raises(RecallError):
+        futures['a.nc'].result()
+    # The first dmget and two reissues
+    assert tape.dmgets['a.nc'] == 3
+    assert done == ['b.nc']
+
+
+def test_recall_cancelled_callback(clock, faketape):
+    tape = faketape({'a.nc': None})
+    done = []
+    errors = []
+
+    async def run():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        manager = _manager(tape, poll=10)
+        futures = manager.request(['a.nc'], callback=done.append)
+        futures['a.nc'].cancel()
+        await asyncio.sleep(0)
+        manager._task.cancel()
+
+    asyncio.run(run())
+    assert done == []
+    assert errors == []
+
+
+def test_recall_within_running_loop(clock, faketape):
+    # e.g. esm4ppeObj.issue_dmget(wait=True) called from a Jupyter notebook
+    tape = faketape({'a.nc': 0, 'b.nc': 2})
+
+    async def run():
+        recall(['a.nc', 'b.nc'], query_ondisk=tape.query_ondisk, issue_dmget=tape.issue_dmget,
+               poll=10, retrytime=15)
+
+    asyncio.run(run())
+    assert tape.dmgets == {'a.nc': 0, 'b.nc': 2}
+
+
+def test_arecall(clock, faketape):
+    tape = faketape({'a.nc': 1})
+
+    async def run():
+        await arecall(['a.nc'], query_ondisk=tape.query_ondisk, issue_dmget=tape.issue_dmget)
+
+    asyncio.run(run())
+    assert tape.dmgets == {'a.nc': 1}
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from esm4ppe.masks import build_maskindex
+from esm4ppe.calculations import calc_regionalmean
+
+
+def _grid(ny=6, nx=8):
+    rng = np.random.default_rng(0)
+    coords = {'yh': np.arange(ny)+0.5, 'xh': np.arange(nx)+0.5}
+    data = rng.normal(size=(5, ny, nx))
+    data[:, 0, :3] = np.nan
+    da = xr.DataArray(data, dims=('lead', 'yh', 'xh'), coords=dict(coords, lead=np.arange(1, 6)), name='tos')
+    weights = xr.DataArray(rng.uniform(1, 2, size=(ny, nx)), dims=('yh', 'xh'), coords=coords)
+    yy, xx = np.meshgrid(np.arange(ny), np.arange(nx), indexing='ij')
+    masks = xr.Dataset({'west': (('yh', 'xh'), xx < nx//2),
+                        'north': (('yh', 'xh'), yy >= ny//2),
+                        'all': (('yh', 'xh'), np.ones((ny, nx), bool))}, coords=coords)
+    return da, weights, masks
+
+
+def test_compact_masks_match_boolean_masks():
+    da, weights, masks = _grid()
+    expected = calc_regionalmean(da, masks, weights)
+    compact = calc_regionalmean(da.chunk({'lead': 2}), build_maskindex(masks), weights)
+    np.testing.assert_allclose(compact.transpose(*expected.dims), expected)
+    # The grid dimensions in a different order
+    np.testing.assert_allclose(calc_regionalmean(da.transpose('lead', 'xh', 'yh'), build_maskindex(masks), weights),
+                               expected)
+
+
+def test_compact_masks_on_another_grid():
+    da, weights, masks = _grid()
+    maskindex = build_maskindex(masks)
+    with pytest.raises(Exception, match='does not match that of the masks'):
+        calc_regionalmean(da.isel(xh=slice(0, 7)), maskindex, weights.isel(xh=slice(0, 7)))
+    with pytest.raises(Exception, match='does not match that of the masks'):
+        calc_regionalmean(da.assign_coords(xh=da['xh']+1), maskindex, weights.assign_coords(xh=weights['xh']+1))
+
+
+def test_regionalmean_matches_weighted_mean():
+    da, weights, masks = _grid()
+    rm = calc_regionalmean(da.chunk({'lead': 2}), masks, weights)
+    assert rm.dims == ('lead', 'region')
+    for region in masks.data_vars:
+        expected = da.where(masks[region]).weighted(weights).mean(['yh', 'xh'])
+        np.testing.assert_allclose(rm.sel(region=region), expected)
@@ -0,0 +1,53 @@
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from esm4ppe.version import sysconfig
+from esm4ppe.processing import write_regionalmeanstore
+from esm4ppe.classes import open_regionalmeanstore
+
+_writer = """
+import sys
+import numpy as np, xarray as xr
+from esm4ppe.version import sysconfig
+from esm4ppe.processing import write_regionalmeanstore
+sysconfig['regionalmeanpathroot'] = sys.argv[1]
+i = int(sys.argv[2])
+rm = xr.Dataset({'v%d' % i: (('region', 'lead'), np.full((3, 4), float(i)))},
+                coords={'region': ['a', 'b', 'c'], 'lead': np.arange(1, 5)})
+write_regionalmeanstore(rm, 'v%d' % i, 'basin', 'monthly', 'ensemble')
+"""
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    monkeypatch.setitem(sysconfig, 'regionalmeanpathroot', str(tmp_path))
+    return str(tmp_path)
+
+
+def _rm(variable, lead, value=1.):
+    return xr.Dataset({variable: (('region', 'lead'), np.full((3, len(lead)), value))},
+                      coords={'region': ['a', 'b', 'c'], 'lead': lead})
+
+
+def test_store_grows_to_union_of_coordinates(root):
+    write_regionalmeanstore(_rm('tos', [1, 2, 3]), 'tos', 'basin', 'monthly', 'ensemble')
+    write_regionalmeanstore(_rm('sos', [2, 3], 2.), 'sos', 'basin', 'monthly', 'ensemble')
+    write_regionalmeanstore(_rm('chl', [3, 4, 5], 3.), 'chl', 'basin', 'monthly', 'ensemble')
+    ds = open_regionalmeanstore('basin', 'monthly')
+    assert list(ds['lead'].values) == [1, 2, 3, 4, 5]
+    np.testing.assert_array_equal(ds['tos'].isel(region=0), [1, 1, 1, np.nan, np.nan])
+    np.testing.assert_array_equal(ds['sos'].isel(region=0), [np.nan, 2, 2, np.nan, np.nan])
+    np.testing.assert_array_equal(ds['chl'].isel(region=0), [np.nan, np.nan, 3, 3, 3])
+
+
+def test_concurrent_writers(root):
+    writers = [subprocess.Popen([sys.executable, '-c', _writer, root, str(i)]) for i in range(1, 7)]
+    assert [writer.wait(timeout=300) for writer in writers] == [0]*6
+    ds = open_regionalmeanstore('basin', 'monthly')
+    assert sorted(ds.data_vars) == ['v%d' % i for i in range(1, 7)]
+    for i in range(1, 7):
+        assert (ds['v%d' % i] == i).all()
@@ -0,0 +1,47 @@
+import numpy as np
+import xarray as xr
+
+from esm4ppe.calculations import calc_skill, calc_crps, get_comparison
+
+
+def _ensemble(nmember=5, ninit=6, nlead=4):
+    rng = np.random.default_rng(0)
+    signal = rng.normal(size=(1, ninit, nlead, 3))
+    data = signal+0.8*rng.normal(size=(nmember, ninit, nlead, 3))
+    data[2, 1, 0, 0] = np.nan
+    return xr.DataArray(data, dims=('member', 'init', 'lead', 'xh'),
+                        coords={'member': np.arange(nmember), 'init': np.arange(ninit), 'lead': np.arange(1, nlead+1)})
+
+
+def _m2e(x):
+    # Each member against the mean of the other valid members, flattened over inits and members
+    forecast = np.stack([np.nanmean(np.delete(x, m, axis=0), axis=0) for m in range(x.shape[0])])
+    return forecast.ravel(), x.ravel()
+
+
+def test_skill_matches_bruteforce_m2e():
+    ds = _ensemble()
+    skill = calc_skill(ds.to_dataset(name='tos').chunk({'lead': 2}), None, ['acc', 'mse', 'rmse', 'mae', 'msess'])
+    values = ds.values
+    for il in range(values.shape[2]):
+        for ix in range(values.shape[3]):
+            f, v = _m2e(values[:, :, il, ix])
+            valid = np.isfinite(f) & np.isfinite(v)
+            f, v = f[valid], v[valid]
+            point = {'lead': il+1, 'xh': ix}
+            mse = ((f-v)**2).mean()
+            np.testing.assert_allclose(skill['acc']['tos'].sel(point), np.corrcoef(f, v)[0, 1])
+            np.testing.assert_allclose(skill['mse']['tos'].sel(point), mse)
+            np.testing.assert_allclose(skill['rmse']['tos'].sel(point), np.sqrt(mse))
+            np.testing.assert_allclose(skill['mae']['tos'].sel(point), abs(f-v).mean())
+            np.testing.assert_allclose(skill['msess']['tos'].sel(point), 1-mse/v.var())
+
+
+def test_crps_matches_pairwise():
+    ds = _ensemble().fillna(0.)
+    forecast, verif = get_comparison(ds, 'm2c')
+    crps = calc_crps(forecast.chunk({'lead': 2}), verif, ['init'])
+    x, y = forecast.values, verif.values
+    # E|X-y| - E|X-X'|/2 over all pairs of members
+    expected = (abs(x-y).mean(axis=0)-abs(x[:, np.newaxis]-x[np.newaxis]).mean(axis=(0, 1))/2).mean(axis=0)
+    np.testing.assert_allclose(crps.transpose('lead', 'xh'), expected)
@@ -0,0 +1,50 @@
+import cftime
+import numpy as np
+import pytest
+import xarray as xr
+
+pytest.importorskip('h5py')
+pytest.importorskip('fsspec')
+
+from esm4ppe import virtual
+from esm4ppe.virtual import build_virtualensemble, read_chunkrefs
+
+
+def _write_file(path, member, year0, data):
+    nt = data.shape[0]
+    bnds = [cftime.DatetimeNoLeap(year0+i//12, i % 12+1, 1) for i in range(nt+1)]
+    time = [bnds[i]+(bnds[i+1]-bnds[i])/2 for i in range(nt)]
+    ds = xr.Dataset({'thetao': (('time', 'zl', 'yh', 'xh'), data),
+                     'time_bnds': (('time', 'nv'), np.array([bnds[:-1], bnds[1:]]).T)},
+                    coords={'time': time, 'nv': [1, 2], 'zl': [2.5, 10.], 'yh': np.arange(3.), 'xh': np.arange(4.)},
+                    attrs={'title': 'ESM4_piControl_D-ensemble-01230101-'+str(member).zfill(2)})
+    ds['thetao'].encoding = {'chunksizes': (12, 1, 3, 4), 'zlib': True}
+    ds.to_netcdf(path)
+
+
+def test_virtualensemble_with_depth(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    data = {}
+    paths = []
+    for member in [1, 2]:
+        data[member] = rng.normal(size=(24, 2, 3, 4)).astype('f4')
+        for year0, part in [(123, slice(0, 12)), (124, slice(12, 24))]:
+            path = str(tmp_path/'{}.{}.nc'.format(member, year0))
+            _write_file(path, member, year0, data[member][part])
+            paths.append(path)
+    assert read_chunkrefs(paths[0], 'thetao')['dims'] == ['time', 'zl', 'yh', 'xh']
+    monkeypatch.setattr(virtual, 'get_paths_esm4ppe', lambda *args: paths)
+    monkeypatch.setattr(virtual, 'get_headerindexpath', lambda *args: None)
+    refs = build_virtualensemble('thetao', 'monthly', save=False)
+    ds = xr.open_dataset('reference://', engine='zarr', chunks={},
+                         backend_kwargs={'consolidated': False, 'storage_options': {'fo': refs}})
+    assert ds['thetao'].dims == ('init', 'member', 'lead', 'zl', 'yh', 'xh')
+    assert list(ds['zl'].values) == [2.5, 10.]
+    np.testing.assert_array_equal(ds['thetao'].isel(init=0).values, np.stack([data[1], data[2]]))
+
+
+def test_chunkrefs_require_time_first(tmp_path):
+    path = str(tmp_path/'static.nc')
+    xr.Dataset({'areacello': (('yh', 'xh'), np.ones((3, 4)))}).to_netcdf(path)
+    with pytest.raises(Exception, match='time as the first dimension'):
+        read_chunkrefs(path, 'areacello')
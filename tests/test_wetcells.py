@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from esm4ppe.masks import compress_wetcells, expand_wetcells
+
+
+def _ocean(ny=5, nx=7):
+    rng = np.random.default_rng(0)
+    coords = {'yh': np.arange(ny)+0.5, 'xh': np.arange(nx)+0.5}
+    wet = rng.uniform(size=(ny, nx)) > 0.3
+    static = xr.Dataset({'wet': (('yh', 'xh'), wet.astype('f4'))}, coords=coords)
+    data = np.where(wet, rng.normal(size=(4, ny, nx)), np.nan)
+    ds = xr.Dataset({'tos': (('lead', 'yh', 'xh'), data, {'units': 'degC'}),
+                     'lead_bnds': (('lead', 'nv'), np.arange(8).reshape(4, 2))},
+                    coords=dict(coords, lead=np.arange(1, 5)))
+    return ds, static, wet
+
+
+def test_wetcells_round_trip(tmp_path):
+    ds, static, wet = _ocean()
+    compressed = compress_wetcells(ds.chunk({'lead': 2}), static)
+    assert compressed['tos'].dims == ('lead', 'cell')
+    assert compressed.sizes['cell'] == wet.sum()
+    np.testing.assert_array_equal(compressed['tos'], ds['tos'].values[:, wet])
+    xr.testing.assert_identical(compressed['lead_bnds'], ds['lead_bnds'])
+    # Through a store, expanded with the static grid and with the retained grid coordinates
+    compressed.to_zarr(str(tmp_path/'store'))
+    compressed = xr.open_zarr(str(tmp_path/'store'))
+    for expanded in [expand_wetcells(compressed, static), expand_wetcells(compressed)]:
+        xr.testing.assert_identical(expanded['tos'].transpose(*ds['tos'].dims).compute(), ds['tos'])
+
+
+def test_wetcells_dataarray_other_order():
+    ds, static, wet = _ocean()
+    da = ds['tos'].transpose('yh', 'lead', 'xh')
+    compressed = compress_wetcells(da, static)
+    assert compressed.name == 'tos'
+    xr.testing.assert_identical(expand_wetcells(compressed, static).transpose(*ds['tos'].dims), ds['tos'])
+    # A DataArray does not keep the grid coordinates
+    with pytest.raises(Exception, match='provide the static grid'):
+        expand_wetcells(compressed)
@@ -1,24 +1,24 @@
 #!/nbhome/gam/miniconda3/envs/climpred_clean/bin/python
 # Python file to preprocess data for a number of variables
-import esm4ppe
+import esm4ppe.pipeline
 
 variables = ['tos','sos','intpp'] # Sea surface temperature, salinity, and depth-integrated primary production
 frequency = 'monthly'
 
-# Note, occasionally, dmget will fail on a few files. If this happens, the add_* command will fail. This is a
-# system error and can't be avoided. The issue_dmget command has to be reissued until all of the files are
-# succesfully retrieved from tape.
+# Note, occasionally, dmget will fail on a few files. The pipeline tracks each file it requested,
+# checking the disk with a backoff, and reissues the dmget for files still on tape after [retrytime]
+# seconds. Files still missing after [maxretries] reissues raise a RecallError; the other variables
+# are still converted, and the pipeline then raises an error listing the variables that failed.
+# Rerunning the script retries only those.
 
-# While this script is running, issuing other dmget commands will confuse the waiting function of issue_dmget
-# (which simply checks fo the user's name in the dmget queue.
+# The pipeline issues dmgets for the next [nahead] variables while earlier variables are being 
+# converted to zarr, and converts each variable as soon as all of its files are on disk. The ensemble
+# is written one initialization at a time, so rerunning this script after an interruption resumes
+# where it stopped.
 
-# An alternative approach is the issue all of the dmget's at once, with `wait=False` (this can be done in a 
-# notebook rather than as a batch job) and once all of the data is retrieved, run this script to do just the
-# processing of ensemble and control data (i.e. comment out the issue_dmget command).
+# The same can be done from the command line with:
+#     python -m esm4ppe.pipeline tos sos intpp --frequency monthly
 
-for variable in variables:
-    print(variable)
-    es = esm4ppe.esm4ppeObj(variable,frequency)
-    es.issue_dmget(wait=True)
-    # open the ensemble and the control, save to zarr
-    es = es.add_ensemble(triggeropen=True).add_control(triggeropen=True)
\ No newline at end of file
+# The guard is needed because the file headers are read by spawned processes, which import this script
+if __name__ == '__main__':
+    esm4ppe.pipeline.run_pipeline(variables,frequency,nahead=2)